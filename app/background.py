@@ -0,0 +1,197 @@
+"""
+Procesamiento de mensajes en segundo plano con respuestas proactivas
+
+Con ``BACKGROUND_PROCESSING=true`` el endpoint ``/api/messages`` responde en cuanto
+el mensaje queda encolado, en lugar de esperar la respuesta RAG completa:
+
+1. Se guarda la ``ConversationReference`` de la actividad y la identidad del turno
+2. Un pool acotado de workers asyncio atiende la cola (``BACKGROUND_WORKERS``)
+3. Cada trabajo abre un turno proactivo con ``adapter.continue_conversation`` y
+   entrega la respuesta en la conversación original (con streaming si está activo)
+4. Al apagar, ``drain()`` deja de aceptar trabajos y espera a los pendientes
+
+``ActivityDeduplicator`` descarta las actividades que el canal reenvía con el mismo
+id (reintentos por timeout), tanto en modo inline como en segundo plano.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, List, Optional
+
+from botbuilder.core import BotAdapter, TurnContext
+from botbuilder.schema import Activity
+
+logger = logging.getLogger(__name__)
+
+# handler(turn_context, activity): turn_context es el turno proactivo, activity el mensaje original
+TurnHandler = Callable[[TurnContext, Activity], Awaitable[None]]
+
+
+class ActivityDeduplicator:
+    """
+    Recuerda los ids de actividad vistos durante ttl_seconds (LRU acotado)
+    """
+
+    def __init__(self, ttl_seconds: float = 600, max_entries: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._seen: "OrderedDict[str, float]" = OrderedDict()
+        self.duplicates = 0
+
+    def is_duplicate(self, activity_id: Optional[str]) -> bool:
+        """True si el id ya se vio; en caso contrario lo registra"""
+        if not activity_id:
+            return False
+        now = time.monotonic()
+        # Los más antiguos están al principio: se expiran en orden
+        while self._seen:
+            oldest_id, seen_at = next(iter(self._seen.items()))
+            if now - seen_at < self.ttl_seconds and len(self._seen) < self.max_entries:
+                break
+            self._seen.pop(oldest_id)
+        if activity_id in self._seen:
+            self.duplicates += 1
+            return True
+        self._seen[activity_id] = now
+        return False
+
+
+class _Job:
+    __slots__ = ("reference", "claims_identity", "activity", "handler", "enqueued_at")
+
+    def __init__(self, reference, claims_identity, activity: Activity, handler: TurnHandler):
+        self.reference = reference
+        self.claims_identity = claims_identity
+        self.activity = activity
+        self.handler = handler
+        self.enqueued_at = time.monotonic()
+
+
+class BackgroundTurnProcessor:
+    """
+    Cola acotada + pool de workers que responden mediante mensajes proactivos
+
+    Args:
+        adapter: Adaptador del bot (BotFrameworkAdapter o CloudAdapter)
+        workers: Turnos proactivos en curso como máximo
+        max_queue: Trabajos en espera como máximo; con la cola llena submit() devuelve False
+        drain_timeout: Segundos que drain() espera a los trabajos pendientes
+    """
+
+    def __init__(self, adapter: BotAdapter, workers: int = 8, max_queue: int = 200, drain_timeout: float = 30.0):
+        self.adapter = adapter
+        self.workers = workers
+        self.max_queue = max_queue
+        self.drain_timeout = drain_timeout
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._accepting = True
+        self.in_flight = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def _ensure_started(self):
+        # La cola y los workers se crean en el loop que sirve las peticiones
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._tasks = [
+                asyncio.ensure_future(self._worker(number)) for number in range(self.workers)
+            ]
+            logger.info(f"Background processing started with {self.workers} workers")
+
+    def submit(self, turn_context: TurnContext, handler: TurnHandler) -> bool:
+        """
+        Encola la actividad del turno; devuelve False si no se aceptó (cola llena o
+        apagando) y el llamador debe procesarla inline
+        """
+        if not self._accepting:
+            self.rejected += 1
+            return False
+        self._ensure_started()
+        activity = turn_context.activity
+        job = _Job(
+            TurnContext.get_conversation_reference(activity),
+            turn_context.turn_state.get(BotAdapter.BOT_IDENTITY_KEY),
+            activity,
+            handler
+        )
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            logger.warning("Background queue is full; processing the activity inline")
+            return False
+        self.submitted += 1
+        return True
+
+    async def _worker(self, number: int):
+        while True:
+            job = await self._queue.get()
+            self.in_flight += 1
+            try:
+                await self._run(job)
+                self.completed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Background turn failed: {e}", exc_info=True)
+            finally:
+                self.in_flight -= 1
+                self._queue.task_done()
+
+    async def _run(self, job: _Job):
+        async def callback(turn_context: TurnContext):
+            # La actividad de continuación tiene un id nuevo; con el del mensaje original
+            # las respuestas quedan enlazadas a él (replyToId) igual que en modo inline
+            turn_context.activity.id = job.activity.id
+            await job.handler(turn_context, job.activity)
+
+        # Con la identidad del turno original ambos adaptadores crean el conector
+        # correcto, también en modo anónimo (sin app id)
+        await self.adapter.continue_conversation(
+            job.reference,
+            callback,
+            claims_identity=job.claims_identity
+        )
+
+    async def drain(self, *args):
+        """
+        Deja de aceptar trabajos y espera a los pendientes durante drain_timeout
+
+        Acepta argumentos posicionales para poder registrarse como handler on_cleanup de aiohttp.
+        """
+        self._accepting = False
+        if self._queue is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=self.drain_timeout)
+            logger.info("Background queue drained")
+        except asyncio.TimeoutError:
+            logger.warning(f"Background drain timed out with {self._queue.qsize() + self.in_flight} jobs pending")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "in_flight": self.in_flight,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected
+        }
+
+
+def build_background_processor(adapter: BotAdapter, app_settings) -> BackgroundTurnProcessor:
+    """Crea el procesador configurado en AppSettings"""
+    return BackgroundTurnProcessor(
+        adapter,
+        workers=app_settings.background_workers,
+        max_queue=app_settings.background_max_queue,
+        drain_timeout=app_settings.background_drain_timeout_seconds
+    )
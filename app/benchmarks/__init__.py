@@ -0,0 +1,7 @@
+"""
+Offline benchmarks for the bot
+
+Everything in this package runs without network access: Azure OpenAI and the Bot
+Connector are replaced by a local fake server (``fake_azure``), so results can be
+reproduced on a laptop or in CI.
+"""
@@ -0,0 +1,145 @@
+"""
+Offline benchmark of context compression
+
+Chunks the bundled sample corpus (``app/benchmarks/data/compression``: internal
+policy documents, one of them also present as a near-identical wiki copy) with the
+ingestion chunker, retrieves ``--top-k`` chunks per question with BM25 and builds
+the grounded prompt with and without ``ContextCompressor``. The report has, per
+mode, the document and prompt tokens per question, the reduction, the evidence
+recall (questions whose expected answer phrases are still in the prompt) and the
+compression time. No network access is needed.
+
+Usage:
+    python -m app.benchmarks.compression
+    python -m app.benchmarks.compression --top-k 10 --max-document-tokens 200 --output compression.json
+"""
+import argparse
+import asyncio
+import glob
+import json
+import logging
+import os
+import sys
+import time
+from typing import List
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from app.services.context_compression import MODES, ContextCompressor
+from app.services.ingestion import chunk_text
+from app.services.prompt_assembly import PromptAssembler, Tokenizer, format_sources
+from app.services.retrieval.base import RetrievedDocument
+from app.services.retrieval.bm25 import BM25Index, tokenize
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "compression")
+
+SYSTEM_PROMPT = "You are an AI assistant that helps people find information from their documents."
+
+
+def load_chunks(directory: str, chunk_size: int, chunk_overlap: int) -> List[RetrievedDocument]:
+    """Chunks of every Markdown document in directory/docs"""
+    chunks = []
+    for path in sorted(glob.glob(os.path.join(directory, "docs", "*.md"))):
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        name = os.path.basename(path)
+        title = text.splitlines()[0].lstrip("# ").strip() if text.strip() else name
+        for number, content in enumerate(chunk_text(text, chunk_size, chunk_overlap)):
+            chunks.append(RetrievedDocument(id=f"{name}-{number}", content=content, title=title, filepath=name))
+    return chunks
+
+
+def load_questions(directory: str) -> List[dict]:
+    with open(os.path.join(directory, "questions.jsonl"), encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def has_evidence(prompt_text: str, evidence: List[str]) -> bool:
+    """Every expected phrase is in the prompt (accent- and case-insensitive)"""
+    text = f" {' '.join(tokenize(prompt_text))} "
+    return all(f" {' '.join(tokenize(phrase))} " in text for phrase in evidence)
+
+
+async def run_mode(mode: str, args, chunks: List[RetrievedDocument], questions: List[dict]) -> dict:
+    tokenizer = Tokenizer(args.encoding)
+    assembler = PromptAssembler(tokenizer, documents_budget=args.documents_budget)
+    compressor = ContextCompressor(
+        tokenizer,
+        mode=mode,
+        simhash_distance=args.simhash_distance,
+        max_document_tokens=args.max_document_tokens,
+        min_sentences=args.min_sentences
+    )
+    index = BM25Index([chunk.content for chunk in chunks])
+    document_tokens, prompt_tokens, compression_ms = [], [], []
+    recalled = 0
+    for item in questions:
+        documents = [chunks[row] for row, _ in index.search(item["question"], args.top_k)]
+        started = time.perf_counter()
+        compressed = compressor.compress(item["question"], documents)
+        compression_ms.append((time.perf_counter() - started) * 1000)
+        prompt = await assembler.assemble(
+            SYSTEM_PROMPT,
+            item["question"],
+            documents=compressed.documents,
+            format_sources=format_sources
+        )
+        document_tokens.append(compressed.tokens_after)
+        prompt_tokens.append(prompt.total_tokens)
+        if has_evidence(prompt.messages[0]["content"], item["evidence"]):
+            recalled += 1
+    count = len(questions)
+    return {
+        "avg_document_tokens": round(sum(document_tokens) / count, 1),
+        "avg_prompt_tokens": round(sum(prompt_tokens) / count, 1),
+        "evidence_recall": round(recalled / count, 4),
+        "avg_compression_ms": round(sum(compression_ms) / count, 3),
+        "near_duplicates": compressor.duplicates,
+        "sentences_dropped": compressor.sentences_dropped
+    }
+
+
+async def run(args) -> dict:
+    chunks = load_chunks(args.data_dir, args.chunk_size, args.chunk_overlap)
+    questions = load_questions(args.data_dir)
+    modes = {mode: await run_mode(mode, args, chunks, questions) for mode in MODES}
+    baseline = modes["off"]["avg_prompt_tokens"]
+    for result in modes.values():
+        result["prompt_reduction"] = round(1 - result["avg_prompt_tokens"] / baseline, 4) if baseline else 0.0
+    return {
+        "chunks": len(chunks),
+        "questions": len(questions),
+        "top_k": args.top_k,
+        "tokenizer": Tokenizer(args.encoding).backend,
+        "modes": modes
+    }
+
+
+def main(argv=None):
+    """Parse arguments, run the benchmark and print the JSON report"""
+    parser = argparse.ArgumentParser(description="Offline benchmark of context compression")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="Directory with docs/*.md and questions.jsonl")
+    parser.add_argument("--top-k", type=int, default=5, help="RETRIEVAL_TOP_K")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="INGEST_CHUNK_SIZE")
+    parser.add_argument("--chunk-overlap", type=int, default=200, help="INGEST_CHUNK_OVERLAP")
+    parser.add_argument("--documents-budget", type=int, default=3000, help="PROMPT_DOCUMENTS_BUDGET")
+    parser.add_argument("--simhash-distance", type=int, default=3)
+    parser.add_argument("--max-document-tokens", type=int, default=300)
+    parser.add_argument("--min-sentences", type=int, default=2)
+    parser.add_argument("--encoding", default="cl100k_base", help="tiktoken encoding; empty = character estimate")
+    parser.add_argument("--output", help="Also write the report to this JSON file")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
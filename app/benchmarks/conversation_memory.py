@@ -0,0 +1,49 @@
+"""
+Memory footprint of the in-process conversation history store
+
+Fills a fresh ``MemoryConversationStore`` with synthetic conversations and reports
+its size, including the bytes used per thousand active conversations. No network
+access is needed.
+
+Usage:
+    python -m app.benchmarks.conversation_memory
+    python -m app.benchmarks.conversation_memory --conversations 10000 --turns 20 --message-chars 400
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from app.services.conversation_store import MemoryConversationStore
+
+
+def measure_memory_per_thousand(conversations: int = 1000, turns: int = 10, message_chars: int = 200) -> dict:
+    """Fill a fresh in-memory store with synthetic conversations and report its footprint"""
+    store = MemoryConversationStore(token_budget=10 ** 9, max_conversations=conversations)
+    text = "x" * message_chars
+
+    async def _fill():
+        for index in range(conversations):
+            for turn in range(turns):
+                await store.append(f"conversation-{index}", "user" if turn % 2 == 0 else "assistant", f"{turn}{text}")
+
+    asyncio.run(_fill())
+    return {"conversations": conversations, "turns_per_conversation": turns, **store.stats()}
+
+
+def main(argv=None):
+    """Parse arguments, fill the store and print the JSON report"""
+    parser = argparse.ArgumentParser(description="Memory footprint of the conversation history store")
+    parser.add_argument("--conversations", type=int, default=1000)
+    parser.add_argument("--turns", type=int, default=10, help="Turns per conversation")
+    parser.add_argument("--message-chars", type=int, default=200)
+    args = parser.parse_args(argv)
+    report = measure_memory_per_thousand(args.conversations, args.turns, args.message_chars)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""
+Local fake of the Azure services the bot calls
+
+One aiohttp app stands in for both outbound dependencies of a turn:
+
+1. Azure OpenAI chat completions (``/openai/deployments/{deployment}/chat/completions``),
+   JSON or server-sent events, with configurable latency per response and per
+   streamed token, and 429 injection with a ``retry-after-ms`` header
+2. The Bot Connector (``/v3/conversations/...``), which accepts replies and in-place
+   updates and records when the first reply to each incoming activity arrived
+
+Point ``AZURE_OPENAI_ENDPOINT`` and the activities' ``serviceUrl`` at it. Runs
+standalone with ``python -m app.benchmarks.fake_azure --port 8765``.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Dict
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class FakeAzureConfig:
+    """Behaviour of the fake server"""
+    latency_ms: float = 200.0  # before the response (or the first streamed token)
+    token_delay_ms: float = 20.0  # between streamed tokens
+    answer_tokens: int = 40  # words in every answer
+    rate_limit_ratio: float = 0.0  # fraction of completions answered with 429
+    retry_after_ms: int = 500
+    seed: int = 42
+
+
+class FakeAzureServer:
+    """
+    Fake Azure OpenAI + Bot Connector server
+
+    Args:
+        config: Latency, answer size and 429 injection settings
+    """
+
+    def __init__(self, config: FakeAzureConfig = None):
+        self.config = config or FakeAzureConfig()
+        self._random = random.Random(self.config.seed)
+        self.completions = 0
+        self.streamed_completions = 0
+        self.rate_limited = 0
+        self.replies = 0
+        self.updates = 0
+        # replyToId -> perf_counter() of the first message reply (typing indicators do not
+        # count), read by the load generator
+        self.first_reply_at: Dict[str, float] = {}
+        self._runner = None
+        self.port = None
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/openai/deployments/{deployment}/chat/completions", self.chat_completions)
+        app.router.add_post("/v3/conversations/{conversation_id}/activities", self.send_to_conversation)
+        app.router.add_post("/v3/conversations/{conversation_id}/activities/{activity_id}", self.reply_to_activity)
+        app.router.add_put("/v3/conversations/{conversation_id}/activities/{activity_id}", self.update_activity)
+        app.router.add_get("/stats", self.stats_handler)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Serve in the running event loop; returns the base URL"""
+        self._runner = web.AppRunner(self.build_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{self.port}"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def _answer_words(self, question: str):
+        words = ["Según", "la", "documentación", "[doc1]", "la", "respuesta", "a", f"'{question[:40]}'", "es"]
+        while len(words) < self.config.answer_tokens:
+            words.append(f"detalle{len(words)}")
+        return words[:max(self.config.answer_tokens, 1)]
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        if self.config.rate_limit_ratio and self._random.random() < self.config.rate_limit_ratio:
+            self.rate_limited += 1
+            return web.json_response(
+                {"error": {"code": "429", "message": "Rate limit is exceeded."}},
+                status=429,
+                headers={"retry-after-ms": str(self.config.retry_after_ms)}
+            )
+
+        self.completions += 1
+        question = body["messages"][-1]["content"] if body.get("messages") else ""
+        words = self._answer_words(question)
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in body.get("messages", [])) // 4
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        citations = [{"title": "Manual de usuario", "filepath": "manual.md", "url": "", "content": "Texto de ejemplo"}]
+        await asyncio.sleep(self.config.latency_ms / 1000)
+
+        if not body.get("stream"):
+            return web.json_response({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.match_info["deployment"],
+                "choices": [{
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": " ".join(words), "context": {"citations": citations}}
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": len(words),
+                    "total_tokens": prompt_tokens + len(words)
+                }
+            })
+
+        self.streamed_completions += 1
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        async def event(delta: dict, finish_reason=None):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": request.match_info["deployment"],
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            }
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+
+        await event({"role": "assistant", "context": {"citations": citations}})
+        for number, word in enumerate(words):
+            if number:
+                await asyncio.sleep(self.config.token_delay_ms / 1000)
+            await event({"content": word if number == 0 else f" {word}"})
+        await event({}, finish_reason="stop")
+        if (body.get("stream_options") or {}).get("include_usage"):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": request.match_info["deployment"],
+                "choices": [],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": len(words),
+                    "total_tokens": prompt_tokens + len(words)
+                }
+            }
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    def _record_reply(self, activity: dict, reply_to_id: str):
+        self.replies += 1
+        if activity.get("type") != "message":
+            return
+        if reply_to_id and reply_to_id not in self.first_reply_at:
+            self.first_reply_at[reply_to_id] = time.perf_counter()
+
+    async def send_to_conversation(self, request: web.Request) -> web.Response:
+        activity = await request.json()
+        self._record_reply(activity, activity.get("replyToId"))
+        return web.json_response({"id": uuid.uuid4().hex})
+
+    async def reply_to_activity(self, request: web.Request) -> web.Response:
+        activity = await request.json()
+        self._record_reply(activity, request.match_info["activity_id"])
+        return web.json_response({"id": uuid.uuid4().hex})
+
+    async def update_activity(self, request: web.Request) -> web.Response:
+        await request.read()
+        self.updates += 1
+        return web.json_response({"id": request.match_info["activity_id"]})
+
+    def stats(self) -> dict:
+        return {
+            "completions": self.completions,
+            "streamed_completions": self.streamed_completions,
+            "rate_limited": self.rate_limited,
+            "replies": self.replies,
+            "updates": self.updates
+        }
+
+    async def stats_handler(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats())
+
+
+def main(argv=None):
+    """Run the fake server standalone"""
+    parser = argparse.ArgumentParser(description="Fake Azure OpenAI and Bot Connector server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=FakeAzureConfig.latency_ms)
+    parser.add_argument("--token-delay-ms", type=float, default=FakeAzureConfig.token_delay_ms)
+    parser.add_argument("--answer-tokens", type=int, default=FakeAzureConfig.answer_tokens)
+    parser.add_argument("--rate-limit-ratio", type=float, default=FakeAzureConfig.rate_limit_ratio)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    server = FakeAzureServer(FakeAzureConfig(
+        latency_ms=args.latency_ms,
+        token_delay_ms=args.token_delay_ms,
+        answer_tokens=args.answer_tokens,
+        rate_limit_ratio=args.rate_limit_ratio
+    ))
+    web.run_app(server.build_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
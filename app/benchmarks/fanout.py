@@ -0,0 +1,133 @@
+"""
+Offline benchmark of multi-index fan-out retrieval
+
+Builds ``--indexes`` fake search indexes (app.services.retrieval.fake), one of them
+with a heavy latency tail, and runs the same queries through ``FanOutRetriever``
+twice: waiting for every index, and with the latency budget. The report has
+p50/p95/p99 retrieval latency of both runs, the fraction of queries answered
+without every index, the overlap of the budgeted results with the complete ones
+and the per-index counters. No network access is needed.
+
+Usage:
+    python -m app.benchmarks.fanout
+    python -m app.benchmarks.fanout --indexes 6 --slow-ratio 0.2 --budget-ms 300 --output fanout.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+from typing import List
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from app.services.retrieval.fake import SYNTHETIC_TOPICS, FakeSearchRetriever
+from app.services.retrieval.fanout import FanOutIndex, FanOutRetriever
+
+logger = logging.getLogger(__name__)
+
+
+def _percentiles(values: List[float]) -> dict:
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 1) if ordered else 0.0
+
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99)}
+
+
+def build_retriever(args, latency_budget_ms: float) -> FanOutRetriever:
+    """Fake indexes with the same seeds for every run, so both runs see the same latencies"""
+    indexes = []
+    for number in range(args.indexes):
+        slow = number == args.indexes - 1
+        indexes.append(FanOutIndex(
+            name=f"index-{number}",
+            retriever=FakeSearchRetriever(
+                f"index-{number}",
+                latency_ms=args.latency_ms,
+                jitter_ms=args.jitter_ms,
+                slow_ratio=args.slow_ratio if slow else 0.0,
+                slow_latency_ms=args.slow_latency_ms,
+                seed=number
+            ),
+            timeout_ms=args.timeout_ms
+        ))
+    return FanOutRetriever(indexes, latency_budget_ms=latency_budget_ms, candidates=args.candidates)
+
+
+async def run_queries(retriever: FanOutRetriever, queries: List[str], top_k: int, concurrency: int):
+    """Latencies (ms) and results of every query"""
+    latencies = [0.0] * len(queries)
+    results = [None] * len(queries)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(position: int, query: str):
+        async with semaphore:
+            started = time.perf_counter()
+            results[position] = await retriever.retrieve(query, top_k)
+            latencies[position] = (time.perf_counter() - started) * 1000
+
+    await asyncio.gather(*(one(position, query) for position, query in enumerate(queries)))
+    return latencies, results
+
+
+async def run(args) -> dict:
+    rng = random.Random(args.seed)
+    vocabulary = " ".join(SYNTHETIC_TOPICS.values()).split()
+    queries = [" ".join(rng.sample(vocabulary, 3)) for _ in range(args.queries)]
+
+    complete = build_retriever(args, latency_budget_ms=0)
+    complete_ms, complete_results = await run_queries(complete, queries, args.top_k, args.concurrency)
+    budgeted = build_retriever(args, latency_budget_ms=args.budget_ms)
+    budgeted_ms, budgeted_results = await run_queries(budgeted, queries, args.top_k, args.concurrency)
+
+    overlaps = []
+    for full, partial in zip(complete_results, budgeted_results):
+        full_ids = {document.id for document in full}
+        if full_ids:
+            overlaps.append(len(full_ids & {document.id for document in partial}) / len(full_ids))
+    return {
+        "queries": len(queries),
+        "indexes": args.indexes,
+        "budget_ms": args.budget_ms,
+        "wait_for_all_ms": _percentiles(complete_ms),
+        "budgeted_ms": _percentiles(budgeted_ms),
+        "partial_ratio": round(budgeted.stats.partial / len(queries), 4),
+        "mean_overlap_with_complete": round(sum(overlaps) / len(overlaps), 4) if overlaps else None,
+        "index_stats": budgeted.stats.as_dict()["indexes"]
+    }
+
+
+def main(argv=None):
+    """Parse arguments, run the benchmark and print the JSON report"""
+    parser = argparse.ArgumentParser(description="Offline benchmark of multi-index fan-out retrieval")
+    parser.add_argument("--indexes", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--candidates", type=int, default=10)
+    parser.add_argument("--latency-ms", type=float, default=40.0, help="Base latency of every index")
+    parser.add_argument("--jitter-ms", type=float, default=40.0)
+    parser.add_argument("--slow-ratio", type=float, default=0.1, help="Slow queries on the last index")
+    parser.add_argument("--slow-latency-ms", type=float, default=1000.0)
+    parser.add_argument("--timeout-ms", type=float, default=1500.0, help="Per-index timeout")
+    parser.add_argument("--budget-ms", type=float, default=200.0, help="Latency budget of the budgeted run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Also write the report to this JSON file")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+"""
+Offline load test for the bot endpoints
+
+Starts the fake Azure server in-process, launches the bot as a subprocess pointed at
+it (no network access and no real credentials needed), and fires synthetic Teams
+message activities at ``/api/messages``:
+
+1. ``bot_app``: ``app.bot_app`` served by ``app.server`` (aiohttp)
+2. ``official``: ``teams_bot_official.py`` (CloudAdapter)
+
+Each conversation sends its messages in sequence; up to ``--concurrency``
+conversations are in flight at once. The report contains p50/p95/p99 request
+latency, time to the first reply seen by the fake Bot Connector, throughput,
+bot process memory per concurrent conversation, the bot's own ``/metrics`` stage
+histograms and the fake server counters. It is written as JSON, and with
+``--baseline`` the run fails when latency or throughput regressed.
+
+Usage:
+    python -m app.benchmarks.loadtest --conversations 200 --concurrency 50 --output results.json
+    python -m app.benchmarks.loadtest --target official --rate-limit-ratio 0.1 --no-stream
+    python -m app.benchmarks.loadtest --baseline results.json --max-regression 0.2
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import List, Optional
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(ROOT)
+
+from app.benchmarks.fake_azure import FakeAzureConfig, FakeAzureServer  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+TARGETS = ("bot_app", "official")
+
+QUESTIONS = [
+    "¿Cómo solicito vacaciones?",
+    "¿Cuál es la política de teletrabajo?",
+    "¿Dónde encuentro el manual de onboarding?",
+    "¿Cómo configuro la VPN?",
+    "¿Quién aprueba los gastos de viaje?"
+]
+
+
+def percentiles(values: List[float]) -> dict:
+    """Exact p50/p95/p99, mean and max of a list of milliseconds"""
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "mean": 0.0, "max": 0.0}
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return {
+        "p50": round(pick(0.50), 2),
+        "p95": round(pick(0.95), 2),
+        "p99": round(pick(0.99), 2),
+        "mean": round(sum(ordered) / len(ordered), 2),
+        "max": round(ordered[-1], 2)
+    }
+
+
+def rss_bytes(pid: int) -> Optional[int]:
+    """Resident memory of a process (Linux /proc); None where unavailable"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def build_activity(service_url: str, conversation: int, number: int, text: str) -> dict:
+    """Synthetic Teams message activity"""
+    return {
+        "type": "message",
+        "id": uuid.uuid4().hex,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "channelId": "msteams",
+        "serviceUrl": service_url,
+        "from": {"id": f"user-{conversation}", "name": f"Usuario {conversation}"},
+        "recipient": {"id": "bot", "name": "Teams RAG Bot"},
+        "conversation": {"id": f"conversation-{conversation}", "conversationType": "personal"},
+        "text": text,
+        "locale": "es-ES"
+    }
+
+
+def bot_environment(fake_url: str, port: int, args) -> dict:
+    """Environment that points the bot at the fake server and disables outbound auth"""
+    env = dict(os.environ)
+    env.update({
+        "AZURE_OPENAI_ENDPOINT": fake_url,
+        "AZURE_OPENAI_API_KEY": "offline-load-test",
+        "AZURE_OPENAI_GPT_DEPLOYMENT": "gpt-loadtest",
+        "AZURE_SEARCH_SERVICE_URL": fake_url,
+        "AZURE_SEARCH_INDEX_NAME": "loadtest",
+        "MicrosoftAppId": "",
+        "MicrosoftAppPassword": "",
+        "WEB_HOST": "127.0.0.1",
+        "WEB_PORT": str(port),
+        "STREAM_RESPONSES": "true" if args.stream else "false",
+        "STREAM_FLUSH_INTERVAL": str(args.flush_interval),
+        "ANSWER_CACHE_ENABLED": "true" if args.answer_cache else "false",
+        "EMBEDDING_BACKEND": "hashing",
+        "EMBEDDING_CACHE_DIR": "",
+        "HISTORY_BACKEND": "memory",
+        "METRICS_ENABLED": "true",
+        "BACKGROUND_PROCESSING": "true" if args.background else "false",
+        "PYTHONUNBUFFERED": "1"
+    })
+    if args.endpoints > 1:
+        # Several pool endpoints on the same fake server, to exercise routing and hedging
+        env["AZURE_OPENAI_ENDPOINTS"] = json.dumps([
+            {"name": f"region-{number}", "endpoint": fake_url, "api_key": "offline-load-test"}
+            for number in range(args.endpoints)
+        ])
+    return env
+
+
+def bot_command(target: str, port: int) -> List[str]:
+    if target == "bot_app":
+        return [sys.executable, "-m", "app.server", "--host", "127.0.0.1", "--port", str(port), "--workers", "1"]
+    return [sys.executable, os.path.join(ROOT, "teams_bot_official.py")]
+
+
+async def wait_until_ready(session: aiohttp.ClientSession, url: str, process: subprocess.Popen, timeout: float = 60.0):
+    """Poll the bot until it accepts HTTP connections (any status counts)"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Bot process exited with code {process.returncode} before becoming ready")
+        try:
+            async with session.get(url):
+                return
+        except aiohttp.ClientError:
+            await asyncio.sleep(0.2)
+    raise TimeoutError(f"Bot at {url} did not become ready in {timeout:.0f}s")
+
+
+async def run_target(target: str, fake: FakeAzureServer, fake_url: str, args) -> dict:
+    """Launch one bot, drive the load and collect the report"""
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    log_file = open(os.path.join(args.log_dir, f"loadtest-{target}.log"), "w") if args.log_dir else subprocess.DEVNULL
+    process = subprocess.Popen(
+        bot_command(target, port),
+        cwd=ROOT,
+        env=bot_environment(fake_url, port, args),
+        stdout=log_file,
+        stderr=subprocess.STDOUT
+    )
+    service_url = f"{fake_url}/"
+    latencies: List[float] = []
+    first_reply: List[float] = []
+    status_counts = {}
+    sent_at = {}
+    peak_rss = 0
+
+    try:
+        connector = aiohttp.TCPConnector(limit=args.concurrency)
+        timeout = aiohttp.ClientTimeout(total=args.request_timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            await wait_until_ready(session, base_url + "/", process)
+
+            # Warm-up turn: imports, client pools and first-call costs stay out of the numbers
+            warmup = build_activity(service_url, -1, 0, "warm up")
+            async with session.post(base_url + "/api/messages", json=warmup) as response:
+                await response.read()
+            baseline_rss = rss_bytes(process.pid)
+            fake_before = fake.stats()
+
+            semaphore = asyncio.Semaphore(args.concurrency)
+
+            async def conversation(index: int):
+                nonlocal peak_rss
+                async with semaphore:
+                    for number in range(args.messages):
+                        question = QUESTIONS[(index + number) % len(QUESTIONS)]
+                        if not args.repeat_questions:
+                            # Unique text keeps the answer cache and coalescing out of the measurement
+                            question = f"{question} (conversación {index}, mensaje {number})"
+                        activity = build_activity(service_url, index, number, question)
+                        started = time.perf_counter()
+                        sent_at[activity["id"]] = started
+                        try:
+                            async with session.post(base_url + "/api/messages", json=activity) as response:
+                                await response.read()
+                                status = response.status
+                        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                            status = type(e).__name__
+                        latencies.append((time.perf_counter() - started) * 1000)
+                        status_counts[str(status)] = status_counts.get(str(status), 0) + 1
+                    rss = rss_bytes(process.pid)
+                    if rss:
+                        peak_rss = max(peak_rss, rss)
+
+            started = time.perf_counter()
+            await asyncio.gather(*(conversation(index) for index in range(args.conversations)))
+            if args.background:
+                # Requests were only acknowledged; wait for the proactive replies
+                deadline = time.monotonic() + args.request_timeout
+                while time.monotonic() < deadline and any(a not in fake.first_reply_at for a in sent_at):
+                    await asyncio.sleep(0.05)
+            wall_seconds = time.perf_counter() - started
+
+            for activity_id, sent in sent_at.items():
+                replied = fake.first_reply_at.get(activity_id)
+                if replied is not None:
+                    first_reply.append((replied - sent) * 1000)
+
+            bot_metrics = None
+            try:
+                async with session.get(base_url + "/metrics") as response:
+                    if response.status == 200:
+                        bot_metrics = await response.json()
+            except aiohttp.ClientError:
+                pass
+            final_rss = rss_bytes(process.pid)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        if log_file is not subprocess.DEVNULL:
+            log_file.close()
+
+    fake_after = fake.stats()
+    requests = len(latencies)
+    succeeded = sum(count for status, count in status_counts.items() if status == "200")
+    memory = {"baseline_rss_mb": None, "final_rss_mb": None, "peak_rss_mb": None, "bytes_per_conversation": None}
+    if baseline_rss and final_rss:
+        peak_rss = max(peak_rss, final_rss)
+        memory = {
+            "baseline_rss_mb": round(baseline_rss / 2 ** 20, 1),
+            "final_rss_mb": round(final_rss / 2 ** 20, 1),
+            "peak_rss_mb": round(peak_rss / 2 ** 20, 1),
+            # Every conversation's history stays resident, so growth over the run is per conversation
+            "bytes_per_conversation": round(max(0, peak_rss - baseline_rss) / args.conversations)
+        }
+    history = ((bot_metrics or {}).get("components") or {}).get("history") or {}
+    if history.get("bytes_per_1k_conversations"):
+        memory["history_bytes_per_conversation"] = round(history["bytes_per_1k_conversations"] / 1000)
+
+    return {
+        "requests": requests,
+        "succeeded": succeeded,
+        "errors": requests - succeeded,
+        "status_counts": status_counts,
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput_rps": round(succeeded / wall_seconds, 2) if wall_seconds else 0.0,
+        "latency_ms": percentiles(latencies),
+        "first_reply_ms": percentiles(first_reply),
+        "memory": memory,
+        "fake_azure": {key: fake_after[key] - fake_before[key] for key in fake_after},
+        "bot_metrics": bot_metrics
+    }
+
+
+def compare(results: dict, baseline: dict, max_regression: float) -> List[str]:
+    """Regressions of p95/p99 latency or throughput beyond max_regression (a fraction)"""
+    problems = []
+    for target, current in results["targets"].items():
+        previous = baseline.get("targets", {}).get(target)
+        if not previous:
+            continue
+        for key in ("p95", "p99"):
+            before, after = previous["latency_ms"][key], current["latency_ms"][key]
+            if before and after > before * (1 + max_regression):
+                problems.append(f"{target}: latency {key} {before} ms -> {after} ms")
+        before, after = previous["throughput_rps"], current["throughput_rps"]
+        if before and after < before * (1 - max_regression):
+            problems.append(f"{target}: throughput {before} -> {after} req/s")
+    return problems
+
+
+async def run(args) -> dict:
+    fake = FakeAzureServer(FakeAzureConfig(
+        latency_ms=args.latency_ms,
+        token_delay_ms=args.token_delay_ms,
+        answer_tokens=args.answer_tokens,
+        rate_limit_ratio=args.rate_limit_ratio,
+        retry_after_ms=args.retry_after_ms
+    ))
+    fake_url = await fake.start()
+    targets = TARGETS if args.target == "both" else (args.target,)
+    results = {
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "config": {
+            key: value for key, value in vars(args).items()
+            if key not in ("output", "baseline", "log_dir")
+        },
+        "targets": {}
+    }
+    try:
+        for target in targets:
+            logger.info(f"Load testing {target}...")
+            results["targets"][target] = await run_target(target, fake, fake_url, args)
+    finally:
+        await fake.stop()
+    return results
+
+
+def main(argv=None):
+    """Parse arguments, run the load test and write the JSON report"""
+    parser = argparse.ArgumentParser(description="Offline load test for the bot endpoints")
+    parser.add_argument("--target", choices=TARGETS + ("both",), default="both")
+    parser.add_argument("--conversations", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=3, help="Messages per conversation")
+    parser.add_argument("--concurrency", type=int, default=20, help="Conversations in flight at once")
+    parser.add_argument("--latency-ms", type=float, default=FakeAzureConfig.latency_ms)
+    parser.add_argument("--token-delay-ms", type=float, default=FakeAzureConfig.token_delay_ms)
+    parser.add_argument("--answer-tokens", type=int, default=FakeAzureConfig.answer_tokens)
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="Fraction of completions answered with 429")
+    parser.add_argument("--retry-after-ms", type=int, default=FakeAzureConfig.retry_after_ms)
+    parser.add_argument("--stream", action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument("--flush-interval", type=float, default=0.25, help="STREAM_FLUSH_INTERVAL for the bot")
+    parser.add_argument("--answer-cache", action="store_true", help="Leave the answer cache enabled")
+    parser.add_argument(
+        "--background",
+        action="store_true",
+        help="BACKGROUND_PROCESSING=true: latency is the acknowledgement, first reply the answer"
+    )
+    parser.add_argument("--endpoints", type=int, default=1, help="Azure OpenAI endpoints in the pool (1 = no pool)")
+    parser.add_argument("--repeat-questions", action="store_true", help="Reuse a small pool of questions")
+    parser.add_argument("--request-timeout", type=float, default=120.0)
+    parser.add_argument("--output", default="loadtest-results.json")
+    parser.add_argument("--baseline", help="Earlier results file to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    parser.add_argument("--log-dir", help="Directory for the bot processes' logs")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    results = asyncio.run(run(args))
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    for target, report in results["targets"].items():
+        print(
+            f"{target}: {report['succeeded']}/{report['requests']} ok, {report['throughput_rps']} req/s, "
+            f"p50/p95/p99 {report['latency_ms']['p50']}/{report['latency_ms']['p95']}/{report['latency_ms']['p99']} ms, "
+            f"{report['memory']['bytes_per_conversation']} bytes/conversation"
+        )
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            problems = compare(results, json.load(f), args.max_regression)
+        for problem in problems:
+            print(f"REGRESSION {problem}")
+        if problems:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,45 @@
 """
 Flask Bot Application siguiendo patrones oficiales de Microsoft Bot Framework
+
+Los turnos se ejecutan siempre sobre un único event loop de larga duración por
+proceso. En modo Flask ese loop vive en un hilo de fondo y cada petición le envía
+su turno; en modo asíncrono (``create_async_app``) aiohttp sirve directamente
+sobre el mismo loop. Ver ``app.server`` para el lanzador multi-worker.
 """
 import asyncio
+import threading
 import traceback
-from flask import Flask, request, Response
-from botbuilder.core import BotFrameworkAdapter, BotFrameworkAdapterSettings, MessageFactory
+from aiohttp import web
+from botbuilder.core import BotFrameworkAdapter, BotFrameworkAdapterSettings, MessageFactory, TurnContext
 from botbuilder.schema import Activity
+from botframework.connector.auth import ClaimsIdentity, AuthenticationConstants
 import json
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from app.teams_bot import TeamsRAGBot
-from app.config import AppSettings
+from app.background import build_background_processor
+from app.fast_path import build_activity_fast_path
+from app.config import settings
+from app.services.registry import registry
+from app.services.metrics import PROMETHEUS_CONTENT_TYPE, SendTimingMixin, metrics, wants_prometheus
+from app.logging_setup import configure_logging, per_message
+from app.startup import startup
 import logging
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize Flask app
-app = Flask(__name__)
-
-# Load configuration
-settings = AppSettings()
+# Configuration: the same settings singleton as the rest of the app
+metrics.enabled = settings.metrics_enabled
+# Configure logging (ya configurado por app.teams_bot en la importación; no-op en ese caso)
+configure_logging(settings)
 
-# Microsoft Bot Framework credentials (hardcoded debido a problemas de .env)
-MICROSOFT_APP_ID = "92bc3ead-9f2c-4d71-a58e-2015571d3410"
-MICROSOFT_APP_PASSWORD = "QD-8Q~dQz5GzPx0UTmbeTp4GkLIRw1HSEPMYDcS4"
+# Microsoft Bot Framework credentials (hardcoded debido a problemas de .env).
+# Las variables de entorno tienen prioridad; vacías = modo anónimo sin tokens de salida
+# (lo usa el harness de carga offline, ver app.benchmarks.loadtest)
+MICROSOFT_APP_ID = os.environ.get("MicrosoftAppId", "92bc3ead-9f2c-4d71-a58e-2015571d3410")
+MICROSOFT_APP_PASSWORD = os.environ.get("MicrosoftAppPassword", "QD-8Q~dQz5GzPx0UTmbeTp4GkLIRw1HSEPMYDcS4")
 
 # Create Bot Framework Adapter Settings (configuración básica)
 logger.info(f"Configurando BotFrameworkAdapter con App ID: {MICROSOFT_APP_ID}")
@@ -36,12 +48,22 @@ adapter_settings = BotFrameworkAdapterSettings(
     app_password=MICROSOFT_APP_PASSWORD
 )
 
+class TimedBotFrameworkAdapter(SendTimingMixin, BotFrameworkAdapter):
+    """BotFrameworkAdapter que mide send_activity/update_activity en /metrics"""
+
+
 # Create Bot Framework Adapter
-adapter = BotFrameworkAdapter(adapter_settings)
+adapter = TimedBotFrameworkAdapter(adapter_settings)
 logger.info("BotFrameworkAdapter creado exitosamente")
 
 # Create the Bot
-bot = TeamsRAGBot()
+# Con BACKGROUND_PROCESSING=true las respuestas se envían como mensajes proactivos
+bot = TeamsRAGBot(
+    background=build_background_processor(adapter, settings) if settings.background_processing else None
+)
+
+# Respuesta 200 inmediata para las actividades que el bot ignora (typing, reacciones...)
+fast_path = build_activity_fast_path(settings)
 
 # Error handler
 async def on_error(context, error):
@@ -60,88 +82,170 @@ async def on_error(context, error):
 # Set the error handler on the adapter
 adapter.on_turn_error = on_error
 
-@app.route("/api/messages", methods=["POST"])
+class TurnLoop:
+    """
+    Event loop de larga duración que ejecuta los turnos del bot en un hilo de fondo.
+
+    Todas las peticiones de un mismo proceso comparten este loop, de modo que el pool
+    de conexiones HTTP del cliente ``AsyncAzureOpenAI`` se reutiliza entre turnos y
+    varias actividades pueden estar en curso a la vez.
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever,
+                    name="bot-turn-loop",
+                    daemon=True
+                )
+                self._thread.start()
+                logger.info("Turn loop iniciado")
+            return self._loop
+
+    def run(self, coro):
+        """Ejecuta la corrutina en el loop compartido y espera su resultado"""
+        loop = self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+    def stop(self):
+        """Detiene el loop compartido (usado al apagar el proceso)"""
+        with self._lock:
+            if self._loop is not None:
+                self._loop.call_soon_threadsafe(self._loop.stop)
+                self._thread.join(timeout=5)
+                self._loop = None
+                self._thread = None
+
+
+turn_loop = TurnLoop()
+
+
+async def process_turn(activity: Activity):
+    """
+    Ejecuta la lógica del bot para una actividad.
+
+    Usa el método más básico que evita parse_request completamente: se crea el
+    TurnContext directamente con una ClaimsIdentity para el bot.
+    """
+    # Create ClaimsIdentity for authentication
+    with metrics.span("adapter_auth"):
+        claims_identity = ClaimsIdentity({
+            AuthenticationConstants.AUDIENCE_CLAIM: MICROSOFT_APP_ID,
+            AuthenticationConstants.APP_ID_CLAIM: MICROSOFT_APP_ID,
+            AuthenticationConstants.VERSION_CLAIM: "1.0"
+        }, True)
+
+    # Create TurnContext
+    context = TurnContext(adapter, activity)
+    context.turn_state[adapter.BOT_IDENTITY_KEY] = claims_identity
+    # Sin el ConnectorClient en turn_state, send_activity falla con KeyError
+    context.turn_state[adapter.BOT_CONNECTOR_CLIENT_KEY] = await adapter.create_connector_client(
+        activity.service_url, claims_identity
+    )
+
+    # Run bot logic
+    await bot.on_turn(context)
+    return None
+
+
+def _log_request(body: dict, auth_header: str):
+    """Registra los datos básicos de la petición entrante en un único registro muestreado"""
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    auth_state = "none"
+    if auth_header:
+        auth_state = "bearer" if auth_header.startswith("Bearer ") else "other"
+    logger.info(
+        "=== NUEVO MENSAJE RECIBIDO === type=%s from=%s auth=%s",
+        body.get("type", "unknown"),
+        (body.get("from") or {}).get("id", "unknown"),
+        auth_state,
+        extra=per_message(body.get("id"))
+    )
+
+
 def messages():
     """
     Main bot message endpoint siguiendo el patrón oficial de Microsoft
     """
-    logger.info("=== NUEVO MENSAJE RECIBIDO ===")
+    from flask import request, Response
+
     try:
         # Verify content type
         if "application/json" not in request.headers.get("Content-Type", ""):
             logger.warning("Invalid content type received")
             return Response(status=415)  # Unsupported Media Type
         
-        # Get request body
-        body = request.get_json()
-        if not body:
-            logger.warning("Empty request body")
-            return Response(status=400)  # Bad Request
-        
-        logger.info(f"Activity type: {body.get('type', 'unknown')}")
-        logger.info(f"From: {body.get('from', {}).get('name', 'unknown')}")
-        
-        # Create Activity from request body
-        activity = Activity().deserialize(body)
+        with metrics.span("activity_deserialize"):
+            # Get request body; only the activities the bot handles are deserialized
+            try:
+                body, activity = fast_path.parse(request.get_data())
+            except ValueError:
+                logger.warning("Empty or invalid request body")
+                return Response(status=400)  # Bad Request
+        if activity is None:
+            return Response(status=200)
         
         # Get Authorization header
         auth_header = request.headers.get("Authorization", "")
-        logger.info(f"Auth header present: {'Yes' if auth_header else 'No'}")
-        if auth_header:
-            logger.info(f"Auth header starts with Bearer: {auth_header.startswith('Bearer ')}")
+        _log_request(body, auth_header)
         
-        # Usar el método más básico que evita parse_request completamente
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        # El turno se ejecuta en el loop compartido del proceso, no en uno nuevo
+        invoke_response = turn_loop.run(process_turn(activity))
         
-        try:
-            async def simple_process():
-                # Crear TurnContext directamente
-                from botbuilder.core import TurnContext
-                from botframework.connector.auth import ClaimsIdentity, AuthenticationConstants
-                
-                # Create ClaimsIdentity for authentication
-                claims_identity = ClaimsIdentity({
-                    AuthenticationConstants.AUDIENCE_CLAIM: MICROSOFT_APP_ID,
-                    AuthenticationConstants.APP_ID_CLAIM: MICROSOFT_APP_ID,
-                    AuthenticationConstants.VERSION_CLAIM: "1.0"
-                }, True)
-                
-                # Create TurnContext
-                context = TurnContext(adapter, activity)
-                context.turn_state[adapter.BOT_IDENTITY_KEY] = claims_identity
-                
-                # Run bot logic
-                await bot.on_turn(context)
-                return None
-            
-            invoke_response = loop.run_until_complete(simple_process())
-            
-            if invoke_response:
-                return Response(
-                    response=json.dumps(invoke_response.body) if invoke_response.body else "",
-                    status=invoke_response.status,
-                    headers={"Content-Type": "application/json"}
-                )
-            else:
-                return Response(status=200)
-                
-        finally:
-            loop.close()
+        if invoke_response:
+            return Response(
+                response=json.dumps(invoke_response.body) if invoke_response.body else "",
+                status=invoke_response.status,
+                headers={"Content-Type": "application/json"}
+            )
+        else:
+            return Response(status=200)
             
     except Exception as e:
         logger.error(f"Error in messages endpoint: {str(e)}")
         logger.error(traceback.format_exc())
         return Response(status=500)
 
-@app.route("/health", methods=["GET"])
 def health():
     """
     Health check endpoint
     """
     return {"status": "healthy", "bot": "Teams RAG Bot"}, 200
 
-@app.route("/", methods=["GET"])
+def _components() -> dict:
+    """Contadores de los componentes compartidos más los del bot (cola, duplicados y tipos de actividad)"""
+    components = registry.stats()
+    components["dedup"] = {"duplicates": bot.deduplicator.duplicates}
+    components["activities"] = fast_path.stats()
+    if bot.background is not None:
+        components["background"] = bot.background.stats()
+    return components
+
+
+async def _collect_components() -> dict:
+    # Se ejecuta en el turn loop, como el resto del estado del bot
+    return _components()
+
+
+def metrics_endpoint():
+    """
+    Latencias por etapa del turno (JSON, o texto Prometheus con ?format=prometheus)
+    """
+    from flask import request, Response
+
+    components = turn_loop.run(_collect_components())
+    if wants_prometheus(request.args.get("format"), request.headers.get("Accept")):
+        return Response(metrics.render_prometheus(components), status=200, content_type=PROMETHEUS_CONTENT_TYPE)
+    return metrics.snapshot(components), 200
+
 def home():
     """
     Home endpoint with bot information
@@ -151,21 +255,143 @@ def home():
         "framework": "Microsoft Bot Framework v4",
         "endpoints": {
             "messages": "/api/messages",
-            "health": "/health"
+            "health": "/health",
+            "metrics": "/metrics"
         }
     }, 200
 
+
+_flask_app = None
+
+
+def create_flask_app():
+    """
+    Crea la aplicación Flask (una por proceso); Flask sólo se importa en este modo,
+    no al servir con aiohttp (``create_async_app``)
+    """
+    global _flask_app
+    if _flask_app is None:
+        from flask import Flask
+
+        flask_app = Flask(__name__)
+        flask_app.add_url_rule("/api/messages", view_func=messages, methods=["POST"])
+        flask_app.add_url_rule("/health", view_func=health, methods=["GET"])
+        if settings.metrics_enabled:
+            flask_app.add_url_rule("/metrics", view_func=metrics_endpoint, methods=["GET"])
+        flask_app.add_url_rule("/", view_func=home, methods=["GET"])
+        _flask_app = flask_app
+    return _flask_app
+
+
+def __getattr__(name):
+    """``app.bot_app:app`` sigue siendo el objetivo WSGI, creado en el primer acceso"""
+    if name == "app":
+        return create_flask_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+async def async_messages(req: web.Request) -> web.Response:
+    """
+    Endpoint de mensajes nativo asíncrono (aiohttp).
+
+    Se ejecuta directamente en el loop del worker, así que muchas actividades pueden
+    procesarse a la vez sin hilos ni loops adicionales.
+    """
+    try:
+        if "application/json" not in req.headers.get("Content-Type", ""):
+            logger.warning("Invalid content type received")
+            return web.Response(status=415)
+
+        with metrics.span("activity_deserialize"):
+            try:
+                body, activity = fast_path.parse(await req.read())
+            except ValueError:
+                logger.warning("Empty or invalid request body")
+                return web.Response(status=400)
+        if activity is None:
+            return web.Response(status=200)
+        auth_header = req.headers.get("Authorization", "")
+        _log_request(body, auth_header)
+
+        invoke_response = await process_turn(activity)
+        if invoke_response:
+            return web.json_response(data=invoke_response.body, status=invoke_response.status)
+        return web.Response(status=200)
+
+    except Exception as e:
+        logger.error(f"Error in messages endpoint: {str(e)}")
+        logger.error(traceback.format_exc())
+        return web.Response(status=500)
+
+
+async def async_health(req: web.Request) -> web.Response:
+    """Health check endpoint (modo asíncrono)"""
+    return web.json_response({"status": "healthy", "bot": "Teams RAG Bot"})
+
+
+async def async_metrics(req: web.Request) -> web.Response:
+    """Metrics endpoint (modo asíncrono); ?format=prometheus devuelve texto Prometheus"""
+    components = _components()
+    if wants_prometheus(req.query.get("format"), req.headers.get("Accept")):
+        return web.Response(
+            text=metrics.render_prometheus(components),
+            headers={"Content-Type": PROMETHEUS_CONTENT_TYPE}
+        )
+    return web.json_response(metrics.snapshot(components))
+
+
+async def async_home(req: web.Request) -> web.Response:
+    """Home endpoint (modo asíncrono)"""
+    return web.json_response({
+        "message": "Teams RAG Bot is running",
+        "framework": "Microsoft Bot Framework v4",
+        "endpoints": {
+            "messages": "/api/messages",
+            "health": "/health",
+            "metrics": "/metrics"
+        }
+    })
+
+
+def create_async_app() -> web.Application:
+    """
+    Crea la aplicación aiohttp que sirve el bot sobre un único event loop por worker
+    """
+    async_app = web.Application()
+    async_app.router.add_post("/api/messages", async_messages)
+    async_app.router.add_get("/health", async_health)
+    if settings.metrics_enabled:
+        async_app.router.add_get("/metrics", async_metrics)
+    async_app.router.add_get("/", async_home)
+    async_app.on_startup.append(registry.startup)
+    if bot.background is not None:
+        # Primero se terminan las respuestas pendientes, luego se cierran los clientes
+        async_app.on_cleanup.append(bot.background.drain)
+    async_app.on_cleanup.append(registry.shutdown)
+    return async_app
+
+
+startup.mark("app_ready")
+
+
 if __name__ == "__main__":
     logger.info("Starting Teams RAG Bot...")
     logger.info(f"Bot ID: {MICROSOFT_APP_ID}")
     logger.info(f"Bot Password length: {len(MICROSOFT_APP_PASSWORD)} characters")
     
+    # Pre-calentamiento en el turn loop mientras Flask empieza a aceptar peticiones
+    turn_loop.run(registry.startup())
     try:
-        app.run(
+        create_flask_app().run(
             host="0.0.0.0",
             port=3978,
-            debug=False  # Set to False in production
+            debug=False,  # Set to False in production
+            threaded=True  # Las peticiones comparten el turn loop del proceso
         )
     except Exception as e:
         logger.error(f"Failed to start bot: {e}")
-        raise
\ No newline at end of file
+        raise
+    finally:
+        if bot.background is not None:
+            turn_loop.run(bot.background.drain())
+        turn_loop.run(registry.shutdown())
+        turn_loop.stop()
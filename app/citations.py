@@ -0,0 +1,260 @@
+"""
+Post-procesado de citas y respuesta compacta para Teams
+
+``RagChatService`` devuelve las citas tal como llegan de Azure OpenAI: un chunk por
+cita, con todo su ``content``, y marcadores ``[docN]`` en el texto. Este módulo las
+convierte en una respuesta pequeña:
+
+1. Agrupa las citas por documento (filepath, url o título), así que varios chunks
+   de un mismo documento son una sola fuente
+2. Renumera los marcadores ``[docN]`` del texto como ``[1]``, ``[2]``... según el
+   orden de aparición; sin marcadores se listan las primeras fuentes
+3. Recorta cada fragmento a ``CITATIONS_SNIPPET_CHARS`` caracteres
+4. Renderiza una Adaptive Card compacta (``CITATIONS_MODE=card``) o una lista en
+   markdown (``text``). Las tarjetas ya renderizadas se guardan en una caché LRU y
+   el tamaño del JSON se limita a ``CITATIONS_MAX_PAYLOAD_BYTES``: primero se quitan
+   fragmentos, luego fuentes y por último se recorta el texto
+"""
+import hashlib
+import json
+import logging
+import re
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from botbuilder.core import CardFactory, MessageFactory
+from botbuilder.schema import Activity
+
+logger = logging.getLogger(__name__)
+
+_MARKER = re.compile(r"(\s*)\[doc(\d+)\]")
+_REPEATED_MARKER = re.compile(r"(\[\d+\])(?:\s*\1)+")
+
+# Estructura fija de la tarjeta; el cuerpo se añade en cada render
+CARD_SCHEMA = "http://adaptivecards.io/schemas/adaptive-card.json"
+CARD_VERSION = "1.4"
+
+
+@dataclass
+class Source:
+    """Un documento citado en la respuesta"""
+    number: int
+    title: str
+    url: str = ""
+    snippet: str = ""
+
+
+def _document_key(citation: dict) -> str:
+    for name in ("filepath", "url", "title", "chunk_id"):
+        value = citation.get(name)
+        if value:
+            return str(value).strip().lower()
+    return str(id(citation))
+
+
+def _snippet(content: Optional[str], limit: int) -> str:
+    """Primer fragmento del contenido, cortado en un límite de palabra"""
+    text = " ".join((content or "").split())
+    if len(text) <= limit:
+        return text
+    cut = text[:limit].rsplit(" ", 1)[0] if " " in text[:limit] else text[:limit]
+    return cut.rstrip(".,;:") + "…"
+
+
+def process_citations(
+    message: str,
+    citations: List[dict],
+    max_sources: int = 5,
+    snippet_chars: int = 200
+) -> Tuple[str, List[Source]]:
+    """
+    Agrupa las citas por documento y renumera los marcadores del texto
+
+    Returns:
+        (texto con marcadores [n], fuentes en orden de número)
+    """
+    citations = citations or []
+    # Documento de cada cita y primer chunk de cada documento
+    keys = [_document_key(citation) for citation in citations]
+    first_chunk = {}
+    for key, citation in zip(keys, citations):
+        first_chunk.setdefault(key, citation)
+
+    numbers = OrderedDict()
+
+    def number_for(key: str) -> Optional[int]:
+        if key not in numbers:
+            if len(numbers) >= max_sources:
+                return None
+            numbers[key] = len(numbers) + 1
+        return numbers[key]
+
+    def replace_marker(match: re.Match) -> str:
+        index = int(match.group(2)) - 1
+        number = number_for(keys[index]) if 0 <= index < len(citations) else None
+        # Un marcador descartado se lleva también el espacio que lo precede
+        return f"{match.group(1)}[{number}]" if number is not None else ""
+
+    text = _MARKER.sub(replace_marker, message or "")
+    text = _REPEATED_MARKER.sub(r"\1", text)
+    if not numbers:
+        # Sin marcadores: se listan los primeros documentos recuperados
+        for key in first_chunk:
+            if number_for(key) is None:
+                break
+
+    sources = []
+    for key, number in numbers.items():
+        citation = first_chunk[key]
+        sources.append(Source(
+            number=number,
+            title=citation.get("title") or citation.get("filepath") or citation.get("url") or f"Documento {number}",
+            url=citation.get("url") or "",
+            snippet=_snippet(citation.get("content"), snippet_chars)
+        ))
+    return text, sources
+
+
+class CitationRenderer:
+    """
+    Convierte la respuesta final y sus citas en la actividad que se envía a Teams
+
+    Args:
+        mode: card | text | off
+        max_sources: Fuentes mostradas como máximo
+        snippet_chars: Caracteres por fragmento
+        max_payload_bytes: Tamaño máximo del JSON de la tarjeta
+        cache_entries: Tarjetas renderizadas que se guardan (LRU)
+    """
+
+    def __init__(
+        self,
+        mode: str = "card",
+        max_sources: int = 5,
+        snippet_chars: int = 200,
+        max_payload_bytes: int = 24000,
+        cache_entries: int = 256
+    ):
+        self.mode = mode
+        self.max_sources = max_sources
+        self.snippet_chars = snippet_chars
+        self.max_payload_bytes = max_payload_bytes
+        self.cache_entries = cache_entries
+        self._cache: "OrderedDict[str, Tuple[str, Optional[str]]]" = OrderedDict()
+        self.rendered = 0
+        self.cache_hits = 0
+        self.trimmed = 0
+        self.payload_bytes = 0
+
+    def render(self, message: str, citations: List[dict] = None) -> Activity:
+        """Actividad con el texto y, según el modo, la tarjeta o la lista de fuentes"""
+        if self.mode == "off" or not citations:
+            return MessageFactory.text(message)
+
+        key = hashlib.sha256(
+            json.dumps([message, citations], ensure_ascii=False, sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
+        cached = self._cache.get(key)
+        if cached is not None:
+            self.cache_hits += 1
+            self._cache.move_to_end(key)
+        else:
+            cached = self._render(message, citations)
+            self._cache[key] = cached
+            if len(self._cache) > self.cache_entries:
+                self._cache.popitem(last=False)
+        text, card_json = cached
+        if card_json is None:
+            return MessageFactory.text(text)
+        # Una copia por envío: el adaptador no debe compartir el contenido entre actividades
+        return MessageFactory.attachment(CardFactory.adaptive_card(json.loads(card_json)))
+
+    def _render(self, message: str, citations: List[dict]) -> Tuple[str, Optional[str]]:
+        text, sources = process_citations(message, citations, self.max_sources, self.snippet_chars)
+        self.rendered += 1
+        if self.mode == "text":
+            return self._text_with_sources(text, sources), None
+
+        card_json = self._fit(text, sources)
+        self.payload_bytes += len(card_json.encode("utf-8"))
+        return text, card_json
+
+    @staticmethod
+    def _text_with_sources(text: str, sources: List[Source]) -> str:
+        if not sources:
+            return text
+        lines = [text, "", "**Fuentes:**"]
+        for source in sources:
+            title = f"[{source.title}]({source.url})" if source.url else source.title
+            lines.append(f"{source.number}. {title}")
+        return "\n".join(lines)
+
+    def _fit(self, text: str, sources: List[Source]) -> str:
+        """JSON de la tarjeta dentro de max_payload_bytes"""
+        card_json = self._card_json(text, sources, with_snippets=True)
+        if len(card_json.encode("utf-8")) <= self.max_payload_bytes:
+            return card_json
+        self.trimmed += 1
+        card_json = self._card_json(text, sources, with_snippets=False)
+        while len(card_json.encode("utf-8")) > self.max_payload_bytes and sources:
+            sources = sources[:-1]
+            card_json = self._card_json(text, sources, with_snippets=False)
+        overflow = len(card_json.encode("utf-8")) - self.max_payload_bytes
+        while overflow > 0 and text.rstrip("…"):
+            # Sólo queda el texto: se recorta lo que sobra (el escape JSON puede pedir otra vuelta)
+            text = text[:max(len(text.rstrip("…")) - overflow - 1, 0)].rstrip() + "…"
+            card_json = self._card_json(text, [], with_snippets=False)
+            overflow = len(card_json.encode("utf-8")) - self.max_payload_bytes
+        return card_json
+
+    @staticmethod
+    def _card_json(text: str, sources: List[Source], with_snippets: bool) -> str:
+        body = [{"type": "TextBlock", "text": text, "wrap": True}]
+        if sources:
+            items = []
+            for source in sources:
+                title = f"[{source.title}]({source.url})" if source.url else source.title
+                items.append({"type": "TextBlock", "text": f"[{source.number}] {title}", "wrap": True, "size": "Small", "spacing": "None"})
+                if with_snippets and source.snippet:
+                    items.append({
+                        "type": "TextBlock",
+                        "text": source.snippet,
+                        "wrap": True,
+                        "isSubtle": True,
+                        "size": "Small",
+                        "maxLines": 2,
+                        "spacing": "None"
+                    })
+            body.append({"type": "Container", "separator": True, "spacing": "Medium", "items": items})
+        card = {"type": "AdaptiveCard", "$schema": CARD_SCHEMA, "version": CARD_VERSION, "body": body}
+        return json.dumps(card, ensure_ascii=False, separators=(",", ":"))
+
+    def apply_settings(self, app_settings):
+        """Aplica los CITATIONS_* de una configuración recargada; las tarjetas en caché se descartan"""
+        self.mode = app_settings.citations_mode
+        self.max_sources = app_settings.citations_max_sources
+        self.snippet_chars = app_settings.citations_snippet_chars
+        self.max_payload_bytes = app_settings.citations_max_payload_bytes
+        self.cache_entries = app_settings.citations_card_cache_entries
+        self._cache = OrderedDict()
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "rendered": self.rendered,
+            "cache_hits": self.cache_hits,
+            "trimmed": self.trimmed,
+            "avg_payload_bytes": round(self.payload_bytes / self.rendered) if self.rendered and self.mode == "card" else 0
+        }
+
+
+def build_citation_renderer(app_settings) -> CitationRenderer:
+    """Crea el renderizador configurado en AppSettings"""
+    return CitationRenderer(
+        mode=app_settings.citations_mode,
+        max_sources=app_settings.citations_max_sources,
+        snippet_chars=app_settings.citations_snippet_chars,
+        max_payload_bytes=app_settings.citations_max_payload_bytes,
+        cache_entries=app_settings.citations_card_cache_entries
+    )
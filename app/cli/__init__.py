@@ -0,0 +1,3 @@
+"""
+Command line tools for the Teams RAG Bot.
+"""
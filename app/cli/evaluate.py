@@ -0,0 +1,255 @@
+"""
+Run a JSONL file of questions through RagChatService
+
+Usage:
+    python -m app.cli.evaluate questions.jsonl --output answers.jsonl
+    python -m app.cli.evaluate questions.jsonl --output answers.jsonl --concurrency 16 --stream
+
+Every input line is a JSON object:
+
+    {"id": "vpn-1", "question": "¿Cómo configuro la VPN?",
+     "history": [{"role": "user", "content": "..."}, {"role": "assistant", "content": "..."}],
+     "expected_sources": ["vpn.md"]}
+
+Only ``question`` is required; ``id`` defaults to the line number. Every output line
+holds the answer, citations, token usage and latency of one item, plus the recall of
+``expected_sources`` among the citations (matched against title, filepath, url and
+chunk id). Results are appended as they finish. Running again with the same output
+file skips the items already answered, so an interrupted run resumes where it
+stopped; items that failed are retried. The answer cache is off unless
+``--answer-cache`` is given, so prompt and index changes are always measured.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+from typing import Iterator, List, Optional, Set, Tuple
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+logger = logging.getLogger(__name__)
+
+
+def read_items(path: str) -> Iterator[dict]:
+    """Input items with an id, skipping blank lines"""
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            if not item.get("question"):
+                raise ValueError(f"{path}:{number}: missing 'question'")
+            item["id"] = str(item.get("id", number))
+            yield item
+
+
+def finished_ids(path: str) -> Set[str]:
+    """Ids already answered without error in an existing output file"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                # A line cut short by an interrupted run
+                continue
+            if "error" not in result:
+                done.add(str(result["id"]))
+    return done
+
+
+def source_recall(expected: List[str], citations: List[dict]) -> Tuple[List[str], Optional[float]]:
+    """Expected sources found in the citations and the fraction found (None without expectations)"""
+    if not expected:
+        return [], None
+    fields = [
+        str(citation.get(name) or "").lower()
+        for citation in citations
+        for name in ("title", "filepath", "url", "chunk_id")
+    ]
+    found = [source for source in expected if any(source.lower() in value for value in fields if value)]
+    return found, len(found) / len(expected)
+
+
+def _compact_citation(citation: dict) -> dict:
+    return {name: citation.get(name) for name in ("title", "filepath", "url", "chunk_id") if citation.get(name)}
+
+
+class Evaluation:
+    """
+    Bounded-concurrency run over the input items
+
+    Args:
+        service: RagChatService (or anything with the same completion methods)
+        output_path: JSONL file results are appended to
+        concurrency: Items in flight at once
+        stream: Use stream_chat_completion and also record the time to the first token
+    """
+
+    def __init__(self, service, output_path: str, concurrency: int = 8, stream: bool = False):
+        self.service = service
+        self.output_path = output_path
+        self.concurrency = concurrency
+        self.stream = stream
+        self.completed = 0
+        self.failed = 0
+        self.skipped = 0
+        self.latencies_ms: List[float] = []
+        self.total_tokens = 0
+        self.recalls: List[float] = []
+
+    async def _answer(self, item: dict) -> dict:
+        from app.models.chat_models import ChatMessage
+
+        history = [ChatMessage(**turn) for turn in item.get("history") or []]
+        started = time.perf_counter()
+        result = {"id": item["id"], "question": item["question"]}
+        if self.stream:
+            first_token_ms = None
+            response = None
+            async for event in self.service.stream_chat_completion(
+                user_message=item["question"],
+                conversation_history=history,
+                conversation_id=f"evaluate:{item['id']}"
+            ):
+                if event["type"] == "delta" and first_token_ms is None:
+                    first_token_ms = (time.perf_counter() - started) * 1000
+                elif event["type"] == "end":
+                    response = event
+            if response is None:
+                raise RuntimeError("stream ended without an end event")
+            result["first_token_ms"] = round(first_token_ms or 0.0, 1)
+        else:
+            response = await self.service.get_chat_completion(
+                user_message=item["question"],
+                conversation_history=history,
+                conversation_id=f"evaluate:{item['id']}"
+            )
+        latency_ms = (time.perf_counter() - started) * 1000
+
+        citations = response.get("citations") or []
+        found, recall = source_recall(item.get("expected_sources") or [], citations)
+        result.update({
+            "answer": response.get("message"),
+            "citations": [_compact_citation(citation) for citation in citations],
+            "usage": response.get("usage", {}),
+            "latency_ms": round(latency_ms, 1)
+        })
+        if item.get("expected_sources"):
+            result["expected_sources"] = item["expected_sources"]
+            result["found_sources"] = found
+            result["source_recall"] = recall
+        return result
+
+    async def _worker(self, items: Iterator[dict], output):
+        for item in items:
+            try:
+                result = await self._answer(item)
+            except Exception as e:
+                self.failed += 1
+                logger.warning(f"Item {item['id']} failed: {e}")
+                result = {"id": item["id"], "question": item["question"], "error": f"{type(e).__name__}: {e}"}
+            else:
+                self.completed += 1
+                self.latencies_ms.append(result["latency_ms"])
+                self.total_tokens += result["usage"].get("total_tokens", 0)
+                if result.get("source_recall") is not None:
+                    self.recalls.append(result["source_recall"])
+            # Written as soon as it is known, so an interrupted run can resume
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
+
+    async def run(self, items: Iterator[dict], done: Set[str] = frozenset()) -> dict:
+        """Answer every item not in done and return the summary"""
+        def pending():
+            for item in items:
+                if item["id"] in done:
+                    self.skipped += 1
+                    continue
+                yield item
+
+        started = time.perf_counter()
+        # All workers pull from one generator, so items are read lazily and in order
+        shared = pending()
+        with open(self.output_path, "a", encoding="utf-8") as output:
+            if output.tell() and not self._ends_with_newline():
+                # Terminate a line cut short by an interrupted run
+                output.write("\n")
+            await asyncio.gather(*(self._worker(shared, output) for _ in range(self.concurrency)))
+        return self.summary(time.perf_counter() - started)
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.output_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def summary(self, elapsed: float) -> dict:
+        ordered = sorted(self.latencies_ms)
+
+        def pick(q: float) -> float:
+            return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+        return {
+            "completed": self.completed,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "elapsed_seconds": round(elapsed, 2),
+            "items_per_second": round(self.completed / elapsed, 2) if elapsed else 0.0,
+            "latency_ms": {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99)},
+            "total_tokens": self.total_tokens,
+            "mean_source_recall": round(sum(self.recalls) / len(self.recalls), 4) if self.recalls else None
+        }
+
+
+def main(argv=None):
+    """Parse arguments and run the evaluation"""
+    from app.config import settings
+
+    parser = argparse.ArgumentParser(description="Run a JSONL file of questions through the RAG service")
+    parser.add_argument("input", help="JSONL file with one question per line")
+    parser.add_argument("--output", required=True, help="JSONL file results are appended to")
+    parser.add_argument("--concurrency", type=int, default=settings.evaluate_concurrency)
+    parser.add_argument("--limit", type=int, default=0, help="Only the first N items (0 = all)")
+    parser.add_argument("--stream", action="store_true", help="Use the streaming path and record time to first token")
+    parser.add_argument("--restart", action="store_true", help="Discard existing results instead of resuming")
+    parser.add_argument("--answer-cache", action="store_true", help="Serve repeated questions from the answer cache")
+    parser.add_argument("--no-routing", action="store_true", help="Send every question through RAG")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    settings.answer_cache_enabled = args.answer_cache
+    if args.no_routing:
+        settings.routing_enabled = False
+    if args.restart and os.path.exists(args.output):
+        os.remove(args.output)
+
+    from app.services.registry import registry
+
+    async def run():
+        try:
+            evaluation = Evaluation(
+                registry.get_rag_chat_service(),
+                args.output,
+                concurrency=args.concurrency,
+                stream=args.stream
+            )
+            items = read_items(args.input)
+            if args.limit:
+                items = itertools.islice(items, args.limit)
+            return await evaluation.run(items, finished_ids(args.output))
+        finally:
+            await registry.shutdown()
+
+    summary = asyncio.run(run())
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Ingest a directory of documents into the local index
+
+Usage:
+    python -m app.cli.ingest ./docs
+    python -m app.cli.ingest ./docs --index local_index --embedder hashing
+
+Only new or changed chunks are embedded; the report shows chunks/s and the
+embedding calls saved by reusing vectors already in the index.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+
+def main(argv=None):
+    """Parse arguments and run the ingestion pipeline"""
+    from app.config import settings
+    from app.services.ingestion import IngestionPipeline
+    from app.services.registry import registry
+
+    parser = argparse.ArgumentParser(description="Ingest documents into the local index")
+    parser.add_argument("directory", help="Directory with .txt/.md/.rst documents")
+    parser.add_argument("--index", default=settings.local_index_path, help="Index directory")
+    parser.add_argument("--chunk-size", type=int, default=settings.ingest_chunk_size)
+    parser.add_argument("--chunk-overlap", type=int, default=settings.ingest_chunk_overlap)
+    parser.add_argument("--batch-size", type=int, default=settings.ingest_batch_size)
+    parser.add_argument("--concurrency", type=int, default=settings.ingest_concurrency)
+    parser.add_argument(
+        "--embedder",
+        choices=["azure", "hashing"],
+        default=settings.embedding_backend,
+        help="'hashing' uses a local fake embedder and needs no Azure access"
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    settings.embedding_backend = args.embedder
+
+    async def run():
+        try:
+            pipeline = IngestionPipeline(
+                registry.get_embedder(),
+                args.index,
+                chunk_size=args.chunk_size,
+                chunk_overlap=args.chunk_overlap,
+                batch_size=args.batch_size,
+                concurrency=args.concurrency
+            )
+            return await pipeline.run(args.directory)
+        finally:
+            await registry.shutdown()
+
+    report = asyncio.run(run())
+    print(json.dumps(report.as_dict(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,14 +6,27 @@ This module uses Pydantic's settings management to:
 2. Load environment variables from .env file or environment
 3. Validate the configuration values
 4. Provide strongly-typed access to settings throughout the app
+5. Reload the settings file while running (app.config.provider): ``settings`` reads
+   the current immutable snapshot
 """
-from typing import Optional
+import json
+import os
+from functools import cached_property
+from typing import Dict, List, Optional
 from pydantic import BaseModel, Field
 from pydantic_settings import BaseSettings
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Repository root: relative cache directories are resolved against it, not the working directory
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def resolve_app_path(path: str) -> str:
+    """Absolute path for a setting; relative paths are taken from APP_ROOT (empty stays empty)"""
+    return os.path.join(APP_ROOT, path) if path else path
+
 
 class OpenAISettings(BaseModel):
     """Azure OpenAI settings"""
@@ -28,6 +41,29 @@ class SearchSettings(BaseModel):
     index_name: str
 
 
+class OpenAIEndpointSettings(BaseModel):
+    """One Azure OpenAI resource of the endpoint pool (AZURE_OPENAI_ENDPOINTS)"""
+    name: str
+    endpoint: str
+    api_key: str = ""  # empty = Entra ID token
+    weight: float = 1.0  # share of the calls relative to the other endpoints
+    deployments: Dict[str, str] = {}  # deployment name in the settings -> name on this resource
+
+
+class SearchIndexSettings(BaseModel):
+    """One named index queried by the fan-out retriever (SEARCH_INDEXES)"""
+    name: str
+    backend: str = "azure_search"  # azure_search | local | fake
+    index_name: str = ""  # Azure AI Search index; empty = name
+    path: str = ""  # local index directory, or JSONL corpus for the fake backend
+    timeout_ms: Optional[float] = None  # None = RETRIEVAL_INDEX_TIMEOUT_MS
+    weight: float = 1.0  # multiplies the index's reciprocal rank scores
+    fields: Dict[str, str] = {}  # Azure AI Search field names, e.g. {"content": "content"} (default: integrated vectorization)
+    query_type: str = "vector_semantic_hybrid"  # Azure AI Search: vector_semantic_hybrid | vector_hybrid | semantic | keyword
+    semantic_configuration: str = ""  # Azure AI Search; empty = <index_name>-semantic-configuration
+    options: Dict[str, float] = {}  # fake backend latency options (latency_ms, jitter_ms, ...)
+
+
 class AppSettings(BaseSettings):
     """Application settings with environment variable loading capabilities"""
     # Microsoft Bot Framework Settings
@@ -41,20 +77,176 @@ class AppSettings(BaseSettings):
     azure_openai_endpoint: str = Field(..., env="AZURE_OPENAI_ENDPOINT")
     azure_openai_gpt_deployment: str = Field(..., env="AZURE_OPENAI_GPT_DEPLOYMENT")
     azure_openai_embedding_deployment: str = Field("", env="AZURE_OPENAI_EMBEDDING_DEPLOYMENT")
+    # Optional API key (local fakes, dev resources); empty = Entra ID token from DefaultAzureCredential
+    azure_openai_api_key: str = Field("", env="AZURE_OPENAI_API_KEY")
+    # JSON list of OpenAIEndpointSettings; empty = AZURE_OPENAI_ENDPOINT alone, no pool
+    azure_openai_endpoints: str = Field("", env="AZURE_OPENAI_ENDPOINTS")
     
     # Azure AI Search Settings
     azure_search_service_url: str = Field(..., env="AZURE_SEARCH_SERVICE_URL")
     azure_search_index_name: str = Field(..., env="AZURE_SEARCH_INDEX_NAME")
     
+    # Retrieval: "azure_search" uses the On Your Data data source, "local" the in-process retriever,
+    # "fanout" several named indexes merged with reciprocal rank fusion
+    retrieval_mode: str = Field("azure_search", env="RETRIEVAL_MODE")
+    local_index_path: str = Field("local_index", env="LOCAL_INDEX_PATH")
+    retrieval_top_k: int = Field(5, env="RETRIEVAL_TOP_K")
+    retrieval_hybrid_alpha: float = Field(0.5, env="RETRIEVAL_HYBRID_ALPHA")
+    # RETRIEVAL_MODE=fanout queries every index in SEARCH_INDEXES concurrently (app.services.retrieval.fanout)
+    search_indexes: str = Field("", env="SEARCH_INDEXES")  # JSON list of SearchIndexSettings; empty = AZURE_SEARCH_INDEX_NAME
+    azure_search_api_key: str = Field("", env="AZURE_SEARCH_API_KEY")  # empty = Entra ID token
+    retrieval_index_timeout_ms: float = Field(1500, env="RETRIEVAL_INDEX_TIMEOUT_MS")
+    retrieval_latency_budget_ms: float = Field(2000, env="RETRIEVAL_LATENCY_BUDGET_MS")  # 0 = wait for every index
+    retrieval_fanout_candidates: int = Field(10, env="RETRIEVAL_FANOUT_CANDIDATES")
+    retrieval_rrf_k: int = Field(60, env="RETRIEVAL_RRF_K")
+    
+    # Embeddings: "azure" uses azure_openai_embedding_deployment, "hashing" a local fake
+    embedding_backend: str = Field("azure", env="EMBEDDING_BACKEND")
+    local_embedding_dimensions: int = Field(256, env="LOCAL_EMBEDDING_DIMENSIONS")
+    embedding_cache_enabled: bool = Field(True, env="EMBEDDING_CACHE_ENABLED")
+    embedding_cache_memory_entries: int = Field(10000, env="EMBEDDING_CACHE_MEMORY_ENTRIES")
+    embedding_cache_dir: str = Field(".cache/embeddings", env="EMBEDDING_CACHE_DIR")  # relative to the app root; empty = memory only
+    
+    # Document ingestion (app.cli.ingest)
+    ingest_chunk_size: int = Field(1000, env="INGEST_CHUNK_SIZE")
+    ingest_chunk_overlap: int = Field(200, env="INGEST_CHUNK_OVERLAP")
+    ingest_batch_size: int = Field(16, env="INGEST_BATCH_SIZE")
+    ingest_concurrency: int = Field(4, env="INGEST_CONCURRENCY")
+    
+    # Batch evaluation (app.cli.evaluate)
+    evaluate_concurrency: int = Field(8, env="EVALUATE_CONCURRENCY")
+    
     # Other settings
     system_prompt: str = Field(
         "You are an AI assistant that helps people find information from their documents. Always cite your sources using the document title.",
         env="SYSTEM_PROMPT"
     )
     
+    # Streaming delivery of answers to Teams
+    stream_responses: bool = Field(True, env="STREAM_RESPONSES")
+    stream_flush_interval: float = Field(1.0, env="STREAM_FLUSH_INTERVAL")
+    
+    # Cheap 200 for activities the bot ignores, before deserializing them (app.fast_path)
+    activity_fast_path: bool = Field(True, env="ACTIVITY_FAST_PATH")
+    
+    # Citations rendered with the answer (app.citations)
+    citations_mode: str = Field("card", env="CITATIONS_MODE")  # card | text | off
+    citations_max_sources: int = Field(5, env="CITATIONS_MAX_SOURCES")
+    citations_snippet_chars: int = Field(200, env="CITATIONS_SNIPPET_CHARS")
+    citations_max_payload_bytes: int = Field(24000, env="CITATIONS_MAX_PAYLOAD_BYTES")
+    citations_card_cache_entries: int = Field(256, env="CITATIONS_CARD_CACHE_ENTRIES")
+    
+    # Background processing with proactive replies (app.background)
+    background_processing: bool = Field(False, env="BACKGROUND_PROCESSING")
+    background_workers: int = Field(8, env="BACKGROUND_WORKERS")
+    background_max_queue: int = Field(200, env="BACKGROUND_MAX_QUEUE")
+    background_drain_timeout_seconds: float = Field(30.0, env="BACKGROUND_DRAIN_TIMEOUT_SECONDS")
+    dedup_ttl_seconds: float = Field(600, env="DEDUP_TTL_SECONDS")
+    dedup_max_entries: int = Field(10000, env="DEDUP_MAX_ENTRIES")
+    
+    # Routing of small talk away from the RAG call (app.services.routing)
+    routing_enabled: bool = Field(True, env="ROUTING_ENABLED")
+    routing_canned_replies: bool = Field(True, env="ROUTING_CANNED_REPLIES")  # false = small talk on the chat route
+    routing_similarity_threshold: float = Field(0.75, env="ROUTING_SIMILARITY_THRESHOLD")
+    routing_max_small_talk_words: int = Field(8, env="ROUTING_MAX_SMALL_TALK_WORDS")
+    routing_use_embeddings: bool = Field(False, env="ROUTING_USE_EMBEDDINGS")
+    routing_chat_deployment: str = Field("", env="ROUTING_CHAT_DEPLOYMENT")  # empty = AZURE_OPENAI_GPT_DEPLOYMENT
+    routing_rag_deployment: str = Field("", env="ROUTING_RAG_DEPLOYMENT")  # empty = AZURE_OPENAI_GPT_DEPLOYMENT
+    
+    # Answer cache in front of the "On Your Data" call
+    answer_cache_enabled: bool = Field(True, env="ANSWER_CACHE_ENABLED")
+    answer_cache_backend: str = Field("memory", env="ANSWER_CACHE_BACKEND")  # memory | sqlite
+    answer_cache_path: str = Field("answer_cache.sqlite3", env="ANSWER_CACHE_PATH")
+    answer_cache_ttl_seconds: float = Field(3600, env="ANSWER_CACHE_TTL_SECONDS")
+    answer_cache_max_entries: int = Field(1000, env="ANSWER_CACHE_MAX_ENTRIES")
+    # 1.0 = exact repeats only; near-duplicates also need ANSWER_CACHE_USE_EMBEDDINGS (try 0.97)
+    answer_cache_similarity_threshold: float = Field(1.0, env="ANSWER_CACHE_SIMILARITY_THRESHOLD")
+    # Match near-duplicates with the (cached) embedding deployment
+    answer_cache_use_embeddings: bool = Field(False, env="ANSWER_CACHE_USE_EMBEDDINGS")
+    
+    # Conversation history (app.services.conversation_store)
+    history_backend: str = Field("memory", env="HISTORY_BACKEND")  # memory | sqlite
+    history_sqlite_path: str = Field("conversations.sqlite3", env="HISTORY_SQLITE_PATH")
+    history_token_budget: int = Field(2000, env="HISTORY_TOKEN_BUDGET")
+    history_idle_ttl_seconds: float = Field(3600, env="HISTORY_IDLE_TTL_SECONDS")
+    history_max_conversations: int = Field(10000, env="HISTORY_MAX_CONVERSATIONS")
+    
+    # Bot state storage for ConversationState (app.services.state_storage)
+    state_storage: str = Field("memory", env="STATE_STORAGE")  # memory | sqlite
+    state_sqlite_path: str = Field("bot_state.sqlite3", env="STATE_SQLITE_PATH")
+    state_write_behind: bool = Field(True, env="STATE_WRITE_BEHIND")  # read-through cache + batched flushes
+    state_cache_entries: int = Field(10000, env="STATE_CACHE_ENTRIES")
+    state_cache_ttl_seconds: float = Field(60, env="STATE_CACHE_TTL_SECONDS")  # 0 = never re-read
+    state_flush_interval_seconds: float = Field(1.0, env="STATE_FLUSH_INTERVAL_SECONDS")
+    state_flush_batch: int = Field(200, env="STATE_FLUSH_BATCH")
+    
+    # Token-budgeted prompt assembly (app.services.prompt_assembly); the answer reserve
+    # is OPENAI_COMPLETION_TOKEN_RESERVE
+    prompt_context_window: int = Field(8192, env="PROMPT_CONTEXT_WINDOW")
+    prompt_documents_budget: int = Field(3000, env="PROMPT_DOCUMENTS_BUDGET")
+    prompt_history_budget: int = Field(2000, env="PROMPT_HISTORY_BUDGET")
+    prompt_summary_mode: str = Field("off", env="PROMPT_SUMMARY_MODE")  # off | extractive | model
+    prompt_summary_max_tokens: int = Field(300, env="PROMPT_SUMMARY_MAX_TOKENS")
+    tokenizer_encoding: str = Field("cl100k_base", env="TOKENIZER_ENCODING")  # empty = character estimate
+    tokenizer_cache_entries: int = Field(4096, env="TOKENIZER_CACHE_ENTRIES")
+    
+    # Compression of locally retrieved documents before prompt assembly (app.services.context_compression)
+    context_compression: str = Field("extractive", env="CONTEXT_COMPRESSION")  # off | dedupe | extractive
+    context_compression_simhash_distance: int = Field(3, env="CONTEXT_COMPRESSION_SIMHASH_DISTANCE")
+    context_compression_max_document_tokens: int = Field(300, env="CONTEXT_COMPRESSION_MAX_DOCUMENT_TOKENS")
+    context_compression_min_sentences: int = Field(2, env="CONTEXT_COMPRESSION_MIN_SENTENCES")
+    
+    # Admission control for Azure OpenAI calls (app.services.admission); 0 = no budget
+    openai_requests_per_minute: float = Field(0, env="OPENAI_REQUESTS_PER_MINUTE")
+    openai_tokens_per_minute: float = Field(0, env="OPENAI_TOKENS_PER_MINUTE")
+    openai_initial_concurrency: int = Field(8, env="OPENAI_INITIAL_CONCURRENCY")
+    openai_min_concurrency: int = Field(1, env="OPENAI_MIN_CONCURRENCY")
+    openai_max_concurrency: int = Field(64, env="OPENAI_MAX_CONCURRENCY")
+    openai_max_queue: int = Field(100, env="OPENAI_MAX_QUEUE")
+    openai_queue_timeout_seconds: float = Field(10.0, env="OPENAI_QUEUE_TIMEOUT_SECONDS")
+    openai_max_retries: int = Field(3, env="OPENAI_MAX_RETRIES")
+    openai_completion_token_reserve: int = Field(800, env="OPENAI_COMPLETION_TOKEN_RESERVE")
+    
+    # Endpoint pool over AZURE_OPENAI_ENDPOINTS: hedged requests and circuit breakers (app.services.endpoint_pool)
+    openai_hedge_enabled: bool = Field(True, env="OPENAI_HEDGE_ENABLED")
+    openai_hedge_quantile: float = Field(0.95, env="OPENAI_HEDGE_QUANTILE")
+    openai_hedge_min_delay_ms: float = Field(250, env="OPENAI_HEDGE_MIN_DELAY_MS")
+    openai_hedge_initial_delay_ms: float = Field(5000, env="OPENAI_HEDGE_INITIAL_DELAY_MS")  # until the quantile is known
+    openai_hedge_max_ratio: float = Field(0.1, env="OPENAI_HEDGE_MAX_RATIO")  # hedged calls at most
+    openai_breaker_failures: int = Field(3, env="OPENAI_BREAKER_FAILURES")
+    openai_breaker_cooldown_seconds: float = Field(30, env="OPENAI_BREAKER_COOLDOWN_SECONDS")
+    
+    # Shared HTTP connection pool for Azure OpenAI (app.services.registry)
+    http_max_connections: int = Field(100, env="HTTP_MAX_CONNECTIONS")
+    http_max_keepalive_connections: int = Field(20, env="HTTP_MAX_KEEPALIVE_CONNECTIONS")
+    http_keepalive_expiry: float = Field(30.0, env="HTTP_KEEPALIVE_EXPIRY")
+    http_timeout_seconds: float = Field(60.0, env="HTTP_TIMEOUT_SECONDS")
+    http2: bool = Field(False, env="HTTP2")
+    
     # Optional port setting
     port: int = Field(8080, env="PORT")
     
+    # Async server settings (app.server)
+    web_host: str = Field("0.0.0.0", env="WEB_HOST")
+    web_port: int = Field(3978, env="WEB_PORT")
+    web_workers: int = Field(1, env="WEB_WORKERS")
+    # Build clients and fetch the first token in the background after startup (app.startup)
+    startup_prewarm: bool = Field(True, env="STARTUP_PREWARM")
+    
+    # Per-stage latency histograms served on /metrics (app.services.metrics)
+    metrics_enabled: bool = Field(True, env="METRICS_ENABLED")
+    
+    # Logging (app.logging_setup)
+    log_level: str = Field("INFO", env="LOG_LEVEL")
+    log_format: str = Field("text", env="LOG_FORMAT")  # text | json
+    log_async: bool = Field(True, env="LOG_ASYNC")  # queue handler + background writer thread
+    log_sample_rate: float = Field(1.0, env="LOG_SAMPLE_RATE")  # fraction of per-message records kept
+    log_redact: bool = Field(True, env="LOG_REDACT")  # hide message text and credentials
+    
+    # Hot reload of the settings file (app.config.provider)
+    settings_file: str = Field("", env="SETTINGS_FILE")  # empty = .env
+    settings_reload_interval_seconds: float = Field(5.0, env="SETTINGS_RELOAD_INTERVAL_SECONDS")  # 0 = no reload
+    
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
@@ -63,8 +255,13 @@ class AppSettings(BaseSettings):
         # Setting env_priority to True prioritizes environment variables over .env file
         env_priority = True
         extra = "allow"  # Eliminado para validación estricta
+        # Snapshots are immutable; changes go through a new snapshot (app.config.provider)
+        frozen = True
+        # SETTINGS_FILE and SETTINGS_RELOAD_INTERVAL_SECONDS: only model_ names are reserved
+        protected_namespaces = ("model_",)
     
-    @property
+    # Derived views are built once per snapshot and cached on it
+    @cached_property
     def openai(self) -> OpenAISettings:
         """Return OpenAI settings in the format used by the application"""
         return OpenAISettings(
@@ -73,15 +270,32 @@ class AppSettings(BaseSettings):
             embedding_deployment=self.azure_openai_embedding_deployment
         )
     
-    @property
+    @cached_property
     def search(self) -> SearchSettings:
         """Return Search settings in the format used by the application"""
         return SearchSettings(
             url=self.azure_search_service_url,
             index_name=self.azure_search_index_name
         )
+    
+    @cached_property
+    def openai_endpoint_list(self) -> List[OpenAIEndpointSettings]:
+        """Endpoints of AZURE_OPENAI_ENDPOINTS (empty when the pool is not configured)"""
+        if not self.azure_openai_endpoints.strip():
+            return []
+        return [OpenAIEndpointSettings(**endpoint) for endpoint in json.loads(self.azure_openai_endpoints)]
+    
+    @cached_property
+    def search_index_list(self) -> List[SearchIndexSettings]:
+        """Named indexes of SEARCH_INDEXES, or the single AZURE_SEARCH_INDEX_NAME index"""
+        if not self.search_indexes.strip():
+            return [SearchIndexSettings(name=self.azure_search_index_name)]
+        return [SearchIndexSettings(**index) for index in json.loads(self.search_indexes)]
 
 
 # Create settings instance - environment variables will be loaded automatically
-# This creates a singleton instance that can be imported throughout the app
-settings = AppSettings()
+# This creates a singleton provider that can be imported throughout the app; every
+# attribute read returns the value of the current snapshot
+from app.config.provider import SettingsProvider  # noqa: E402
+
+settings = SettingsProvider(AppSettings)
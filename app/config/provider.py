@@ -0,0 +1,185 @@
+"""
+Hot-reloadable settings
+
+``app.config.settings`` is a ``SettingsProvider``: attribute reads are forwarded to
+the current ``AppSettings`` snapshot, so existing ``settings.x`` code keeps working.
+On top of that the provider:
+
+1. Holds immutable (frozen) ``AppSettings`` snapshots and swaps them with a single
+   assignment, so a reader that takes ``settings.current`` once sees one
+   consistent configuration
+2. Watches the settings file (``SETTINGS_FILE``, the ``.env`` file by default) every
+   ``SETTINGS_RELOAD_INTERVAL_SECONDS`` and builds a new snapshot when it changes.
+   An invalid file is logged and the current snapshot kept
+3. Tells subscribers which fields changed, so they rebuild only the affected clients
+4. Keeps overrides set in code (``settings.x = value``, used by the CLIs) on top of
+   every reloaded snapshot
+
+Environment variables take priority over the file, as at startup: a variable set in
+the process environment cannot be changed by editing the file.
+"""
+import asyncio
+import inspect
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, FrozenSet, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Fields read once at startup; changing them in the file needs a restart
+RESTART_PREFIXES = (
+    "microsoft_app_", "allow_local_tests", "port", "web_", "log_", "metrics_enabled", "startup_prewarm",
+    "background_", "dedup_", "history_", "state_", "stream_flush_interval", "activity_fast_path", "settings_"
+)
+
+
+class SettingsProvider:
+    """
+    Current settings snapshot, file watcher and change notifications
+
+    Args:
+        settings_class: Frozen AppSettings class the snapshots are built from
+        path: Settings file to watch; empty = the class's env_file
+    """
+
+    def __init__(self, settings_class, path: str = ""):
+        object.__setattr__(self, "_settings_class", settings_class)
+        object.__setattr__(self, "_overrides", {})
+        object.__setattr__(self, "_subscribers", [])
+        object.__setattr__(self, "_task", None)
+        object.__setattr__(self, "version", 1)
+        object.__setattr__(self, "reloads", 0)
+        object.__setattr__(self, "failures", 0)
+        object.__setattr__(self, "last_reload", 0.0)
+        snapshot = settings_class()
+        default_path = settings_class.model_config.get("env_file") or ""
+        path = path or snapshot.settings_file or default_path
+        if path != default_path:
+            snapshot = settings_class(_env_file=path)
+        object.__setattr__(self, "_current", snapshot)
+        object.__setattr__(self, "path", path)
+        object.__setattr__(self, "_mtime", self._file_mtime())
+
+    @property
+    def current(self):
+        """Current immutable AppSettings snapshot"""
+        return self._current
+
+    def __getattr__(self, name: str) -> Any:
+        # Only called for names the provider itself does not have
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self._current, name)
+
+    def __setattr__(self, name: str, value: Any):
+        """Override a field in code; the override survives reloads of the file"""
+        self.override(**{name: value})
+
+    def override(self, **fields):
+        """Replace fields of the current snapshot, and of every later one"""
+        self._overrides.update(fields)
+        notifications = self._publish(self._with_overrides(self._current))
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No services running yet (CLI argument handling)
+            return
+        if notifications:
+            loop.create_task(self._notify(notifications))
+
+    def subscribe(self, callback: Callable):
+        """
+        Call ``callback(old, new, changed)`` after every change; changed is the frozenset
+        of changed field names. Coroutine functions are awaited.
+        """
+        self._subscribers.append(callback)
+
+    def _with_overrides(self, snapshot):
+        if not self._overrides:
+            return snapshot
+        # model_construct skips the environment, the values are already validated
+        return self._settings_class.model_construct(**{**snapshot.model_dump(), **self._overrides})
+
+    def _file_mtime(self) -> Optional[int]:
+        try:
+            return os.stat(self.path).st_mtime_ns if self.path else None
+        except OSError:
+            return None
+
+    @staticmethod
+    def _changed(old, new) -> FrozenSet[str]:
+        before = old.model_dump()
+        after = new.model_dump()
+        return frozenset(name for name in before.keys() | after.keys() if before.get(name) != after.get(name))
+
+    def _publish(self, snapshot) -> List:
+        """Swap in snapshot; returns the pending notifications (old, new, changed)"""
+        old = self._current
+        changed = self._changed(old, snapshot)
+        if not changed:
+            return []
+        object.__setattr__(self, "_current", snapshot)
+        object.__setattr__(self, "version", self.version + 1)
+        restart = sorted(name for name in changed if name.startswith(RESTART_PREFIXES))
+        if restart:
+            logger.warning(f"Settings changed that only take effect after a restart: {', '.join(restart)}")
+        return [(old, snapshot, changed)]
+
+    async def _notify(self, notifications: List):
+        for old, new, changed in notifications:
+            for callback in list(self._subscribers):
+                try:
+                    result = callback(old, new, changed)
+                    if inspect.isawaitable(result):
+                        await result
+                except Exception as e:
+                    logger.error(f"Settings subscriber {getattr(callback, '__qualname__', callback)} failed: {e}")
+
+    async def reload(self) -> FrozenSet[str]:
+        """Build a snapshot from the file and the environment; returns the changed fields"""
+        object.__setattr__(self, "_mtime", self._file_mtime())
+        try:
+            snapshot = self._settings_class(_env_file=self.path or None)
+        except Exception as e:
+            object.__setattr__(self, "failures", self.failures + 1)
+            logger.error(f"Invalid settings in {self.path}, keeping version {self.version}: {e}")
+            return frozenset()
+        notifications = self._publish(self._with_overrides(snapshot))
+        if not notifications:
+            return frozenset()
+        object.__setattr__(self, "reloads", self.reloads + 1)
+        object.__setattr__(self, "last_reload", time.time())
+        changed = notifications[0][2]
+        logger.info(f"Settings reloaded (version {self.version}): {', '.join(sorted(changed))}")
+        await self._notify(notifications)
+        return changed
+
+    async def _watch(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            if self._file_mtime() != self._mtime:
+                await self.reload()
+
+    def start(self):
+        """Start watching the settings file (no-op when SETTINGS_RELOAD_INTERVAL_SECONDS is 0)"""
+        interval = self._current.settings_reload_interval_seconds
+        if interval > 0 and self.path and self._task is None:
+            object.__setattr__(self, "_task", asyncio.ensure_future(self._watch(interval)))
+            logger.info(f"Watching {self.path} for settings changes every {interval:g} s")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            object.__setattr__(self, "_task", None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "reloads": self.reloads,
+            "failures": self.failures,
+            "last_reload": self.last_reload,
+            "watching": self._task is not None,
+            "overrides": sorted(self._overrides)
+        }
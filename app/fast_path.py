@@ -0,0 +1,130 @@
+"""
+Pre-filtrado rápido de actividades en ``/api/messages``
+
+Teams envía muchas actividades que el bot no usa (typing, messageReaction,
+messageUpdate, installationUpdate, conversationUpdate sin miembros nuevos...). Antes
+cada una pasaba por el parseo JSON completo, ``Activity().deserialize``, la
+autenticación y un turno del adaptador. ``ActivityFastPath``:
+
+1. Decodifica el cuerpo con ``orjson`` si está instalado (si no, con ``json``)
+2. Mira sólo el campo ``type`` (y ``membersAdded`` en conversationUpdate)
+3. Responde 200 sin más trabajo a las actividades que ``TeamsRAGBot`` ignora; el
+   resto se deserializa y sigue el camino normal
+4. Cuenta las actividades recibidas y atendidas por tipo y estima el tiempo de
+   deserialización ahorrado (omitidas × media medida en las atendidas)
+
+Las actividades omitidas no se autentican: no se procesan ni se guarda estado, así
+que no hay nada que proteger. Con ``ACTIVITY_FAST_PATH=false`` todo se deserializa
+como antes.
+"""
+import json
+import logging
+import time
+from typing import Dict, Optional, Tuple
+
+from botbuilder.schema import Activity
+
+try:
+    import orjson
+except ImportError:  # se usa json de la biblioteca estándar
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# Tipos que TeamsRAGBot atiende: mensajes, invokes (el canal espera su respuesta) y
+# conversationUpdate con miembros nuevos (saludo)
+HANDLED_TYPES = frozenset({"message", "invoke", "conversationUpdate"})
+
+# Tipos distintos que se cuentan por separado; el resto va a "other"
+MAX_COUNTED_TYPES = 32
+
+
+def loads(raw: bytes):
+    """Decodifica JSON con orjson si está disponible"""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+class ActivityFastPath:
+    """
+    Decide qué actividades merecen la deserialización completa y un turno
+
+    Args:
+        enabled: False = se atienden todas las actividades
+        handled_types: Tipos de actividad que se procesan
+    """
+
+    def __init__(self, enabled: bool = True, handled_types=HANDLED_TYPES):
+        self.enabled = enabled
+        self.handled_types = frozenset(handled_types)
+        self.received: Dict[str, int] = {}
+        self.handled: Dict[str, int] = {}
+        self.skipped = 0
+        self.decode_ms = 0.0
+        self.deserialize_ms = 0.0
+        self.deserialized = 0
+
+    def _count(self, counters: Dict[str, int], activity_type: str):
+        if activity_type not in counters and len(counters) >= MAX_COUNTED_TYPES:
+            activity_type = "other"
+        counters[activity_type] = counters.get(activity_type, 0) + 1
+
+    def _wanted(self, body: dict, activity_type: str) -> bool:
+        if not self.enabled:
+            return True
+        if activity_type not in self.handled_types:
+            return False
+        if activity_type == "conversationUpdate":
+            # Sólo interesa si entra alguien que no sea el propio bot
+            bot_id = (body.get("recipient") or {}).get("id")
+            return any((member or {}).get("id") != bot_id for member in body.get("membersAdded") or [])
+        return True
+
+    def parse(self, raw: bytes) -> Tuple[dict, Optional[Activity]]:
+        """
+        Decodifica el cuerpo y deserializa la actividad sólo si el bot la atiende
+
+        Returns:
+            (cuerpo, actividad); la actividad es None cuando basta con responder 200
+
+        Raises:
+            ValueError: El cuerpo no es un objeto JSON o está vacío
+        """
+        started = time.perf_counter()
+        body = loads(raw)
+        self.decode_ms += (time.perf_counter() - started) * 1000
+        if not isinstance(body, dict) or not body:
+            raise ValueError("Activity body is not a JSON object")
+
+        activity_type = str(body.get("type") or "unknown")
+        self._count(self.received, activity_type)
+        if not self._wanted(body, activity_type):
+            self.skipped += 1
+            logger.debug("Skipping %s activity", activity_type)
+            return body, None
+
+        self._count(self.handled, activity_type)
+        started = time.perf_counter()
+        activity = Activity().deserialize(body)
+        self.deserialize_ms += (time.perf_counter() - started) * 1000
+        self.deserialized += 1
+        return body, activity
+
+    def stats(self) -> dict:
+        received = sum(self.received.values())
+        average_deserialize_ms = self.deserialize_ms / self.deserialized if self.deserialized else 0.0
+        return {
+            "decoder": "orjson" if orjson is not None else "json",
+            "received": dict(self.received),
+            "handled": dict(self.handled),
+            "skipped": self.skipped,
+            "avg_decode_ms": round(self.decode_ms / received, 4) if received else 0.0,
+            "avg_deserialize_ms": round(average_deserialize_ms, 4),
+            "estimated_saved_ms": round(self.skipped * average_deserialize_ms, 3)
+        }
+
+
+def build_activity_fast_path(app_settings) -> ActivityFastPath:
+    """Crea el pre-filtro configurado en AppSettings"""
+    return ActivityFastPath(enabled=app_settings.activity_fast_path)
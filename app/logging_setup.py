@@ -0,0 +1,205 @@
+"""
+Logging subsystem for the bot processes
+
+Per-message logging used to be synchronous, eager and verbose (full request bodies,
+headers and message text on stdout). ``configure_logging`` replaces
+``logging.basicConfig`` in the entry points with:
+
+1. A non-blocking ``QueueHandler``: the turn only enqueues records, and a
+   ``QueueListener`` thread does the formatting and I/O
+2. Sampling of per-message records (those logged with ``extra=per_message(...)``);
+   all records of one activity are kept or dropped together
+3. Lazy wrappers (``MessageText``, ``SafeHeaders``, ``ActivitySummary``) that are
+   only rendered when a record is actually emitted, and that redact message text
+   and credentials
+4. Plain text or structured JSON output
+
+Everything is controlled by the ``LOG_*`` settings.
+"""
+import atexit
+import hashlib
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+from typing import Mapping, Optional
+
+# Attributes every LogRecord has; anything else was passed through ``extra``
+_STANDARD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+SENSITIVE_HEADERS = ("authorization", "cookie", "set-cookie", "x-ms-token", "api-key", "ocp-apim-subscription-key")
+
+TEXT_FORMAT = "%(asctime)s [%(levelname)s] %(name)s: %(message)s"
+
+# Redaction is on until configure_logging says otherwise
+_redact = True
+_max_text_length = 200
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def per_message(key: str = None) -> dict:
+    """``extra`` for per-message records; key (e.g. the activity id) keeps a message's records together"""
+    return {"sampled": True, "sample_key": key}
+
+
+class MessageText:
+    """User or bot text, rendered as its length when redaction is on"""
+
+    __slots__ = ("text",)
+
+    def __init__(self, text: Optional[str]):
+        self.text = text or ""
+
+    def __str__(self) -> str:
+        if _redact:
+            return f"<{len(self.text)} chars>"
+        if len(self.text) > _max_text_length:
+            return self.text[:_max_text_length] + "..."
+        return self.text
+
+
+class SafeHeaders:
+    """HTTP headers with credentials masked"""
+
+    __slots__ = ("headers",)
+
+    def __init__(self, headers: Mapping[str, str]):
+        self.headers = headers
+
+    def __str__(self) -> str:
+        safe = {}
+        for name, value in self.headers.items():
+            if name.lower() in SENSITIVE_HEADERS:
+                scheme = value.split(" ", 1)[0] if " " in value else ""
+                safe[name] = f"{scheme} <redacted>".strip()
+            else:
+                safe[name] = value
+        return str(safe)
+
+
+class ActivitySummary:
+    """Compact view of an Activity (object or dict) instead of its full repr"""
+
+    __slots__ = ("activity",)
+
+    def __init__(self, activity):
+        self.activity = activity
+
+    def _get(self, name: str, camel: str = None):
+        if isinstance(self.activity, dict):
+            return self.activity.get(camel or name)
+        return getattr(self.activity, name, None)
+
+    def __str__(self) -> str:
+        conversation = self._get("conversation")
+        sender = self._get("from_property", "from")
+        if isinstance(conversation, dict):
+            conversation = conversation.get("id")
+        elif conversation is not None:
+            conversation = conversation.id
+        if isinstance(sender, dict):
+            sender = sender.get("id")
+        elif sender is not None:
+            sender = sender.id
+        return (
+            f"type={self._get('type')} id={self._get('id')} channel={self._get('channel_id', 'channelId')} "
+            f"conversation={conversation} from={sender} text={MessageText(self._get('text'))}"
+        )
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a fraction of per-message records; other records always pass"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate >= 1.0 or not getattr(record, "sampled", False):
+            return True
+        key = getattr(record, "sample_key", None)
+        if key:
+            # Deterministic per key, so a message is logged completely or not at all
+            bucket = int.from_bytes(hashlib.blake2b(str(key).encode("utf-8"), digest_size=4).digest(), "big")
+            return bucket / 2 ** 32 < self.rate
+        return random.random() < self.rate
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that enqueues the record as it is
+
+    The stdlib ``prepare`` formats the message (and folds the traceback into it) on
+    the logging thread; here the ``QueueListener`` thread does it, so the lazy
+    wrappers are rendered there and ``JsonFormatter`` still sees ``exc_info``.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with the standard fields plus any ``extra`` fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for name, value in vars(record).items():
+            if name not in _STANDARD_ATTRIBUTES and name not in entry and name != "sampled" and value is not None:
+                entry[name] = value if isinstance(value, (str, int, float, bool)) else str(value)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def configure_logging(app_settings=None, force: bool = False) -> None:
+    """
+    Configure the root logger from AppSettings (LOG_LEVEL, LOG_FORMAT, LOG_ASYNC,
+    LOG_SAMPLE_RATE, LOG_REDACT); later calls are no-ops unless force is set
+    """
+    global _redact, _listener
+    root = logging.getLogger()
+    if getattr(root, "_rag_bot_configured", False) and not force:
+        return
+    if app_settings is None:
+        from app.config import settings as app_settings
+
+    _redact = app_settings.log_redact
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if app_settings.log_format == "json" else logging.Formatter(TEXT_FORMAT))
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    if app_settings.log_async:
+        # Unbounded: a full queue would otherwise block or drop records on the turn path
+        handler = DeferredQueueHandler(queue.SimpleQueue())
+        _listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=False)
+        _listener.start()
+    else:
+        handler = output
+    handler.addFilter(SamplingFilter(app_settings.log_sample_rate))
+
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(app_settings.log_level.upper())
+    root._rag_bot_configured = True
+
+
+def shutdown_logging() -> None:
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(shutdown_logging)
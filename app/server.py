@@ -0,0 +1,87 @@
+"""
+Async server launcher for the Teams RAG Bot
+
+Serves ``app.bot_app.create_async_app`` with aiohttp so that every worker process
+keeps a single long-lived event loop and handles many activities concurrently on it.
+With more than one worker, each process binds the same port with ``SO_REUSEPORT``
+and the kernel balances connections across them, so throughput scales with cores.
+
+Usage:
+    python -m app.server --workers 4 --port 3978
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+logger = logging.getLogger(__name__)
+
+
+def run_worker(host: str, port: int, reuse_port: bool):
+    """Run one aiohttp worker; imports the bot inside the process so nothing is shared across forks"""
+    from aiohttp import web
+    from app.bot_app import create_async_app
+
+    logger.info(f"Worker {os.getpid()} listening on {host}:{port}")
+    web.run_app(
+        create_async_app(),
+        host=host,
+        port=port,
+        reuse_port=reuse_port,
+        print=None
+    )
+
+
+def main(argv=None):
+    """Parse arguments and start one or more async workers"""
+    from app.config import settings
+
+    parser = argparse.ArgumentParser(description="Run the Teams RAG Bot on an async server")
+    parser.add_argument("--host", default=settings.web_host)
+    parser.add_argument("--port", type=int, default=settings.web_port)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=settings.web_workers,
+        help="Number of worker processes (0 = one per CPU core)"
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+
+    if workers == 1:
+        run_worker(args.host, args.port, reuse_port=False)
+        return
+
+    if sys.platform == "win32":
+        raise SystemExit("Multiple workers require SO_REUSEPORT, which is not available on Windows")
+
+    # "spawn" keeps each worker's clients and event loop fully independent
+    ctx = multiprocessing.get_context("spawn")
+    processes = [
+        ctx.Process(target=run_worker, args=(args.host, args.port, True), name=f"bot-worker-{i}")
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    logger.info(f"Started {workers} workers on {args.host}:{args.port}")
+
+    def _terminate(signum, frame):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, _terminate)
+    signal.signal(signal.SIGINT, _terminate)
+
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""
+Admission control and backpressure for Azure OpenAI calls
+
+Without a limit, a burst of Teams messages turns into a burst of concurrent
+completions, Azure OpenAI answers with 429s and every user waits for a timeout.
+``AdmissionController`` sits in front of every completion call and provides:
+
+1. Request-per-minute and token-per-minute budgets (token buckets)
+2. An AIMD concurrency limit: +1/limit per successful call, halved on a 429, with
+   new calls paused until the ``retry-after`` the service asked for
+3. Retries of throttled calls with jittered exponential backoff
+4. A bounded wait queue with a deadline; callers that cannot be admitted in time
+   get ``ServiceBusyError`` right away, so the bot can reply "busy" instead of
+   timing out
+"""
+import asyncio
+import logging
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Optional
+
+from app.services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceBusyError(Exception):
+    """Raised when a request is shed because the service is saturated"""
+
+
+def is_rate_limited(error: Exception) -> bool:
+    """True for HTTP 429 errors raised by the OpenAI SDK (or any error with that status)"""
+    return getattr(error, "status_code", None) == 429
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """Seconds to wait according to the retry-after-ms / retry-after response headers"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+class _TokenBucket:
+    """Budget refilled continuously at rate_per_minute; 0 disables the budget"""
+
+    def __init__(self, rate_per_minute: float):
+        self.rate_per_minute = rate_per_minute
+        self.tokens = float(rate_per_minute)
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        self._updated = now
+        self.tokens = min(self.rate_per_minute, self.tokens + elapsed * self.rate_per_minute / 60)
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until amount is available (amount is capped at the bucket size)"""
+        if not self.rate_per_minute:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.rate_per_minute)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) * 60 / self.rate_per_minute
+
+    def consume(self, amount: float):
+        if self.rate_per_minute:
+            self.tokens -= amount
+
+
+class AdmissionController:
+    """
+    Adaptive concurrency limiter with RPM/TPM budgets and a bounded wait queue
+
+    Args:
+        requests_per_minute: RPM budget (0 = unlimited)
+        tokens_per_minute: TPM budget (0 = unlimited)
+        initial_concurrency: Starting concurrency limit
+        min_concurrency: Lower bound for the adaptive limit
+        max_concurrency: Upper bound for the adaptive limit
+        max_queue: Callers allowed to wait for admission; more are shed immediately
+        queue_timeout: Seconds a caller may wait before being shed
+        max_retries: Retries of a throttled (429) call before giving up as busy
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = 0,
+        tokens_per_minute: float = 0,
+        initial_concurrency: int = 8,
+        min_concurrency: int = 1,
+        max_concurrency: int = 64,
+        max_queue: int = 100,
+        queue_timeout: float = 10.0,
+        max_retries: int = 3
+    ):
+        self._requests = _TokenBucket(requests_per_minute)
+        self._tokens = _TokenBucket(tokens_per_minute)
+        self.limit = float(initial_concurrency)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.max_retries = max_retries
+        self.in_flight = 0
+        self.waiting = 0
+        self._paused_until = 0.0
+        self._changed = asyncio.Condition()
+        self.admitted = 0
+        self.shed_queue_full = 0
+        self.shed_timeout = 0
+        self.shed_retries = 0
+        self.throttled = 0
+        self.retries = 0
+
+    def _wait_time(self, estimated_tokens: float, now: float) -> float:
+        if self._paused_until > now:
+            return self._paused_until - now
+        if self.in_flight >= int(self.limit):
+            return float("inf")  # woken up by a release
+        return max(self._requests.wait_time(1, now), self._tokens.wait_time(estimated_tokens, now))
+
+    async def _acquire(self, estimated_tokens: float):
+        if self.waiting >= self.max_queue:
+            self.shed_queue_full += 1
+            raise ServiceBusyError("Admission queue is full")
+        started = time.monotonic()
+        deadline = started + self.queue_timeout
+        self.waiting += 1
+        try:
+            async with self._changed:
+                while True:
+                    now = time.monotonic()
+                    wait = self._wait_time(estimated_tokens, now)
+                    if wait <= 0:
+                        self.in_flight += 1
+                        self.admitted += 1
+                        self._requests.consume(1)
+                        self._tokens.consume(estimated_tokens)
+                        metrics.observe("admission_wait", now - started)
+                        return
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self.shed_timeout += 1
+                        raise ServiceBusyError("Timed out waiting for admission")
+                    try:
+                        await asyncio.wait_for(self._changed.wait(), timeout=min(wait, remaining))
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            self.waiting -= 1
+
+    async def _release(self, succeeded: bool):
+        async with self._changed:
+            self.in_flight -= 1
+            if succeeded:
+                # Additive increase: about +1 per "window" of limit successful calls
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self._changed.notify_all()
+
+    @asynccontextmanager
+    async def slot(self, estimated_tokens: float = 0):
+        """Hold one admitted slot for the duration of a call (or a whole stream)"""
+        await self._acquire(estimated_tokens)
+        succeeded = False
+        try:
+            yield
+            succeeded = True
+        finally:
+            await self._release(succeeded)
+
+    def _on_throttle(self, retry_after: Optional[float]):
+        self.throttled += 1
+        # Multiplicative decrease
+        self.limit = max(self.min_concurrency, self.limit / 2)
+        if retry_after:
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+        logger.warning(f"Azure OpenAI throttled the request; concurrency limit now {self.limit:.1f}")
+
+    @staticmethod
+    def _backoff(attempt: int, retry_after: Optional[float]) -> float:
+        base = retry_after if retry_after else min(8.0, 0.5 * 2 ** (attempt - 1))
+        # Full jitter on top of the requested delay spreads out the retries of a burst
+        return base + random.uniform(0, base)
+
+    async def retry(self, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Call factory(), retrying 429s with jittered backoff; raises ServiceBusyError when exhausted"""
+        attempt = 0
+        while True:
+            try:
+                return await factory()
+            except Exception as e:
+                if not is_rate_limited(e):
+                    raise
+                retry_after = get_retry_after(e)
+                self._on_throttle(retry_after)
+                attempt += 1
+                if attempt > self.max_retries:
+                    self.shed_retries += 1
+                    raise ServiceBusyError("Azure OpenAI is throttling requests") from e
+                self.retries += 1
+                await asyncio.sleep(self._backoff(attempt, retry_after))
+
+    async def call(self, factory: Callable[[], Awaitable[Any]], estimated_tokens: float = 0) -> Any:
+        """Admit, call with retries and release"""
+        async with self.slot(estimated_tokens):
+            return await self.retry(factory)
+
+    def charge(self, extra_tokens: float):
+        """Correct the TPM budget once the real token usage is known"""
+        self._tokens.consume(extra_tokens)
+
+    def stats(self) -> dict:
+        return {
+            "concurrency_limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "queue_depth": self.waiting,
+            "admitted": self.admitted,
+            "shed_queue_full": self.shed_queue_full,
+            "shed_timeout": self.shed_timeout,
+            "shed_retries": self.shed_retries,
+            "throttled": self.throttled,
+            "retries": self.retries
+        }
+
+
+def build_admission_controller(app_settings) -> AdmissionController:
+    """Create the admission controller configured in AppSettings"""
+    return AdmissionController(
+        requests_per_minute=app_settings.openai_requests_per_minute,
+        tokens_per_minute=app_settings.openai_tokens_per_minute,
+        initial_concurrency=app_settings.openai_initial_concurrency,
+        min_concurrency=app_settings.openai_min_concurrency,
+        max_concurrency=app_settings.openai_max_concurrency,
+        max_queue=app_settings.openai_max_queue,
+        queue_timeout=app_settings.openai_queue_timeout_seconds,
+        max_retries=app_settings.openai_max_retries
+    )
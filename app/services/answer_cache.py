@@ -0,0 +1,517 @@
+"""
+Semantic answer cache for the RAG Chat Service
+
+Many Teams questions are the same FAQ asked with slightly different wording. This
+module stores the ``{message, citations}`` result of an "On Your Data" completion and
+returns it for:
+
+1. Exact repeats, matched by a hash of the normalized question text
+2. Optionally, near-duplicates, matched by cosine similarity between embeddings of
+   the questions. Questions that differ in a number or a negation never match, and
+   the hashed vectors of ``local_question_vector`` are not used for this: they
+   score "...2024" and "...2025" or "Spain" and "France" as near-identical
+
+Entries are scoped to a namespace built from the embedding deployment, the search
+index name and the conversation history, expire after a TTL and are evicted in LRU
+order. Storage is pluggable: an in-process backend by default and a SQLite backend
+for caches that should survive restarts or be shared by several workers on one host.
+SQLite queries and commits run on a dedicated thread, never on the event loop.
+
+Near-duplicate matching scores the question against a numpy matrix of the stored
+vectors of its namespace. The matrix is built once from the backend, extended on
+every store and rebuilt every ``INDEX_REFRESH_SECONDS`` so entries stored by other
+workers show up; only the best match's result is read from the backend.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import re
+import sqlite3
+import time
+import unicodedata
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Dimension of the local hashed question vectors (query routing)
+LOCAL_VECTOR_DIMENSIONS = 256
+# Age after which the vector matrix of a namespace is rebuilt from the backend
+INDEX_REFRESH_SECONDS = 30.0
+# Namespaces whose vector matrix is kept in memory (LRU)
+MAX_INDEXED_NAMESPACES = 256
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+# Words that flip the meaning of a question (Spanish and English, normalized)
+NEGATIONS = frozenset({
+    "no", "ni", "nunca", "jamas", "tampoco", "sin", "nada", "ningun", "ninguna", "ninguno",
+    "not", "never", "without", "none", "nor", "cannot", "cant", "dont", "doesnt", "didnt",
+    "isnt", "arent", "wont", "shouldnt",
+    # "don't" normalizes to "don t"
+    "t"
+})
+
+
+def normalize_question(text: str) -> str:
+    """Lowercase, strip accents and punctuation and collapse whitespace"""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = _PUNCTUATION.sub(" ", text.lower())
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def guard_terms(normalized: str) -> frozenset:
+    """Numbers and negations of a normalized question; near-duplicates must share them"""
+    return frozenset(word for word in normalized.split() if word in NEGATIONS or any(ch.isdigit() for ch in word))
+
+
+def local_question_vector(normalized: str) -> List[float]:
+    """
+    Build a cheap hashed bag-of-features vector (words and character trigrams)
+
+    Good enough to compare a message with example phrases (query routing), but not
+    to decide that two questions have the same answer.
+    """
+    vector = [0.0] * LOCAL_VECTOR_DIMENSIONS
+    features = normalized.split()
+    padded = f" {normalized} "
+    features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+    for feature in features:
+        digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=4).digest()
+        vector[int.from_bytes(digest, "little") % LOCAL_VECTOR_DIMENSIONS] += 1.0
+    return _unit(vector)
+
+
+def _unit(vector: List[float]) -> List[float]:
+    norm = math.sqrt(sum(v * v for v in vector))
+    return [v / norm for v in vector] if norm else list(vector)
+
+
+@dataclass
+class CacheEntry:
+    """A cached completion result and the data needed to match and report on it"""
+    key: str
+    namespace: str
+    question: str
+    vector: List[float]
+    result: dict
+    created_at: float
+    tokens: int = 0
+    latency_ms: float = 0.0
+
+
+@dataclass
+class CacheStats:
+    """Counters reported by AnswerCache.stats()"""
+    lookups: int = 0
+    exact_hits: int = 0
+    near_hits: int = 0
+    misses: int = 0
+    stores: int = 0
+    tokens_saved: int = 0
+    latency_saved_ms: float = 0.0
+    lookup_time_ms: float = 0.0
+
+    def as_dict(self) -> dict:
+        hits = self.exact_hits + self.near_hits
+        return {
+            "lookups": self.lookups,
+            "hits": hits,
+            "exact_hits": self.exact_hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "hit_rate": hits / self.lookups if self.lookups else 0.0,
+            "tokens_saved": self.tokens_saved,
+            "latency_saved_ms": round(self.latency_saved_ms, 1),
+            "avg_lookup_ms": round(self.lookup_time_ms / self.lookups, 3) if self.lookups else 0.0
+        }
+
+
+class CacheBackend(ABC):
+    """Storage interface for answer cache entries"""
+
+    # True when calls do I/O and must run off the event loop
+    blocking = False
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[CacheEntry]:
+        """Return the entry for key and mark it as recently used"""
+
+    @abstractmethod
+    def set(self, entry: CacheEntry) -> None:
+        """Insert or replace an entry, evicting the least recently used if full"""
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """Remove an entry if present"""
+
+    @abstractmethod
+    def entries(self, namespace: str) -> Iterable[CacheEntry]:
+        """Iterate over the entries of a namespace"""
+
+    @abstractmethod
+    def __len__(self) -> int:
+        """Number of stored entries"""
+
+    def vectors(self, namespace: str) -> List[Tuple[str, str, float, List[float]]]:
+        """(key, question, created_at, vector) of the entries of a namespace"""
+        return [(entry.key, entry.question, entry.created_at, entry.vector) for entry in self.entries(namespace)]
+
+    def close(self) -> None:
+        """Release the storage"""
+
+
+class MemoryCacheBackend(CacheBackend):
+    """In-process LRU backend (default)"""
+
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def set(self, entry: CacheEntry) -> None:
+        self._entries[entry.key] = entry
+        self._entries.move_to_end(entry.key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    def entries(self, namespace: str) -> Iterable[CacheEntry]:
+        return [entry for entry in self._entries.values() if entry.namespace == namespace]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """SQLite backend; the LRU order is kept in a last_access column"""
+
+    blocking = True
+
+    def __init__(self, path: str, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS answer_cache (
+                key TEXT PRIMARY KEY,
+                namespace TEXT NOT NULL,
+                question TEXT NOT NULL,
+                vector TEXT NOT NULL,
+                result TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                tokens INTEGER NOT NULL,
+                latency_ms REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answer_cache_ns ON answer_cache(namespace)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answer_cache_lru ON answer_cache(last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def _row_to_entry(row) -> CacheEntry:
+        return CacheEntry(
+            key=row[0],
+            namespace=row[1],
+            question=row[2],
+            vector=json.loads(row[3]),
+            result=json.loads(row[4]),
+            created_at=row[5],
+            tokens=row[6],
+            latency_ms=row[7]
+        )
+
+    _COLUMNS = "key, namespace, question, vector, result, created_at, tokens, latency_ms"
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        row = self._conn.execute(
+            f"SELECT {self._COLUMNS} FROM answer_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        self._conn.execute("UPDATE answer_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+        self._conn.commit()
+        return self._row_to_entry(row)
+
+    def set(self, entry: CacheEntry) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO answer_cache VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                entry.key, entry.namespace, entry.question, json.dumps(entry.vector),
+                json.dumps(entry.result), entry.created_at, entry.tokens, entry.latency_ms,
+                time.time()
+            )
+        )
+        self._conn.execute(
+            """
+            DELETE FROM answer_cache WHERE key IN (
+                SELECT key FROM answer_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?
+            )
+            """,
+            (self.max_entries,)
+        )
+        self._conn.commit()
+
+    def delete(self, key: str) -> None:
+        self._conn.execute("DELETE FROM answer_cache WHERE key = ?", (key,))
+        self._conn.commit()
+
+    def entries(self, namespace: str) -> Iterable[CacheEntry]:
+        rows = self._conn.execute(
+            f"SELECT {self._COLUMNS} FROM answer_cache WHERE namespace = ?", (namespace,)
+        ).fetchall()
+        return [self._row_to_entry(row) for row in rows]
+
+    def vectors(self, namespace: str) -> List[Tuple[str, str, float, List[float]]]:
+        # Results are not decoded: only the best match's is read, with get()
+        rows = self._conn.execute(
+            "SELECT key, question, created_at, vector FROM answer_cache WHERE namespace = ?", (namespace,)
+        ).fetchall()
+        return [(key, question, created_at, json.loads(vector)) for key, question, created_at, vector in rows]
+
+    def __len__(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM answer_cache").fetchone()[0]
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class _VectorIndex:
+    """Vectors of one namespace as a matrix, with the data needed to filter matches"""
+
+    def __init__(self, rows: List[Tuple[str, str, float, List[float]]]):
+        self.built_at = time.monotonic()
+        dimensions = len(rows[-1][3]) if rows else 0
+        # Entries embedded with another deployment (other dimension) are left out
+        rows = [row for row in rows if len(row[3]) == dimensions and dimensions]
+        self.keys = [row[0] for row in rows]
+        self.questions = [row[1] for row in rows]
+        self.created_at = [row[2] for row in rows]
+        self.matrix = np.asarray([row[3] for row in rows], dtype=np.float32).reshape(len(rows), dimensions)
+
+    def add(self, key: str, question: str, created_at: float, vector: List[float]):
+        if len(self.keys) and len(vector) != self.matrix.shape[1]:
+            return
+        row = np.asarray(vector, dtype=np.float32)
+        if key in self.keys:
+            position = self.keys.index(key)
+            self.matrix[position] = row
+            self.created_at[position] = created_at
+            return
+        self.keys.append(key)
+        self.questions.append(question)
+        self.created_at.append(created_at)
+        self.matrix = np.vstack([self.matrix.reshape(-1, len(row)), row])
+
+
+class AnswerCache:
+    """
+    Exact and near-duplicate cache for RAG answers
+
+    Args:
+        backend: Storage backend (MemoryCacheBackend by default)
+        ttl_seconds: Age after which an entry is treated as missing and removed
+        similarity_threshold: Minimum cosine similarity for a near-duplicate hit; 1.0
+            (default) disables near-duplicate matching. Only used with embed; around
+            0.97 is a reasonable starting point for embedding deployments
+        embed: Optional async function returning the embedding of a question; without
+            it only exact repeats are matched
+    """
+
+    def __init__(
+        self,
+        backend: CacheBackend = None,
+        ttl_seconds: float = 3600,
+        similarity_threshold: float = 1.0,
+        embed: Callable[[str], Awaitable[List[float]]] = None
+    ):
+        self.backend = backend if backend is not None else MemoryCacheBackend()
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.embed = embed
+        self._stats = CacheStats()
+        # One thread runs every call of a blocking backend, which also serializes them
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="answer-cache") if self.backend.blocking else None
+        self._indexes: "OrderedDict[str, _VectorIndex]" = OrderedDict()
+        self._entries = len(self.backend)
+
+    async def _call(self, function, *args):
+        if self._executor is None:
+            return function(*args)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    @property
+    def matches_near_duplicates(self) -> bool:
+        return self.embed is not None and self.similarity_threshold < 1.0
+
+    @staticmethod
+    def build_namespace(
+        embedding_deployment: str,
+        index_name: str,
+        history_signature: str = "",
+        settings_signature: str = ""
+    ) -> str:
+        """Scope entries to the embedding deployment, index, conversation history and answer settings"""
+        return f"{embedding_deployment}|{index_name}|{settings_signature}|{history_signature}"
+
+    @staticmethod
+    def _key(namespace: str, normalized: str) -> str:
+        return hashlib.sha256(f"{namespace}\n{normalized}".encode("utf-8")).hexdigest()
+
+    async def _vector(self, normalized: str) -> List[float]:
+        return _unit(list(await self.embed(normalized)))
+
+    def _expired(self, entry: CacheEntry, now: float) -> bool:
+        return self.ttl_seconds > 0 and now - entry.created_at > self.ttl_seconds
+
+    async def _index(self, namespace: str) -> _VectorIndex:
+        """Vector matrix of a namespace, (re)built from the backend when missing or old"""
+        index = self._indexes.get(namespace)
+        if index is None or time.monotonic() - index.built_at > INDEX_REFRESH_SECONDS:
+            index = _VectorIndex(await self._call(self.backend.vectors, namespace))
+            self._indexes[namespace] = index
+            if len(self._indexes) > MAX_INDEXED_NAMESPACES:
+                self._indexes.popitem(last=False)
+        self._indexes.move_to_end(namespace)
+        return index
+
+    def _get_fresh(self, key: str, now: float) -> Optional[CacheEntry]:
+        """Entry for key, deleting it when expired"""
+        entry = self.backend.get(key)
+        if entry is not None and self._expired(entry, now):
+            self.backend.delete(entry.key)
+            return None
+        return entry
+
+    async def _near_duplicate(self, normalized: str, namespace: str, now: float) -> Optional[CacheEntry]:
+        vector = np.asarray(await self._vector(normalized), dtype=np.float32)
+        index = await self._index(namespace)
+        if not index.keys or index.matrix.shape[1] != len(vector):
+            return None
+        guard = guard_terms(normalized)
+        scores = index.matrix @ vector
+        for position in np.argsort(-scores):
+            score = float(scores[position])
+            if score < self.similarity_threshold:
+                break
+            if self.ttl_seconds > 0 and now - index.created_at[position] > self.ttl_seconds:
+                continue
+            if guard_terms(index.questions[position]) != guard:
+                continue
+            # Also refreshes the LRU position; None when evicted since the index was built
+            entry = await self._call(self._get_fresh, index.keys[position], now)
+            if entry is not None:
+                logger.debug(f"Near-duplicate cache hit (similarity {score:.3f})")
+                return entry
+        return None
+
+    async def lookup(self, question: str, namespace: str) -> Optional[dict]:
+        """Return a cached result for the question, or None on a miss"""
+        started = time.perf_counter()
+        normalized = normalize_question(question)
+        now = time.time()
+        self._stats.lookups += 1
+        try:
+            entry = await self._call(self._get_fresh, self._key(namespace, normalized), now)
+            if entry is not None:
+                self._stats.exact_hits += 1
+                return self._hit(entry)
+
+            if self.matches_near_duplicates:
+                entry = await self._near_duplicate(normalized, namespace, now)
+                if entry is not None:
+                    self._stats.near_hits += 1
+                    return self._hit(entry)
+
+            self._stats.misses += 1
+            return None
+        finally:
+            self._stats.lookup_time_ms += (time.perf_counter() - started) * 1000
+
+    def _hit(self, entry: CacheEntry) -> dict:
+        self._stats.tokens_saved += entry.tokens
+        self._stats.latency_saved_ms += entry.latency_ms
+        return dict(entry.result)
+
+    async def store(
+        self,
+        question: str,
+        namespace: str,
+        result: dict,
+        tokens: int = 0,
+        latency_ms: float = 0.0
+    ) -> None:
+        """Store the result of an upstream completion"""
+        normalized = normalize_question(question)
+        if not normalized:
+            return
+        # Vectors are only needed to match near-duplicates
+        vector = await self._vector(normalized) if self.matches_near_duplicates else []
+        entry = CacheEntry(
+            key=self._key(namespace, normalized),
+            namespace=namespace,
+            question=normalized,
+            vector=vector,
+            result={"message": result.get("message"), "citations": result.get("citations", [])},
+            created_at=time.time(),
+            tokens=tokens,
+            latency_ms=latency_ms
+        )
+        self._entries = await self._call(self._set, entry)
+        self._stats.stores += 1
+        index = self._indexes.get(namespace)
+        if index is not None and vector:
+            index.add(entry.key, entry.question, entry.created_at, vector)
+
+    def _set(self, entry: CacheEntry) -> int:
+        self.backend.set(entry)
+        return len(self.backend)
+
+    async def close(self):
+        """Close the backend and its thread"""
+        await self._call(self.backend.close)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    def stats(self) -> dict:
+        """Hit rate, tokens and latency saved, and lookup overhead"""
+        return {**self._stats.as_dict(), "entries": self._entries}
+
+
+def build_answer_cache(app_settings, embed=None) -> Optional[AnswerCache]:
+    """Create the answer cache configured in AppSettings, or None when disabled"""
+    if not app_settings.answer_cache_enabled:
+        return None
+    if app_settings.answer_cache_backend == "sqlite":
+        backend = SQLiteCacheBackend(
+            app_settings.answer_cache_path,
+            max_entries=app_settings.answer_cache_max_entries
+        )
+    else:
+        backend = MemoryCacheBackend(max_entries=app_settings.answer_cache_max_entries)
+    return AnswerCache(
+        backend=backend,
+        ttl_seconds=app_settings.answer_cache_ttl_seconds,
+        similarity_threshold=app_settings.answer_cache_similarity_threshold,
+        embed=embed
+    )
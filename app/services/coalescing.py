@@ -0,0 +1,121 @@
+"""
+Single-flight request coalescing
+
+When an announcement goes out, many users ask the same question within seconds.
+``SingleFlight`` makes concurrent callers with the same key share one upstream
+request instead of each firing its own completion:
+
+- ``run()`` coalesces coroutines: followers await the leader's result
+- ``stream()`` coalesces async generators: followers replay the leader's events,
+  including the ones produced before they joined
+
+The shared work runs in its own task, so a leader that is cancelled (for example
+because its Teams request was dropped) does not cancel the followers.
+"""
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class _Broadcast:
+    """Events of one shared stream, replayable by any number of subscribers"""
+
+    def __init__(self):
+        self.events = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.changed = asyncio.Condition()
+
+
+class SingleFlight:
+    """Deduplicates concurrent identical requests and counts what was saved"""
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+        self._streams: Dict[str, _Broadcast] = {}
+        self.leaders = 0
+        self.merged = 0
+        self.tokens_avoided = 0
+
+    async def run(
+        self,
+        key: str,
+        factory: Callable[[], Awaitable[Any]],
+        weight: Callable[[Any], int] = None
+    ) -> Any:
+        """
+        Await factory() once per key among concurrent callers
+
+        Args:
+            key: Identity of the request (normalized prompt + history signature)
+            factory: Creates the upstream coroutine; only called by the leader
+            weight: Optional function returning the tokens a result cost, used to
+                report the tokens avoided by merged callers
+        """
+        task = self._calls.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(factory())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+            return await asyncio.shield(task)
+
+        self.merged += 1
+        result = await asyncio.shield(task)
+        if weight is not None:
+            self.tokens_avoided += weight(result)
+        logger.debug("Merged request into an in-flight completion")
+        return result
+
+    async def stream(self, key: str, factory: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        """Iterate factory() once per key; concurrent callers receive the same events"""
+        broadcast = self._streams.get(key)
+        if broadcast is None:
+            self.leaders += 1
+            broadcast = _Broadcast()
+            self._streams[key] = broadcast
+            asyncio.ensure_future(self._pump(key, broadcast, factory))
+        else:
+            self.merged += 1
+            logger.debug("Merged stream into an in-flight completion")
+
+        index = 0
+        while True:
+            async with broadcast.changed:
+                await broadcast.changed.wait_for(lambda: len(broadcast.events) > index or broadcast.done)
+                pending = broadcast.events[index:]
+                finished = broadcast.done
+            for event in pending:
+                yield event
+            index += len(pending)
+            if finished and index >= len(broadcast.events):
+                if broadcast.error is not None:
+                    raise broadcast.error
+                return
+
+    async def _pump(self, key: str, broadcast: _Broadcast, factory: Callable[[], AsyncIterator[Any]]):
+        try:
+            async for event in factory():
+                async with broadcast.changed:
+                    broadcast.events.append(event)
+                    broadcast.changed.notify_all()
+        except BaseException as e:
+            broadcast.error = e
+        finally:
+            # New callers from now on start a fresh request
+            self._streams.pop(key, None)
+            async with broadcast.changed:
+                broadcast.done = True
+                broadcast.changed.notify_all()
+
+    def stats(self) -> dict:
+        total = self.leaders + self.merged
+        return {
+            "upstream_requests": self.leaders,
+            "merged_requests": self.merged,
+            "merge_rate": self.merged / total if total else 0.0,
+            "tokens_avoided": self.tokens_avoided,
+            "in_flight": len(self._calls) + len(self._streams)
+        }
@@ -0,0 +1,244 @@
+"""
+Compression of retrieved context before the prompt is built
+
+With local or fan-out retrieval, ``RagChatService`` grounds answers with the chunks
+it retrieved itself, and every token of them is paid for. Chunks often repeat each
+other: consecutive chunks of a document share their overlap, and the same document
+is indexed in several places. ``ContextCompressor`` shrinks the chunks in rank
+order (``CONTEXT_COMPRESSION``):
+
+1. ``dedupe``: chunks whose SimHash fingerprint is within
+   ``CONTEXT_COMPRESSION_SIMHASH_DISTANCE`` bits of a better ranked chunk are
+   dropped, and so are sentences a better ranked chunk already contains
+2. ``extractive``: additionally, the sentences of every chunk are scored against
+   the query (BM25 IDF-weighted term overlap, plus half the score of a neighbouring
+   sentence, which often holds the answer) and the best ones are kept in their
+   original order, up to ``CONTEXT_COMPRESSION_MAX_DOCUMENT_TOKENS`` per chunk.
+   A chunk without any query term keeps its first sentences
+
+Document tokens before and after every compression are aggregated in ``stats()``
+(exposed on ``/metrics``). With "On Your Data" Azure injects the chunks server-side
+and nothing is compressed. ``python -m app.benchmarks.compression`` measures the
+savings and how much answer evidence survives on a bundled sample corpus.
+"""
+import hashlib
+import logging
+import math
+import re
+import time
+from dataclasses import dataclass, replace
+from typing import List, Optional, Set
+
+import numpy as np
+
+from app.services.prompt_assembly import Tokenizer
+from app.services.retrieval.base import RetrievedDocument
+from app.services.retrieval.bm25 import tokenize
+
+logger = logging.getLogger(__name__)
+
+MODES = ("off", "dedupe", "extractive")
+
+SIMHASH_BITS = 64
+# Words per shingle of the SimHash fingerprint
+SHINGLE_WORDS = 3
+# Sentences shorter than this (in words) are never dropped as repeated
+MIN_REPEATED_WORDS = 4
+
+_SENTENCE_END = re.compile(r"(?<=[.!?;:])\s+|\s*\n+\s*")
+
+
+def split_sentences(text: str) -> List[str]:
+    """Sentences of text, split after . ! ? ; : and at line breaks"""
+    return [sentence.strip() for sentence in _SENTENCE_END.split(text or "") if sentence.strip()]
+
+
+def simhash(text: str, bits: int = SIMHASH_BITS) -> int:
+    """SimHash fingerprint of the word shingles of text"""
+    words = tokenize(text)
+    shingles = [" ".join(words[i:i + SHINGLE_WORDS]) for i in range(max(len(words) - SHINGLE_WORDS + 1, 1))]
+    digests = b"".join(
+        hashlib.blake2b(shingle.encode("utf-8"), digest_size=bits // 8).digest() for shingle in shingles
+    )
+    # One row of bits per shingle; a fingerprint bit is set when most shingles set it
+    votes = np.unpackbits(np.frombuffer(digests, dtype=np.uint8)).reshape(len(shingles), bits).sum(axis=0)
+    return int.from_bytes(np.packbits(votes * 2 > len(shingles)).tobytes(), "big")
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+@dataclass
+class CompressedContext:
+    """Documents after compression and their tokens before and after"""
+    documents: List[RetrievedDocument]
+    tokens_before: int
+    tokens_after: int
+    duplicates: int = 0
+    sentences_dropped: int = 0
+
+
+class ContextCompressor:
+    """
+    Removes repeated and off-query text from retrieved documents
+
+    Args:
+        tokenizer: Token counter (shared with the prompt assembler)
+        mode: off | dedupe | extractive
+        simhash_distance: Maximum differing fingerprint bits of near-duplicate chunks
+        max_document_tokens: Tokens kept per document in extractive mode
+        min_sentences: Sentences kept per document in extractive mode even without query terms
+    """
+
+    def __init__(
+        self,
+        tokenizer: Tokenizer = None,
+        mode: str = "extractive",
+        simhash_distance: int = 3,
+        max_document_tokens: int = 300,
+        min_sentences: int = 2
+    ):
+        self.tokenizer = tokenizer or Tokenizer()
+        self.mode = mode if mode in MODES else "extractive"
+        self.simhash_distance = simhash_distance
+        self.max_document_tokens = max_document_tokens
+        self.min_sentences = min_sentences
+        self.calls = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+        self.duplicates = 0
+        self.sentences_dropped = 0
+        self.total_ms = 0.0
+
+    def _tokens(self, documents: List[RetrievedDocument]) -> int:
+        return sum(self.tokenizer.count(document.content) for document in documents)
+
+    def _drop_near_duplicates(self, documents: List[RetrievedDocument]) -> List[RetrievedDocument]:
+        kept, fingerprints = [], []
+        for document in documents:
+            fingerprint = simhash(document.content)
+            if any(hamming_distance(fingerprint, other) <= self.simhash_distance for other in fingerprints):
+                continue
+            kept.append(document)
+            fingerprints.append(fingerprint)
+        return kept
+
+    @staticmethod
+    def _idf(query_terms: Set[str], sentences: List[Set[str]]) -> dict:
+        """
+        BM25 IDF of the query terms over every candidate sentence
+
+        Terms in half of the sentences or more (articles, prepositions) get no weight.
+        """
+        total = len(sentences)
+        idf = {}
+        for term in query_terms:
+            frequency = sum(1 for words in sentences if term in words)
+            weight = math.log((total - frequency + 0.5) / (frequency + 0.5)) if frequency else 0.0
+            if weight > 0:
+                idf[term] = weight
+        return idf
+
+    def _select(self, sentences: List[str], words: List[Set[str]], idf: dict) -> List[str]:
+        """Best sentences for the query within the per-document budget, in document order"""
+        scores = [sum(idf.get(term, 0.0) for term in sentence_words) for sentence_words in words]
+        ranked_scores = [
+            score + 0.5 * max(scores[i - 1] if i > 0 else 0.0, scores[i + 1] if i + 1 < len(scores) else 0.0)
+            for i, score in enumerate(scores)
+        ]
+        if not any(scores):
+            # Nothing matches the query: keep the beginning of the document
+            order = list(range(len(sentences)))
+        else:
+            order = sorted(range(len(sentences)), key=lambda i: (-ranked_scores[i], i))
+        chosen, used = [], 0
+        for position, i in enumerate(order):
+            relevant = ranked_scores[i] > 0 or position < self.min_sentences
+            if not relevant:
+                break
+            cost = self.tokenizer.count(sentences[i])
+            if used + cost > self.max_document_tokens:
+                if not chosen:
+                    # A single long sentence: keep its beginning
+                    return [self.tokenizer.truncate(sentences[i], self.max_document_tokens)]
+                continue
+            chosen.append(i)
+            used += cost
+        return [sentences[i] for i in sorted(chosen)]
+
+    def compress(self, query: str, documents: List[RetrievedDocument]) -> CompressedContext:
+        """Compressed copies of documents (best first), dropping the ones left empty"""
+        started = time.perf_counter()
+        tokens_before = self._tokens(documents)
+        if self.mode == "off" or not documents:
+            return CompressedContext(list(documents), tokens_before, tokens_before)
+
+        unique = self._drop_near_duplicates(documents)
+        duplicates = len(documents) - len(unique)
+
+        split = [split_sentences(document.content) for document in unique]
+        words = [[tokenize(sentence) for sentence in sentences] for sentences in split]
+        query_terms = set(tokenize(query))
+        idf = self._idf(query_terms, [set(w) for sentence_words in words for w in sentence_words])
+
+        compressed, dropped = [], 0
+        seen_text = ""
+        for document, sentences, sentence_words in zip(unique, split, words):
+            fresh, fresh_words = [], []
+            for sentence, tokens in zip(sentences, sentence_words):
+                # Text already sent with a better ranked chunk (chunk overlap, copies)
+                if len(tokens) >= MIN_REPEATED_WORDS and f" {' '.join(tokens)} " in seen_text:
+                    dropped += 1
+                    continue
+                fresh.append(sentence)
+                fresh_words.append(set(tokens) & query_terms)
+            if self.mode == "extractive" and fresh:
+                kept = self._select(fresh, fresh_words, idf)
+                dropped += len(fresh) - len(kept)
+                fresh = kept
+            if not fresh:
+                continue
+            content = " ".join(fresh)
+            seen_text += f" {' '.join(tokenize(content))} "
+            compressed.append(replace(document, content=content) if content != document.content else document)
+
+        tokens_after = self._tokens(compressed)
+        self.calls += 1
+        self.tokens_before += tokens_before
+        self.tokens_after += tokens_after
+        self.duplicates += duplicates
+        self.sentences_dropped += dropped
+        self.total_ms += (time.perf_counter() - started) * 1000
+        logger.debug(
+            f"Context compressed from {tokens_before} to {tokens_after} tokens "
+            f"({duplicates} near-duplicate chunks, {dropped} sentences dropped)"
+        )
+        return CompressedContext(compressed, tokens_before, tokens_after, duplicates, dropped)
+
+    def stats(self) -> dict:
+        """Document tokens before and after compression since startup"""
+        calls = self.calls or 1
+        return {
+            "mode": self.mode,
+            "calls": self.calls,
+            "avg_tokens_before": round(self.tokens_before / calls, 1),
+            "avg_tokens_after": round(self.tokens_after / calls, 1),
+            "reduction": round(1 - self.tokens_after / self.tokens_before, 4) if self.tokens_before else 0.0,
+            "near_duplicates": self.duplicates,
+            "sentences_dropped": self.sentences_dropped,
+            "avg_ms": round(self.total_ms / calls, 3)
+        }
+
+
+def build_context_compressor(app_settings, tokenizer: Tokenizer = None) -> Optional[ContextCompressor]:
+    """Create the context compressor configured in AppSettings, or None when disabled"""
+    if app_settings.context_compression == "off":
+        return None
+    return ContextCompressor(
+        tokenizer,
+        mode=app_settings.context_compression,
+        simhash_distance=app_settings.context_compression_simhash_distance,
+        max_document_tokens=app_settings.context_compression_max_document_tokens,
+        min_sentences=app_settings.context_compression_min_sentences
+    )
@@ -0,0 +1,357 @@
+"""
+Conversation history store for the Teams bots
+
+Keeps the recent turns of every Teams conversation, keyed by the conversation id,
+so they can be sent to ``RagChatService.get_chat_completion`` as history:
+
+1. History is trimmed by a token budget (newest turns first), not by message count,
+   so prompt size and latency stay bounded on long threads
+2. Turns are stored compactly: one tuple of (role code, content, token count) each,
+   inside a slotted per-conversation record
+3. Conversations idle for longer than a TTL are evicted, and the number of live
+   conversations is capped in LRU order
+4. An optional SQLite backend keeps history across restarts; its queries and
+   commits run off the event loop
+"""
+import asyncio
+import logging
+import sqlite3
+import sys
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+
+from app.models.chat_models import ChatMessage
+
+logger = logging.getLogger(__name__)
+
+_ROLE_CODES = {"user": 0, "assistant": 1, "system": 2}
+_ROLE_NAMES = {code: role for role, code in _ROLE_CODES.items()}
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate (about four characters per token)"""
+    return len(text) // 4 + 1 if text else 0
+
+
+class _Conversation:
+    """Compact per-conversation record"""
+    __slots__ = ("turns", "tokens", "last_access")
+
+    def __init__(self):
+        self.turns = deque()
+        self.tokens = 0
+        self.last_access = time.time()
+
+
+class ConversationStore(ABC):
+    """
+    Base class for conversation history stores
+
+    Args:
+        token_budget: Maximum tokens of history kept (and returned) per conversation
+        idle_ttl_seconds: Conversations not used for this long are evicted
+        max_conversations: Maximum number of conversations kept (LRU eviction)
+        count_tokens: Function used to count the tokens of a message
+    """
+
+    def __init__(
+        self,
+        token_budget: int = 2000,
+        idle_ttl_seconds: float = 3600,
+        max_conversations: int = 10000,
+        count_tokens: Callable[[str], int] = estimate_tokens
+    ):
+        self.token_budget = token_budget
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.max_conversations = max_conversations
+        self.count_tokens = count_tokens
+        self._exchanges = 0
+
+    # Idle conversations are swept every this many stored exchanges
+    EVICT_EVERY = 256
+
+    @abstractmethod
+    async def get_history(self, conversation_id: str) -> List[ChatMessage]:
+        """Return the stored history of a conversation, oldest first"""
+
+    @abstractmethod
+    async def append(self, conversation_id: str, role: str, content: str) -> None:
+        """Add a message and trim the conversation to the token budget"""
+
+    @abstractmethod
+    async def clear(self, conversation_id: str) -> None:
+        """Forget a conversation"""
+
+    @abstractmethod
+    async def evict_idle(self) -> int:
+        """Evict idle conversations and return how many were removed"""
+
+    @abstractmethod
+    def stats(self) -> dict:
+        """Counters for monitoring"""
+
+    async def append_exchange(self, conversation_id: str, user_message: str, assistant_message: str) -> None:
+        """Store one user question and the assistant answer"""
+        await self.append(conversation_id, "user", user_message)
+        await self.append(conversation_id, "assistant", assistant_message)
+        self._exchanges += 1
+        if self._exchanges % self.EVICT_EVERY == 0:
+            removed = await self.evict_idle()
+            if removed:
+                logger.info(f"Evicted {removed} idle conversations")
+
+
+class MemoryConversationStore(ConversationStore):
+    """In-process store (default)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._conversations: "OrderedDict[str, _Conversation]" = OrderedDict()
+        self._evicted = 0
+
+    async def get_history(self, conversation_id: str) -> List[ChatMessage]:
+        conversation = self._conversations.get(conversation_id)
+        if conversation is None:
+            return []
+        if self._is_idle(conversation, time.time()):
+            self._remove(conversation_id)
+            return []
+        conversation.last_access = time.time()
+        self._conversations.move_to_end(conversation_id)
+        return [ChatMessage(role=_ROLE_NAMES[role], content=content) for role, content, _ in conversation.turns]
+
+    async def append(self, conversation_id: str, role: str, content: str) -> None:
+        if not content:
+            return
+        conversation = self._conversations.get(conversation_id)
+        if conversation is None:
+            conversation = _Conversation()
+            self._conversations[conversation_id] = conversation
+        tokens = self.count_tokens(content)
+        conversation.turns.append((_ROLE_CODES.get(role, 0), content, tokens))
+        conversation.tokens += tokens
+        # Drop the oldest turns until the conversation fits the budget
+        while conversation.tokens > self.token_budget and len(conversation.turns) > 1:
+            _, _, dropped = conversation.turns.popleft()
+            conversation.tokens -= dropped
+        conversation.last_access = time.time()
+        self._conversations.move_to_end(conversation_id)
+
+        while len(self._conversations) > self.max_conversations:
+            self._conversations.popitem(last=False)
+            self._evicted += 1
+
+    async def clear(self, conversation_id: str) -> None:
+        self._conversations.pop(conversation_id, None)
+
+    def _is_idle(self, conversation: _Conversation, now: float) -> bool:
+        return self.idle_ttl_seconds > 0 and now - conversation.last_access > self.idle_ttl_seconds
+
+    def _remove(self, conversation_id: str):
+        self._conversations.pop(conversation_id, None)
+        self._evicted += 1
+
+    async def evict_idle(self) -> int:
+        now = time.time()
+        removed = 0
+        # Conversations are kept in access order, so idle ones are at the front
+        while self._conversations:
+            conversation_id, conversation = next(iter(self._conversations.items()))
+            if not self._is_idle(conversation, now):
+                break
+            self._remove(conversation_id)
+            removed += 1
+        return removed
+
+    def memory_usage_bytes(self) -> int:
+        """Approximate memory held by the stored conversations"""
+        total = sys.getsizeof(self._conversations)
+        for conversation_id, conversation in self._conversations.items():
+            total += sys.getsizeof(conversation_id) + sys.getsizeof(conversation)
+            total += sys.getsizeof(conversation.turns)
+            for turn in conversation.turns:
+                total += sys.getsizeof(turn) + sys.getsizeof(turn[1])
+        return total
+
+    def stats(self) -> dict:
+        active = len(self._conversations)
+        memory = self.memory_usage_bytes()
+        return {
+            "backend": "memory",
+            "active_conversations": active,
+            "evicted_conversations": self._evicted,
+            "memory_bytes": memory,
+            "bytes_per_1k_conversations": int(memory / active * 1000) if active else 0
+        }
+
+
+class SQLiteConversationStore(ConversationStore):
+    """
+    SQLite-backed store; history survives restarts and is shared by local workers
+
+    Every query and commit (an fsync with WAL) runs on one dedicated thread, which
+    also serializes access to the connection, so the event loop never waits on disk.
+    """
+
+    def __init__(self, path: str, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="conversation-store")
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS conversation_turns (
+                conversation_id TEXT NOT NULL,
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                role INTEGER NOT NULL,
+                content TEXT NOT NULL,
+                tokens INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS conversation_turns_id ON conversation_turns(conversation_id, seq);
+            CREATE TABLE IF NOT EXISTS conversations (
+                conversation_id TEXT PRIMARY KEY,
+                last_access REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS conversations_access ON conversations(last_access);
+            """
+        )
+        self._conn.commit()
+        self._evicted = 0
+        self._active = self._count()
+
+    async def _run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    def _count(self) -> int:
+        # Refreshed on the store thread after every change, so stats() never touches the connection
+        return self._conn.execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+
+    def _touch(self, conversation_id: str):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO conversations VALUES (?, ?)", (conversation_id, time.time())
+        )
+
+    def _delete(self, conversation_ids: List[str]):
+        for conversation_id in conversation_ids:
+            self._conn.execute("DELETE FROM conversation_turns WHERE conversation_id = ?", (conversation_id,))
+            self._conn.execute("DELETE FROM conversations WHERE conversation_id = ?", (conversation_id,))
+        self._evicted += len(conversation_ids)
+
+    def _read_turns(self, conversation_id: str) -> list:
+        row = self._conn.execute(
+            "SELECT last_access FROM conversations WHERE conversation_id = ?", (conversation_id,)
+        ).fetchone()
+        if row is None:
+            return []
+        if self.idle_ttl_seconds > 0 and time.time() - row[0] > self.idle_ttl_seconds:
+            self._delete([conversation_id])
+            self._conn.commit()
+            self._active = self._count()
+            return []
+        rows = self._conn.execute(
+            "SELECT role, content FROM conversation_turns WHERE conversation_id = ? ORDER BY seq",
+            (conversation_id,)
+        ).fetchall()
+        self._touch(conversation_id)
+        self._conn.commit()
+        self._active = self._count()
+        return rows
+
+    async def get_history(self, conversation_id: str) -> List[ChatMessage]:
+        rows = await self._run(self._read_turns, conversation_id)
+        return [ChatMessage(role=_ROLE_NAMES[role], content=content) for role, content in rows]
+
+    def _insert_turn(self, conversation_id: str, role: int, content: str, tokens: int):
+        self._conn.execute(
+            "INSERT INTO conversation_turns (conversation_id, role, content, tokens) VALUES (?, ?, ?, ?)",
+            (conversation_id, role, content, tokens)
+        )
+        # Keep the newest turns that fit the budget (always at least the last one)
+        rows = self._conn.execute(
+            "SELECT seq, tokens FROM conversation_turns WHERE conversation_id = ? ORDER BY seq DESC",
+            (conversation_id,)
+        ).fetchall()
+        total = 0
+        for index, (seq, turn_tokens) in enumerate(rows):
+            total += turn_tokens
+            if total > self.token_budget and index > 0:
+                self._conn.execute(
+                    "DELETE FROM conversation_turns WHERE conversation_id = ? AND seq <= ?",
+                    (conversation_id, seq)
+                )
+                break
+        self._touch(conversation_id)
+
+        overflow = self._conn.execute(
+            "SELECT conversation_id FROM conversations ORDER BY last_access DESC LIMIT -1 OFFSET ?",
+            (self.max_conversations,)
+        ).fetchall()
+        self._delete([row[0] for row in overflow])
+        self._conn.commit()
+        self._active = self._count()
+
+    async def append(self, conversation_id: str, role: str, content: str) -> None:
+        if not content:
+            return
+        # Tokens are counted on the loop: count_tokens may share a cache with other callers
+        tokens = self.count_tokens(content)
+        await self._run(self._insert_turn, conversation_id, _ROLE_CODES.get(role, 0), content, tokens)
+
+    def _clear(self, conversation_id: str):
+        self._conn.execute("DELETE FROM conversation_turns WHERE conversation_id = ?", (conversation_id,))
+        self._conn.execute("DELETE FROM conversations WHERE conversation_id = ?", (conversation_id,))
+        self._conn.commit()
+        self._active = self._count()
+
+    async def clear(self, conversation_id: str) -> None:
+        await self._run(self._clear, conversation_id)
+
+    def _evict_before(self, cutoff: float) -> int:
+        idle = self._conn.execute(
+            "SELECT conversation_id FROM conversations WHERE last_access < ?", (cutoff,)
+        ).fetchall()
+        self._delete([row[0] for row in idle])
+        self._conn.commit()
+        self._active = self._count()
+        return len(idle)
+
+    async def evict_idle(self) -> int:
+        if self.idle_ttl_seconds <= 0:
+            return 0
+        return await self._run(self._evict_before, time.time() - self.idle_ttl_seconds)
+
+    def stats(self) -> dict:
+        return {
+            "backend": "sqlite",
+            "active_conversations": self._active,
+            "evicted_conversations": self._evicted
+        }
+
+    def _close(self):
+        self._conn.close()
+
+    async def close(self) -> None:
+        """Close the connection on the store thread, after any pending write"""
+        await self._run(self._close)
+        self._executor.shutdown(wait=False)
+
+
+def build_conversation_store(app_settings) -> ConversationStore:
+    """Create the conversation store configured in AppSettings"""
+    # The history budget is counted with the same tokenizer as the prompt budgets
+    from app.services.prompt_assembly import Tokenizer
+
+    tokenizer = Tokenizer(app_settings.tokenizer_encoding, app_settings.tokenizer_cache_entries)
+    options = dict(
+        token_budget=app_settings.history_token_budget,
+        idle_ttl_seconds=app_settings.history_idle_ttl_seconds,
+        max_conversations=app_settings.history_max_conversations,
+        count_tokens=tokenizer.count
+    )
+    if app_settings.history_backend == "sqlite":
+        return SQLiteConversationStore(app_settings.history_sqlite_path, **options)
+    return MemoryConversationStore(**options)
+
@@ -0,0 +1,221 @@
+"""
+Two-tier embedding cache
+
+Repeated questions and re-ingestion of unchanged documents would otherwise pay for
+the same Azure OpenAI embedding calls again. ``CachedEmbedder`` wraps any
+``Embedder`` and keys vectors by ``(embedding deployment, sha256(text))``:
+
+1. Memory tier: an LRU of float32 arrays
+2. Disk tier: one append-only file of raw float32 values plus an offset index
+   (``vectors.f32`` and ``index.jsonl`` in the cache directory)
+
+Only the texts missing from both tiers are sent to the wrapped embedder, in a
+single batched call. Disk reads (one per ``embed`` call, for all the keys the
+memory tier misses) and appends run on a dedicated thread, never on the event loop.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.services.embeddings import Embedder
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends are not coordinated between processes
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+VECTORS_FILE = "vectors.f32"
+INDEX_FILE = "index.jsonl"
+
+
+def cache_key(deployment: str, text: str) -> str:
+    """Cache key for a text embedded with a deployment"""
+    return f"{deployment}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+
+class DiskEmbeddingStore:
+    """Append-only float32 vector file with an offset index"""
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self._vectors_path = os.path.join(directory, VECTORS_FILE)
+        self._index_path = os.path.join(directory, INDEX_FILE)
+        # key -> (byte offset, dimensions)
+        self._offsets: Dict[str, Tuple[int, int]] = {}
+        self._lock = threading.Lock()
+        self._load_index()
+
+    def _load_index(self):
+        if not os.path.exists(self._index_path):
+            return
+        size = os.path.getsize(self._vectors_path) if os.path.exists(self._vectors_path) else 0
+        with open(self._index_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    key, offset, dimensions = json.loads(line)
+                except ValueError:
+                    continue  # partially written line from an interrupted process
+                if offset + dimensions * 4 <= size:
+                    self._offsets[key] = (offset, dimensions)
+        logger.info(f"Embedding cache loaded {len(self._offsets)} vectors from disk")
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._offsets
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """Read the vectors of the stored keys with one open, in file order"""
+        locations = sorted((self._offsets[key], key) for key in keys if key in self._offsets)
+        if not locations:
+            return {}
+        vectors = {}
+        with open(self._vectors_path, "rb") as f:
+            for (offset, dimensions), key in locations:
+                f.seek(offset)
+                data = f.read(dimensions * 4)
+                if len(data) == dimensions * 4:
+                    vectors[key] = np.frombuffer(data, dtype=np.float32)
+        return vectors
+
+    def put_many(self, items: List[Tuple[str, np.ndarray]]):
+        """Append vectors and their index lines"""
+        items = [(key, vector) for key, vector in items if key not in self._offsets]
+        if not items:
+            return
+        with self._lock, open(self._vectors_path, "ab") as vectors_file, \
+                open(self._index_path, "a", encoding="utf-8") as index_file:
+            if fcntl is not None:
+                fcntl.flock(vectors_file.fileno(), fcntl.LOCK_EX)
+            try:
+                offset = vectors_file.seek(0, os.SEEK_END)
+                lines = []
+                for key, vector in items:
+                    data = np.asarray(vector, dtype=np.float32).tobytes()
+                    vectors_file.write(data)
+                    lines.append(json.dumps([key, offset, len(data) // 4]))
+                    self._offsets[key] = (offset, len(data) // 4)
+                    offset += len(data)
+                # Vectors must be on disk before the index lines that point to them
+                vectors_file.flush()
+                index_file.write("\n".join(lines) + "\n")
+                index_file.flush()
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(vectors_file.fileno(), fcntl.LOCK_UN)
+
+
+class CachedEmbedder(Embedder):
+    """
+    Embedder wrapper with a memory LRU tier and an optional disk tier
+
+    Args:
+        embedder: Wrapped embedder; its name (the deployment) is part of every key
+        max_memory_entries: Capacity of the memory tier
+        directory: Disk tier directory, or None for memory only
+    """
+
+    def __init__(self, embedder: Embedder, max_memory_entries: int = 10000, directory: str = None):
+        self.embedder = embedder
+        self.name = embedder.name
+        self.max_memory_entries = max_memory_entries
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._disk = DiskEmbeddingStore(directory) if directory else None
+        self._executor = (
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding-cache") if self._disk is not None else None
+        )
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.upstream_calls = 0
+
+    def _remember(self, key: str, vector: np.ndarray):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    async def _lookup_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """Vectors found in the memory tier, then in the disk tier with one read off the loop"""
+        found = {}
+        on_disk = []
+        for key in keys:
+            if key in found:
+                continue
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                found[key] = vector
+            elif self._disk is not None and key in self._disk:
+                on_disk.append(key)
+        if on_disk:
+            loaded = await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._disk.get_many, list(dict.fromkeys(on_disk))
+            )
+            for key, vector in loaded.items():
+                self.disk_hits += 1
+                self._remember(key, vector)
+                found[key] = vector
+        return found
+
+    def _store(self, items: List[Tuple[str, np.ndarray]]):
+        # Appends run behind the caller: the memory tier already holds the vectors
+        future = self._executor.submit(self._disk.put_many, items)
+        future.add_done_callback(self._log_store_failure)
+
+    @staticmethod
+    def _log_store_failure(future: Future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.warning(f"Could not write embeddings to the disk cache: {future.exception()}")
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        keys = [cache_key(self.name, text) for text in texts]
+        found = await self._lookup_many(keys)
+
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        if missing:
+            self.misses += len(missing)
+            self.upstream_calls += 1
+            fresh = await self.embedder.embed(list(missing.values()))
+            fresh_by_key = {}
+            for key, vector in zip(missing.keys(), fresh):
+                array = np.asarray(vector, dtype=np.float32)
+                self._remember(key, array)
+                fresh_by_key[key] = array
+            if self._disk is not None:
+                self._store(list(fresh_by_key.items()))
+            found.update(fresh_by_key)
+
+        return [found[key].tolist() for key in keys]
+
+    async def close(self):
+        """Wait for pending disk writes"""
+        if self._executor is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self._executor.shutdown)
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            "upstream_calls": self.upstream_calls,
+            "memory_entries": len(self._memory),
+            "disk_entries": len(self._disk) if self._disk is not None else 0
+        }
@@ -0,0 +1,72 @@
+"""
+Text embedding backends
+
+Every code path that turns text into vectors (query retrieval, document ingestion)
+goes through an ``Embedder``:
+
+1. ``AzureOpenAIEmbedder`` calls the Azure OpenAI embeddings API with the
+   configured embedding deployment
+2. ``HashingEmbedder`` is a deterministic local stand-in for tests, offline runs and
+   benchmarks; it never touches the network
+"""
+import hashlib
+import math
+import re
+from abc import ABC, abstractmethod
+from typing import List
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+class Embedder(ABC):
+    """Base class for embedding backends"""
+
+    # Name used to scope caches and indexes (e.g. the deployment name)
+    name: str = ""
+
+    @abstractmethod
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        """Return one vector per input text"""
+
+    async def embed_one(self, text: str) -> List[float]:
+        """Embed a single text"""
+        return (await self.embed([text]))[0]
+
+
+class AzureOpenAIEmbedder(Embedder):
+    """Embeddings from an Azure OpenAI deployment"""
+
+    def __init__(self, openai_client, deployment: str):
+        self.openai_client = openai_client
+        self.deployment = deployment
+        self.name = deployment
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        response = await self.openai_client.embeddings.create(model=self.deployment, input=texts)
+        # The API may return items out of order; sort them by their input index
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+
+class HashingEmbedder(Embedder):
+    """Deterministic local embeddings from hashed words and word bigrams"""
+
+    def __init__(self, dimensions: int = 256):
+        self.dimensions = dimensions
+        self.name = f"hashing-{dimensions}"
+
+    def _vector(self, text: str) -> List[float]:
+        vector = [0.0] * self.dimensions
+        words = _TOKEN.findall(text.lower())
+        features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+        for feature in features:
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dimensions
+            sign = 1.0 if digest[4] & 1 else -1.0
+            vector[bucket] += sign
+        norm = math.sqrt(sum(v * v for v in vector))
+        return [v / norm for v in vector] if norm else vector
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        return [self._vector(text) for text in texts]
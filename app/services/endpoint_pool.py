@@ -0,0 +1,419 @@
+"""
+Pool of Azure OpenAI endpoints with health-aware routing and hedged requests
+
+With one endpoint, one slow or throttled region sets the latency for every user.
+``EndpointPool`` stands in for the ``AsyncAzureOpenAI`` client (it exposes
+``chat.completions.create`` and ``embeddings.create``) and spreads calls over the
+endpoints in ``AZURE_OPENAI_ENDPOINTS``:
+
+1. Every endpoint tracks an EWMA of its latency and error rate, plus a window of
+   recent latencies for its p95. Completions, time to the first streamed chunk and
+   embeddings are tracked separately, and embedding errors count towards the
+   error rate and the circuit breaker like completion errors
+2. Calls are routed at random, weighted by ``weight / (ewma latency x (1 + error penalty))``
+3. Once a call has taken longer than the p95 of its endpoint (``OPENAI_HEDGE_QUANTILE``),
+   the same request is sent to a second endpoint. The first answer wins and the
+   other request is cancelled. For streams the race is to the first chunk. Hedges
+   are capped at ``OPENAI_HEDGE_MAX_RATIO`` of the calls
+4. Throttling, server errors and timeouts fail over to the next endpoint right away,
+   and an endpoint failing ``OPENAI_BREAKER_FAILURES`` times in a row is skipped
+   (circuit open) for ``OPENAI_BREAKER_COOLDOWN_SECONDS``. After that a single probe
+   call decides whether it closes again
+
+Client errors (bad request, content filter) are raised at once. When every endpoint
+throttled the call, the last 429 is raised, so the admission controller still
+backs off and adapts its concurrency limit.
+"""
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from app.services.admission import get_retry_after
+
+logger = logging.getLogger(__name__)
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+# Latency kinds tracked per endpoint
+KIND_COMPLETE = "complete"
+KIND_STREAM = "stream"  # time to the first chunk
+KIND_EMBEDDING = "embedding"
+
+
+def is_retryable(error: Exception) -> bool:
+    """Errors worth sending to another endpoint: throttling, server errors, timeouts, connection errors"""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        return True
+    return status in (408, 409, 429) or status >= 500
+
+
+class LatencyTracker:
+    """EWMA and a window of recent latencies (ms) for quantiles"""
+
+    def __init__(self, alpha: float = 0.2, window: int = 200):
+        self.alpha = alpha
+        self.ewma_ms: Optional[float] = None
+        self.samples = deque(maxlen=window)
+
+    def record(self, elapsed_ms: float):
+        self.samples.append(elapsed_ms)
+        self.ewma_ms = elapsed_ms if self.ewma_ms is None else self.alpha * elapsed_ms + (1 - self.alpha) * self.ewma_ms
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+@dataclass
+class EndpointConfig:
+    """One Azure OpenAI resource of the pool"""
+    name: str
+    endpoint: str
+    api_key: str = ""
+    weight: float = 1.0
+    deployments: Dict[str, str] = None  # deployment name in settings -> name on this resource
+
+
+class Endpoint:
+    """An Azure OpenAI client with its health: latencies, error rate and circuit breaker"""
+
+    def __init__(self, config: EndpointConfig, client, alpha: float = 0.2):
+        self.name = config.name
+        self.weight = config.weight
+        self.deployments = config.deployments or {}
+        self.client = client
+        self.latency = {kind: LatencyTracker(alpha) for kind in (KIND_COMPLETE, KIND_STREAM, KIND_EMBEDDING)}
+        self.alpha = alpha
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.state = CIRCUIT_CLOSED
+        self.open_until = 0.0
+        self.probing = False
+        self.requests = 0
+        self.failures = 0
+
+    def deployment(self, model: str) -> str:
+        return self.deployments.get(model, model)
+
+    def available(self, now: float) -> bool:
+        """Closed, or open long enough that one probe may go through"""
+        if self.state == CIRCUIT_CLOSED:
+            return True
+        if self.state == CIRCUIT_OPEN and now >= self.open_until:
+            self.state = CIRCUIT_HALF_OPEN
+        return self.state == CIRCUIT_HALF_OPEN and not self.probing
+
+    def score(self, kind: str) -> float:
+        """Routing weight: faster and healthier endpoints get more calls"""
+        ewma = self.latency[kind].ewma_ms or self.latency[KIND_COMPLETE].ewma_ms or 1000.0
+        return self.weight / (max(ewma, 1.0) * (1 + 10 * self.error_rate))
+
+    def record_success(self, kind: str, elapsed_ms: float):
+        self.latency[kind].record(elapsed_ms)
+        self.error_rate *= 1 - self.alpha
+        self.consecutive_failures = 0
+        if self.state != CIRCUIT_CLOSED:
+            logger.info(f"Azure OpenAI endpoint {self.name} recovered; circuit closed")
+        self.state = CIRCUIT_CLOSED
+        self.probing = False
+
+    def record_failure(self, failure_threshold: int, cooldown: float, retry_after: Optional[float] = None):
+        self.failures += 1
+        self.error_rate = self.alpha + (1 - self.alpha) * self.error_rate
+        self.consecutive_failures += 1
+        self.probing = False
+        now = time.monotonic()
+        if self.state == CIRCUIT_HALF_OPEN or self.consecutive_failures >= failure_threshold:
+            if self.state != CIRCUIT_OPEN:
+                logger.warning(f"Azure OpenAI endpoint {self.name} failing; circuit open for {cooldown:.0f} s")
+            self.state = CIRCUIT_OPEN
+            self.open_until = now + max(cooldown, retry_after or 0)
+        elif retry_after:
+            # Throttled: keep it out of rotation for as long as the service asked
+            self.state = CIRCUIT_OPEN
+            self.open_until = max(self.open_until, now + retry_after)
+
+    def stats(self) -> dict:
+        complete = self.latency[KIND_COMPLETE]
+        stream = self.latency[KIND_STREAM]
+        embedding = self.latency[KIND_EMBEDDING]
+        return {
+            "state": self.state,
+            "requests": self.requests,
+            "failures": self.failures,
+            "error_rate": round(self.error_rate, 4),
+            "ewma_ms": round(complete.ewma_ms or 0.0, 1),
+            "p95_ms": round(complete.quantile(0.95) or 0.0, 1),
+            "first_chunk_ewma_ms": round(stream.ewma_ms or 0.0, 1),
+            "first_chunk_p95_ms": round(stream.quantile(0.95) or 0.0, 1),
+            "embedding_ewma_ms": round(embedding.ewma_ms or 0.0, 1)
+        }
+
+
+class _Completions:
+    def __init__(self, pool: "EndpointPool"):
+        self._pool = pool
+
+    async def create(self, **kwargs):
+        return await self._pool.create_completion(**kwargs)
+
+
+class _Chat:
+    def __init__(self, pool: "EndpointPool"):
+        self.completions = _Completions(pool)
+
+
+class _Embeddings:
+    def __init__(self, pool: "EndpointPool"):
+        self._pool = pool
+
+    async def create(self, **kwargs):
+        return await self._pool.create_embeddings(**kwargs)
+
+
+async def _prepend(first, stream):
+    """The stream with its already received first chunk put back in front"""
+    if first is not None:
+        yield first
+    async for chunk in stream:
+        yield chunk
+
+
+async def _discard(result):
+    """Close the stream of an attempt that finished but lost the race"""
+    if isinstance(result, tuple):
+        try:
+            await result[1].close()
+        except Exception as e:
+            logger.debug(f"Closing a discarded stream failed: {e}")
+
+
+class EndpointPool:
+    """
+    Drop-in replacement for AsyncAzureOpenAI over several endpoints
+
+    Args:
+        endpoints: Endpoints of the pool
+        hedge_enabled: Send a second request once the first one is slower than usual
+        hedge_quantile: Latency quantile of the endpoint after which a hedge is sent
+        hedge_min_delay_ms: Lower bound of the hedge delay
+        hedge_initial_delay_ms: Hedge delay until an endpoint has enough samples
+        hedge_max_ratio: Maximum fraction of calls that get a hedge
+        failure_threshold: Consecutive failures that open an endpoint's circuit
+        cooldown_seconds: Time an open circuit waits before a probe call
+        min_samples: Latency samples needed before the quantile is trusted
+    """
+
+    def __init__(
+        self,
+        endpoints: List[Endpoint],
+        hedge_enabled: bool = True,
+        hedge_quantile: float = 0.95,
+        hedge_min_delay_ms: float = 250.0,
+        hedge_initial_delay_ms: float = 5000.0,
+        hedge_max_ratio: float = 0.1,
+        failure_threshold: int = 3,
+        cooldown_seconds: float = 30.0,
+        min_samples: int = 20
+    ):
+        if not endpoints:
+            raise ValueError("EndpointPool needs at least one endpoint")
+        self.endpoints = endpoints
+        self.hedge_enabled = hedge_enabled and len(endpoints) > 1
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay_ms = hedge_min_delay_ms
+        self.hedge_initial_delay_ms = hedge_initial_delay_ms
+        self.hedge_max_ratio = hedge_max_ratio
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.min_samples = min_samples
+        self._random = random.Random()
+        self.chat = _Chat(self)
+        self.embeddings = _Embeddings(self)
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+
+    def _candidates(self, kind: str, exclude=()) -> List[Endpoint]:
+        """Available endpoints in routing order: weighted random without replacement"""
+        now = time.monotonic()
+        available = [e for e in self.endpoints if e not in exclude and e.available(now)]
+        if not available:
+            # Every circuit is open: try them all, closest to its probe first, rather than failing outright
+            remaining = [e for e in self.endpoints if e not in exclude]
+            return sorted(remaining, key=lambda e: e.open_until)
+        ordered = []
+        while available:
+            scores = [endpoint.score(kind) for endpoint in available]
+            chosen = self._random.choices(available, weights=scores)[0]
+            ordered.append(chosen)
+            available.remove(chosen)
+        return ordered
+
+    def _hedge_delay(self, endpoint: Endpoint, kind: str) -> float:
+        tracker = endpoint.latency[kind]
+        if len(tracker.samples) < self.min_samples:
+            return self.hedge_initial_delay_ms / 1000
+        return max(tracker.quantile(self.hedge_quantile), self.hedge_min_delay_ms) / 1000
+
+    def _may_hedge(self) -> bool:
+        return self.hedge_enabled and self.hedges < self.hedge_max_ratio * self.calls
+
+    async def _attempt(self, endpoint: Endpoint, kind: str, kwargs: dict):
+        """
+        One call on one endpoint
+
+        For streams, returns (first chunk or None, stream) once the first chunk arrived.
+        """
+        endpoint.requests += 1
+        if endpoint.state == CIRCUIT_HALF_OPEN:
+            endpoint.probing = True
+        started = time.perf_counter()
+        request = dict(kwargs, model=endpoint.deployment(kwargs.get("model")))
+        stream = None
+        try:
+            if kind == KIND_EMBEDDING:
+                result = await endpoint.client.embeddings.create(**request)
+            elif kind == KIND_STREAM:
+                stream = await endpoint.client.chat.completions.create(**request)
+                try:
+                    result = (await stream.__anext__(), stream)
+                except StopAsyncIteration:
+                    result = (None, stream)
+            else:
+                result = await endpoint.client.chat.completions.create(**request)
+        except asyncio.CancelledError:
+            # Lost a hedge race; not a failure of the endpoint
+            endpoint.probing = False
+            if stream is not None:
+                await _discard((None, stream))
+            raise
+        except Exception as e:
+            if is_retryable(e):
+                endpoint.record_failure(self.failure_threshold, self.cooldown_seconds, get_retry_after(e))
+            else:
+                endpoint.probing = False
+            raise
+        endpoint.record_success(kind, (time.perf_counter() - started) * 1000)
+        return result
+
+    async def create_completion(self, **kwargs):
+        """chat.completions.create over the pool, with hedging and failover"""
+        kind = KIND_STREAM if kwargs.get("stream") else KIND_COMPLETE
+        self.calls += 1
+        candidates = self._candidates(kind)
+        tasks: Dict[asyncio.Task, Endpoint] = {}
+        last_error: Optional[Exception] = None
+
+        def launch():
+            endpoint = candidates.pop(0)
+            tasks[asyncio.ensure_future(self._attempt(endpoint, kind, kwargs))] = endpoint
+
+        launch()
+        first_endpoint = next(iter(tasks.values()))
+        hedge_at = time.monotonic() + self._hedge_delay(first_endpoint, kind)
+        hedged = False
+        winner = None
+        try:
+            while tasks:
+                timeout = None
+                if not hedged and candidates and self._may_hedge():
+                    timeout = max(hedge_at - time.monotonic(), 0)
+                done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # Slower than the endpoint's usual p95: race a second endpoint
+                    hedged = True
+                    self.hedges += 1
+                    launch()
+                    continue
+                for task in done:
+                    endpoint = tasks.pop(task)
+                    error = task.exception()
+                    if error is None:
+                        if winner is None:
+                            winner = task.result()
+                            if hedged and endpoint is not first_endpoint:
+                                self.hedge_wins += 1
+                        else:
+                            # Both finished in the same instant
+                            await _discard(task.result())
+                        continue
+                    if not is_retryable(error):
+                        raise error
+                    last_error = error
+                    logger.warning(f"Azure OpenAI endpoint {endpoint.name} failed, failing over: {error}")
+                if winner is not None:
+                    return _prepend(*winner) if kind == KIND_STREAM else winner
+                if not tasks:
+                    if not candidates:
+                        break
+                    self.failovers += 1
+                    launch()
+            raise last_error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def create_embeddings(self, **kwargs):
+        """embeddings.create on the healthiest endpoint, failing over on retryable errors (no hedging)"""
+        last_error = None
+        for endpoint in self._candidates(KIND_EMBEDDING):
+            if last_error is not None:
+                self.failovers += 1
+            try:
+                return await self._attempt(endpoint, KIND_EMBEDDING, kwargs)
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                last_error = e
+                logger.warning(f"Azure OpenAI endpoint {endpoint.name} failed, failing over: {e}")
+        raise last_error
+
+    async def close(self):
+        for endpoint in self.endpoints:
+            await endpoint.client.close()
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "failovers": self.failovers,
+            "endpoints": {endpoint.name: endpoint.stats() for endpoint in self.endpoints}
+        }
+
+
+def build_endpoint_pool(app_settings, make_client) -> EndpointPool:
+    """
+    Create the pool over AZURE_OPENAI_ENDPOINTS
+
+    Args:
+        make_client: Function (endpoint url, api key) -> AsyncAzureOpenAI
+    """
+    endpoints = []
+    for config in app_settings.openai_endpoint_list:
+        endpoints.append(Endpoint(
+            EndpointConfig(config.name, config.endpoint, config.api_key, config.weight, dict(config.deployments)),
+            make_client(config.endpoint, config.api_key)
+        ))
+    logger.info(f"Azure OpenAI endpoint pool: {', '.join(endpoint.name for endpoint in endpoints)}")
+    return EndpointPool(
+        endpoints,
+        hedge_enabled=app_settings.openai_hedge_enabled,
+        hedge_quantile=app_settings.openai_hedge_quantile,
+        hedge_min_delay_ms=app_settings.openai_hedge_min_delay_ms,
+        hedge_initial_delay_ms=app_settings.openai_hedge_initial_delay_ms,
+        hedge_max_ratio=app_settings.openai_hedge_max_ratio,
+        failure_threshold=app_settings.openai_breaker_failures,
+        cooldown_seconds=app_settings.openai_breaker_cooldown_seconds
+    )
@@ -0,0 +1,272 @@
+"""
+Document ingestion pipeline for the local index
+
+Builds the index read by ``app.services.retrieval.local.LocalRetriever``:
+
+1. Streams text documents from a directory
+2. Splits them into overlapping chunks on word boundaries
+3. Embeds new or changed chunks in batched calls with bounded concurrency, a
+   bounded window of chunks at a time, so memory does not grow with the corpus
+4. Writes chunks, embeddings and a manifest to the index directory
+
+Re-runs are incremental: every chunk carries a hash of its content and embedder,
+and chunks whose hash is already in the index reuse the stored vector instead of
+being embedded again.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import os
+import time
+from dataclasses import asdict, dataclass
+from itertools import islice
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Tuple
+
+import numpy as np
+
+from app.services.embeddings import Embedder
+from app.services.retrieval.local import CHUNKS_FILE, EMBEDDINGS_FILE, MANIFEST_FILE
+from app.services.retrieval.vector_index import VectorIndex
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EXTENSIONS = (".txt", ".md", ".markdown", ".rst")
+
+
+@dataclass
+class Chunk:
+    """A piece of a document as stored in chunks.jsonl"""
+    id: str
+    title: str
+    filepath: str
+    content: str
+    content_hash: str
+    url: str = ""
+
+
+@dataclass
+class IngestionReport:
+    """Summary of one ingestion run"""
+    documents: int = 0
+    chunks: int = 0
+    embedded_chunks: int = 0
+    reused_chunks: int = 0
+    removed_chunks: int = 0
+    embedding_calls: int = 0
+    embedding_calls_saved: int = 0
+    elapsed_seconds: float = 0.0
+
+    @property
+    def chunks_per_second(self) -> float:
+        return self.chunks / self.elapsed_seconds if self.elapsed_seconds else 0.0
+
+    def as_dict(self) -> dict:
+        return {**asdict(self), "chunks_per_second": round(self.chunks_per_second, 1)}
+
+
+def iter_documents(directory: str, extensions=DEFAULT_EXTENSIONS) -> Iterator[Tuple[str, str]]:
+    """Yield (relative path, text) for every matching file, one file at a time"""
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if not name.lower().endswith(tuple(extensions)):
+                continue
+            path = os.path.join(root, name)
+            with open(path, encoding="utf-8", errors="replace") as f:
+                yield os.path.relpath(path, directory).replace(os.sep, "/"), f.read()
+
+
+def chunk_text(text: str, chunk_size: int = 1000, chunk_overlap: int = 200) -> List[str]:
+    """
+    Split text into chunks of about chunk_size characters
+
+    Consecutive chunks share about chunk_overlap characters, and cuts are moved back
+    to the nearest whitespace so words are not split.
+    """
+    if chunk_overlap >= chunk_size:
+        raise ValueError("chunk_overlap must be smaller than chunk_size")
+    text = " ".join(text.split())
+    if not text:
+        return []
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_size, len(text))
+        if end < len(text):
+            cut = text.rfind(" ", start + chunk_overlap + 1, end)
+            if cut > start:
+                end = cut
+        chunks.append(text[start:end].strip())
+        if end >= len(text):
+            break
+        next_start = end - chunk_overlap
+        space = text.find(" ", next_start, end)
+        start = space + 1 if space != -1 else next_start
+    return [chunk for chunk in chunks if chunk]
+
+
+def _windows(items: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(items)
+    while True:
+        window = list(islice(iterator, size))
+        if not window:
+            return
+        yield window
+
+
+class IngestionPipeline:
+    """
+    Chunk, embed and index a directory of documents
+
+    Args:
+        embedder: Embedding backend (AzureOpenAIEmbedder or a local fake)
+        index_path: Index directory to create or update
+        chunk_size: Target chunk size in characters
+        chunk_overlap: Characters shared by consecutive chunks
+        batch_size: Texts per embedding call
+        concurrency: Embedding calls in flight at once
+    """
+
+    def __init__(
+        self,
+        embedder: Embedder,
+        index_path: str,
+        chunk_size: int = 1000,
+        chunk_overlap: int = 200,
+        batch_size: int = 16,
+        concurrency: int = 4
+    ):
+        self.embedder = embedder
+        self.index_path = index_path
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+
+    def _hash(self, content: str) -> str:
+        # The embedder name is part of the hash so switching models re-embeds everything
+        return hashlib.sha256(f"{self.embedder.name}\n{content}".encode("utf-8")).hexdigest()
+
+    def _chunks(self, directory: str, report: IngestionReport) -> Iterator[Chunk]:
+        for filepath, text in iter_documents(directory):
+            report.documents += 1
+            title = os.path.splitext(os.path.basename(filepath))[0]
+            for number, content in enumerate(chunk_text(text, self.chunk_size, self.chunk_overlap)):
+                yield Chunk(
+                    id=f"{filepath}#{number}",
+                    title=title,
+                    filepath=filepath,
+                    content=content,
+                    content_hash=self._hash(content)
+                )
+
+    async def _embed_all(self, texts: List[str], report: IngestionReport) -> List[List[float]]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+
+        async def embed_batch(batch: List[str]) -> List[List[float]]:
+            async with semaphore:
+                return await self.embedder.embed(batch)
+
+        results = await asyncio.gather(*(embed_batch(batch) for batch in batches))
+        report.embedding_calls += len(batches)
+        return [vector for batch in results for vector in batch]
+
+    def _known_rows(self, existing: VectorIndex) -> Dict[str, int]:
+        """Row of every content hash in the current index, read without loading the chunks"""
+        chunks_path = os.path.join(self.index_path, CHUNKS_FILE)
+        if not len(existing) or not os.path.exists(chunks_path):
+            return {}
+        known_rows = {}
+        rows = 0
+        with open(chunks_path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    known_rows[json.loads(line).get("content_hash")] = rows
+                    rows += 1
+        if rows != len(existing):
+            raise ValueError(
+                f"Index at {self.index_path} is inconsistent: {rows} chunks but {len(existing)} embeddings"
+            )
+        return known_rows
+
+    @staticmethod
+    def _read_row(vectors_file: BinaryIO, row: int, dimensions: int) -> np.ndarray:
+        # A repeat of a chunk embedded earlier in this run: its vector is already on disk
+        vectors_file.seek(row * dimensions * 4)
+        vector = np.frombuffer(vectors_file.read(dimensions * 4), dtype=np.float32)
+        vectors_file.seek(0, os.SEEK_END)
+        return vector
+
+    async def run(self, directory: str) -> IngestionReport:
+        """Ingest a directory and write the updated index"""
+        started = time.perf_counter()
+        report = IngestionReport()
+
+        embeddings_path = os.path.join(self.index_path, EMBEDDINGS_FILE)
+        existing = VectorIndex.load(embeddings_path)
+        known_rows = self._known_rows(existing)
+        dimensions = existing.dimensions
+        # Chunks embedded in this run, by hash, and their row in the new index
+        new_rows: Dict[str, int] = {}
+        reused_hashes = set()
+        # Calls a run without any reuse would have made, window by window
+        calls_needed = 0
+
+        os.makedirs(self.index_path, exist_ok=True)
+        chunks_path = os.path.join(self.index_path, CHUNKS_FILE)
+        rows_path = f"{embeddings_path}.rows"
+        window_size = self.batch_size * max(1, self.concurrency)
+        with open(f"{chunks_path}.tmp", "w", encoding="utf-8") as chunks_file, open(rows_path, "w+b") as vectors_file:
+            for window in _windows(self._chunks(directory, report), window_size):
+                calls_needed += math.ceil(len(window) / self.batch_size)
+                # Identical chunks (e.g. shared boilerplate) are embedded only once
+                unique_texts = {
+                    chunk.content_hash: chunk.content for chunk in window
+                    if chunk.content_hash not in known_rows and chunk.content_hash not in new_rows
+                }
+                vectors = dict(zip(unique_texts, await self._embed_all(list(unique_texts.values()), report)))
+                for chunk in window:
+                    if chunk.content_hash in vectors:
+                        vector = np.asarray(vectors.pop(chunk.content_hash), dtype=np.float32)
+                        dimensions = len(vector)
+                        new_rows[chunk.content_hash] = report.chunks
+                        report.embedded_chunks += 1
+                    elif chunk.content_hash in known_rows:
+                        vector = existing.matrix[known_rows[chunk.content_hash]]
+                        reused_hashes.add(chunk.content_hash)
+                        report.reused_chunks += 1
+                    else:
+                        vector = self._read_row(vectors_file, new_rows[chunk.content_hash], dimensions)
+                    vectors_file.write(np.asarray(vector, dtype=np.float32).tobytes())
+                    chunks_file.write(json.dumps(asdict(chunk), ensure_ascii=False) + "\n")
+                    report.chunks += 1
+
+        report.removed_chunks = len(known_rows) - len(reused_hashes)
+        report.embedding_calls_saved = calls_needed - report.embedding_calls
+
+        # Release the memory map before replacing the file it points to
+        del existing
+        VectorIndex.save_rows(embeddings_path, rows_path, dimensions)
+        os.remove(rows_path)
+        os.replace(f"{chunks_path}.tmp", chunks_path)
+        self._write_manifest(report.chunks, dimensions)
+        report.elapsed_seconds = time.perf_counter() - started
+        logger.info(f"Ingestion finished: {report.as_dict()}")
+        return report
+
+    def _write_manifest(self, chunks: int, dimensions: int):
+        with open(os.path.join(self.index_path, MANIFEST_FILE), "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "embedder": self.embedder.name,
+                    "dimensions": dimensions if chunks else 0,
+                    "chunks": chunks,
+                    "chunk_size": self.chunk_size,
+                    "chunk_overlap": self.chunk_overlap
+                },
+                f,
+                indent=2
+            )
@@ -0,0 +1,181 @@
+"""
+Per-stage latency metrics for bot turns
+
+Every turn is split into timed stages so Azure latency can be told apart from our
+own overhead:
+
+1. ``activity_deserialize``: request JSON parsing and ``Activity().deserialize``
+2. ``adapter_auth``: inbound request authentication by the adapter
+3. ``turn``: the whole ``bot.on_turn`` call
+4. ``prompt_build``: history, retrieval and message assembly before the completion,
+   including ``summary`` (the running-summary completion with PROMPT_SUMMARY_MODE=model)
+5. ``token_acquisition``: bearer token for Azure OpenAI (cached calls included)
+6. ``admission_wait``: time spent queued by the admission controller
+7. ``completion`` and ``completion_first_token``: upstream completion, total and
+   time to the first streamed token
+8. ``send_activity`` and ``update_activity``: outbound calls to the Bot Connector
+
+Durations are aggregated into fixed-bucket histograms in ``metrics`` (one per
+process) and rendered as JSON or Prometheus text by the ``/metrics`` routes.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Bucket upper bounds in seconds (Prometheus convention)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRIC_PREFIX = "rag_bot"
+
+
+class Histogram:
+    """Fixed-bucket latency histogram with bucket-interpolated quantiles"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        # One extra slot for observations above the last bound (+Inf)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q: float) -> float:
+        """Approximate quantile in seconds, interpolated linearly inside its bucket"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                # The observed maximum tightens the bounds of the last occupied bucket
+                upper = min(self.buckets[index], self.max) if index < len(self.buckets) else self.max
+                lower = min(self.buckets[index - 1] if index > 0 else 0.0, upper)
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.max
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "avg_ms": round(self.sum / self.count * 1000, 3) if self.count else 0.0,
+            "p50_ms": round(self.quantile(0.50) * 1000, 3),
+            "p95_ms": round(self.quantile(0.95) * 1000, 3),
+            "p99_ms": round(self.quantile(0.99) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3)
+        }
+
+
+class MetricsRegistry:
+    """
+    Stage histograms for one process
+
+    Observations may come from the turn loop and from Flask request threads, so
+    updates are guarded by a lock.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.enabled = True
+        self._stages: Dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+
+    def observe(self, stage: str, seconds: float):
+        """Record one duration for a stage"""
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._stages.get(stage)
+            if histogram is None:
+                histogram = self._stages[stage] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    @contextmanager
+    def span(self, stage: str):
+        """Time the enclosed block (sync or async code) as one observation of stage"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            self.started_at = time.time()
+
+    def snapshot(self, components: Optional[dict] = None) -> dict:
+        """JSON view: per-stage summaries plus optional component stats"""
+        with self._lock:
+            stages = {name: histogram.as_dict() for name, histogram in sorted(self._stages.items())}
+        result = {"uptime_seconds": round(time.time() - self.started_at, 1), "stages": stages}
+        if components:
+            result["components"] = components
+        return result
+
+    def render_prometheus(self, components: Optional[dict] = None) -> str:
+        """Prometheus text exposition format (version 0.0.4)"""
+        name = f"{METRIC_PREFIX}_stage_duration_seconds"
+        lines: List[str] = [
+            f"# HELP {name} Duration of each bot turn stage",
+            f"# TYPE {name} histogram"
+        ]
+        with self._lock:
+            for stage, histogram in sorted(self._stages.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(histogram.buckets, histogram.counts):
+                    cumulative += bucket_count
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {histogram.sum:.6f}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {histogram.count}')
+
+        # Component counters (cache, coalescing, admission, ...) as gauges
+        for component, stats in sorted((components or {}).items()):
+            for key, value in sorted(stats.items()):
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                gauge = f"{METRIC_PREFIX}_{component}_{key}"
+                lines.append(f"# TYPE {gauge} gauge")
+                lines.append(f"{gauge} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class SendTimingMixin:
+    """
+    Mixin for Bot Framework adapters that times outbound sends and updates
+
+    ``TurnContext.on_send_activities`` handlers run before the actual send, so the
+    timing has to wrap the adapter methods themselves.
+    """
+
+    async def send_activities(self, context, activities):
+        with metrics.span("send_activity"):
+            return await super().send_activities(context, activities)
+
+    async def update_activity(self, context, activity):
+        with metrics.span("update_activity"):
+            return await super().update_activity(context, activity)
+
+
+def wants_prometheus(format_param: Optional[str], accept_header: Optional[str]) -> bool:
+    """Prometheus text is served for ?format=prometheus or an Accept header asking for text/plain"""
+    if format_param:
+        return format_param.lower() in ("prometheus", "text")
+    return "text/plain" in (accept_header or "") and "application/json" not in (accept_header or "")
+
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+metrics = MetricsRegistry()
@@ -0,0 +1,416 @@
+"""
+Token-budgeted prompt assembly
+
+``RagChatService`` used to send the system prompt plus the last 20 history messages,
+whatever their size. ``PromptAssembler`` builds the messages of a completion within
+the model's context window instead:
+
+1. Tokens are counted with a local tokenizer (``tiktoken``, or the
+   four-characters-per-token estimate when it cannot be loaded), and counts are
+   cached per text so unchanged system prompts, documents and history turns are
+   only tokenized once. Texts built for a single request are counted uncached
+2. Room for the answer and for retrieved documents is reserved first. Local
+   documents are kept in rank order up to their budget, each costing its own
+   tokens plus a fixed per-source overhead, and the last one that does not fit
+   is truncated. With "On Your Data" the budget is reserved for the chunks Azure
+   injects
+3. History is filled newest turn first into what is left, up to its own budget
+4. Older turns that no longer fit can be collapsed into a running summary per
+   conversation (``PROMPT_SUMMARY_MODE``: ``off``, ``extractive`` or ``model``)
+5. Every build reports the tokens used per section, logged at debug level and
+   aggregated in ``stats()`` (exposed on ``/metrics``) to tune the budgets
+"""
+import hashlib
+import logging
+import re
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.logging_setup import per_message
+from app.models.chat_models import ChatMessage
+from app.services.conversation_store import estimate_tokens
+from app.services.retrieval.base import RetrievedDocument
+
+try:
+    import tiktoken
+except ImportError:  # counts fall back to the character estimate
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Tokens the chat format adds around every message (role, separators)
+MESSAGE_OVERHEAD = 4
+# Documents truncated below this size are dropped instead
+MIN_DOCUMENT_TOKENS = 50
+# Tokens format_sources adds around every document ("[docN]" marker, line breaks)
+SOURCE_OVERHEAD = 8
+
+SOURCES_HEADER = (
+    "Answer using only the sources below. Cite them inline as [doc1], [doc2], ... "
+    "using the number of the source."
+)
+
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+SECTIONS = ("system", "documents", "summary", "history", "user")
+
+# summarize(previous summary, turns to add, max tokens) -> new summary
+Summarizer = Callable[[str, List[ChatMessage], int], Awaitable[str]]
+
+
+class Tokenizer:
+    """
+    Token counter with an LRU cache of counts keyed by text
+
+    Args:
+        encoding_name: tiktoken encoding (e.g. cl100k_base, o200k_base); empty or an
+            encoding that cannot be loaded selects the character estimate
+        cache_entries: Texts whose counts are kept
+    """
+
+    def __init__(self, encoding_name: str = "cl100k_base", cache_entries: int = 4096):
+        self.cache_entries = cache_entries
+        self._cache: "OrderedDict[str, int]" = OrderedDict()
+        self._encoding = None
+        self.backend = "estimate"
+        self.hits = 0
+        self.misses = 0
+        if tiktoken is None and encoding_name:
+            logger.warning(f"tiktoken is not installed; estimating tokens instead of using {encoding_name}")
+        elif encoding_name:
+            try:
+                self._encoding = tiktoken.get_encoding(encoding_name)
+                self.backend = f"tiktoken:{encoding_name}"
+            except Exception as e:
+                # e.g. the BPE file cannot be downloaded on an offline host
+                logger.warning(f"Could not load tiktoken encoding {encoding_name}, estimating tokens: {e}")
+
+    def _encode(self, text: str) -> list:
+        return self._encoding.encode(text, disallowed_special=())
+
+    def count(self, text: Optional[str], cache: bool = True) -> int:
+        """Tokens in text; cache=False for texts that will not be counted again"""
+        if not text:
+            return 0
+        if not cache:
+            return len(self._encode(text)) if self._encoding is not None else estimate_tokens(text)
+        tokens = self._cache.get(text)
+        if tokens is not None:
+            self.hits += 1
+            self._cache.move_to_end(text)
+            return tokens
+        self.misses += 1
+        tokens = len(self._encode(text)) if self._encoding is not None else estimate_tokens(text)
+        self._cache[text] = tokens
+        if len(self._cache) > self.cache_entries:
+            self._cache.popitem(last=False)
+        return tokens
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """text cut to at most max_tokens tokens"""
+        if max_tokens <= 0:
+            return ""
+        if self.count(text) <= max_tokens:
+            return text
+        if self._encoding is not None:
+            return self._encoding.decode(self._encode(text)[:max_tokens])
+        # The estimate counts len // 4 + 1 tokens, so 4 * max_tokens characters would be one too many
+        return text[:max_tokens * 4 - 1]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.backend,
+            "cached_texts": len(self._cache),
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+@dataclass
+class AssembledPrompt:
+    """Messages of one completion and the tokens used by each section"""
+    messages: list
+    # Local documents that made it into the prompt, in citation order (None with On Your Data)
+    documents: Optional[List[RetrievedDocument]] = None
+    tokens: Dict[str, int] = field(default_factory=dict)
+    history_turns: int = 0
+    dropped_turns: int = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.tokens.get("total", 0)
+
+
+def _turn_digest(turn: ChatMessage) -> str:
+    return hashlib.sha256(f"{turn.role}\x1f{turn.content}".encode("utf-8")).hexdigest()
+
+
+def _first_sentence(text: str, limit: int = 160) -> str:
+    text = " ".join(text.split())
+    match = re.match(r"(.+?[.!?])(\s|$)", text)
+    sentence = match.group(1) if match else text
+    return sentence if len(sentence) <= limit else sentence[:limit].rstrip() + "..."
+
+
+def format_sources(documents: List[RetrievedDocument]) -> str:
+    """Render retrieved documents as numbered sources the model can cite as [docN]"""
+    if not documents:
+        return "No relevant documents were found. Say so if you cannot answer from general knowledge."
+    lines = [SOURCES_HEADER]
+    for number, doc in enumerate(documents, start=1):
+        title = doc.title or doc.filepath or doc.id
+        lines.append(f"\n[doc{number}] {title}\n{doc.content}")
+    return "\n".join(lines)
+
+
+class PromptAssembler:
+    """
+    Builds completion messages within a token budget
+
+    Args:
+        tokenizer: Token counter shared by every build
+        context_window: Tokens the deployment accepts (prompt + answer)
+        answer_reserve: Tokens kept free for the answer
+        documents_budget: Maximum tokens of retrieved documents (also reserved for
+            the chunks injected by "On Your Data")
+        history_budget: Maximum tokens of conversation history, summary included
+        summary_mode: off | extractive | model
+        summary_max_tokens: Maximum size of the running summary
+        summarize: Summarizer used in "model" mode
+        max_summaries: Conversations whose running summary is kept (LRU)
+    """
+
+    def __init__(
+        self,
+        tokenizer: Tokenizer = None,
+        context_window: int = 8192,
+        answer_reserve: int = 800,
+        documents_budget: int = 3000,
+        history_budget: int = 2000,
+        summary_mode: str = "off",
+        summary_max_tokens: int = 300,
+        summarize: Summarizer = None,
+        max_summaries: int = 10000
+    ):
+        self.tokenizer = tokenizer or Tokenizer()
+        self.context_window = context_window
+        self.answer_reserve = answer_reserve
+        self.documents_budget = documents_budget
+        self.history_budget = history_budget
+        self.summary_mode = summary_mode if summary_mode in ("extractive", "model") else "off"
+        if self.summary_mode == "model" and summarize is None:
+            logger.warning("PROMPT_SUMMARY_MODE=model without a summarizer; using extractive summaries")
+            self.summary_mode = "extractive"
+        self.summary_max_tokens = summary_max_tokens
+        self.summarize = summarize
+        self.max_summaries = max_summaries
+        # conversation id -> (digest of the last turn covered, summary)
+        self._summaries: "OrderedDict[str, Tuple[str, str]]" = OrderedDict()
+        self.builds = 0
+        self.section_totals = {name: 0 for name in SECTIONS}
+        self.max_total = 0
+        self.dropped_turns = 0
+        self.truncated_documents = 0
+        self.summaries_built = 0
+
+    def message_tokens(self, content: str) -> int:
+        """Tokens of one chat message with the given content"""
+        return self.tokenizer.count(content) + MESSAGE_OVERHEAD
+
+    def count_messages(self, messages: list) -> int:
+        """Tokens of a list of chat messages"""
+        return sum(self.message_tokens(message["content"]) for message in messages)
+
+    def _fit_documents(
+        self,
+        documents: List[RetrievedDocument],
+        budget: int,
+        format_sources: Callable[[List[RetrievedDocument]], str]
+    ) -> Tuple[List[RetrievedDocument], str]:
+        """Documents in rank order that fit in budget, the last one possibly truncated"""
+        kept = []
+        used = self.tokenizer.count(SOURCES_HEADER)
+        for document in documents:
+            overhead = self.tokenizer.count(document.title or document.filepath or document.id) + SOURCE_OVERHEAD
+            cost = self.tokenizer.count(document.content) + overhead
+            if used + cost <= budget:
+                kept.append(document)
+                used += cost
+                continue
+            room = budget - used - overhead
+            if room >= MIN_DOCUMENT_TOKENS:
+                kept.append(replace(document, content=self.tokenizer.truncate(document.content, room)))
+                self.truncated_documents += 1
+            break
+        return kept, format_sources(kept)
+
+    def _fit_history(self, history: List[ChatMessage], budget: int) -> int:
+        """Number of most recent turns that fit in budget"""
+        used = 0
+        kept = 0
+        for turn in reversed(history):
+            cost = self.message_tokens(turn.content)
+            if used + cost > budget:
+                break
+            used += cost
+            kept += 1
+        return kept
+
+    async def _extractive_summary(self, previous: str, turns: List[ChatMessage], max_tokens: int) -> str:
+        """First sentence of every turn appended to the previous summary, oldest lines dropped first"""
+        lines = previous.splitlines() if previous else []
+        for turn in turns:
+            speaker = "User" if turn.role == "user" else "Assistant"
+            lines.append(f"- {speaker}: {_first_sentence(turn.content)}")
+        while len(lines) > 1 and self.tokenizer.count("\n".join(lines)) > max_tokens:
+            lines.pop(0)
+        return self.tokenizer.truncate("\n".join(lines), max_tokens)
+
+    async def _running_summary(
+        self,
+        conversation_id: Optional[str],
+        dropped: List[ChatMessage],
+        kept: List[ChatMessage]
+    ) -> str:
+        """Summary of the dropped turns, extending the conversation's previous summary"""
+        previous, new_turns = "", dropped
+        cached = self._summaries.get(conversation_id) if conversation_id else None
+        if cached is not None:
+            covered, previous = cached
+            self._summaries.move_to_end(conversation_id)
+            dropped_digests = [_turn_digest(turn) for turn in dropped]
+            if covered in dropped_digests:
+                new_turns = dropped[dropped_digests.index(covered) + 1:]
+            elif any(_turn_digest(turn) == covered for turn in kept):
+                new_turns = []
+            # Otherwise the covered turn already left the stored history: every dropped turn is new
+        if not new_turns:
+            return previous
+
+        summary = None
+        if self.summary_mode == "model":
+            try:
+                summary = await self.summarize(previous, new_turns, self.summary_max_tokens)
+                summary = self.tokenizer.truncate(summary or "", self.summary_max_tokens)
+            except Exception as e:
+                logger.warning(f"Summary request failed, using an extractive summary: {e}")
+        if not summary:
+            summary = await self._extractive_summary(previous, new_turns, self.summary_max_tokens)
+        self.summaries_built += 1
+
+        if conversation_id:
+            self._summaries[conversation_id] = (_turn_digest(dropped[-1]), summary)
+            self._summaries.move_to_end(conversation_id)
+            if len(self._summaries) > self.max_summaries:
+                self._summaries.popitem(last=False)
+        return summary
+
+    async def assemble(
+        self,
+        system_prompt: str,
+        user_message: Optional[str] = None,
+        history: List[ChatMessage] = None,
+        documents: List[RetrievedDocument] = None,
+        format_sources: Callable[[List[RetrievedDocument]], str] = format_sources,
+        conversation_id: Optional[str] = None
+    ) -> AssembledPrompt:
+        """
+        Build the messages of one completion
+
+        Args:
+            system_prompt: Base system prompt
+            user_message: Current user message
+            history: Conversation history, oldest first
+            documents: Locally retrieved documents, best first; None when Azure
+                retrieves them ("On Your Data")
+            format_sources: Renders documents as the sources block of the system message
+            conversation_id: Key of the running summary; without it summaries are not reused
+        """
+        history = history or []
+        tokens = {name: 0 for name in SECTIONS}
+        tokens["system"] = self.message_tokens(system_prompt)
+        tokens["user"] = self.message_tokens(user_message) if user_message else 0
+        available = self.context_window - self.answer_reserve - tokens["system"] - tokens["user"]
+
+        system_content = system_prompt
+        kept_documents = None
+        documents_room = min(self.documents_budget, max(available, 0))
+        if documents is not None:
+            kept_documents, sources = self._fit_documents(documents, documents_room, format_sources)
+            system_content = f"{system_prompt}\n\n{sources}"
+            # Counted once, uncached: this text is unique to the request
+            tokens["documents"] = self.tokenizer.count(system_content, cache=False) + MESSAGE_OVERHEAD - tokens["system"]
+            available -= tokens["documents"]
+        else:
+            available -= documents_room
+
+        history_room = max(min(self.history_budget, available), 0)
+        kept_turns = self._fit_history(history, history_room)
+        summary = ""
+        if kept_turns < len(history) and self.summary_mode != "off":
+            # Make room for the summary, then summarize everything that is left out
+            summary_room = min(self.summary_max_tokens + MESSAGE_OVERHEAD + self.tokenizer.count(SUMMARY_PREFIX), history_room)
+            kept_turns = self._fit_history(history, history_room - summary_room)
+            split = len(history) - kept_turns
+            summary = await self._running_summary(conversation_id, history[:split], history[split:])
+        split = len(history) - kept_turns
+        recent = history[split:]
+
+        messages = [{"role": "system", "content": system_content}]
+        if summary:
+            messages.append({"role": "system", "content": SUMMARY_PREFIX + summary})
+            tokens["summary"] = self.message_tokens(messages[-1]["content"])
+        for turn in recent:
+            messages.append({"role": turn.role, "content": turn.content})
+            tokens["history"] += self.message_tokens(turn.content)
+        if user_message:
+            messages.append({"role": "user", "content": user_message})
+        tokens["total"] = sum(tokens[name] for name in SECTIONS)
+
+        self.builds += 1
+        for name in SECTIONS:
+            self.section_totals[name] += tokens[name]
+        self.max_total = max(self.max_total, tokens["total"])
+        self.dropped_turns += split
+        logger.debug(
+            "Prompt tokens: %s (history turns kept %s, dropped %s)",
+            " ".join(f"{name}={tokens[name]}" for name in SECTIONS + ("total",)),
+            kept_turns,
+            split,
+            extra=per_message(conversation_id)
+        )
+        return AssembledPrompt(
+            messages=messages,
+            documents=kept_documents,
+            tokens=tokens,
+            history_turns=kept_turns,
+            dropped_turns=split
+        )
+
+    def stats(self) -> dict:
+        """Average tokens per section and budget pressure since startup"""
+        builds = self.builds or 1
+        return {
+            "builds": self.builds,
+            "avg_tokens": {name: round(total / builds, 1) for name, total in self.section_totals.items()},
+            "avg_total_tokens": round(sum(self.section_totals.values()) / builds, 1),
+            "max_total_tokens": self.max_total,
+            "dropped_turns": self.dropped_turns,
+            "truncated_documents": self.truncated_documents,
+            "summaries_built": self.summaries_built,
+            "tokenizer": self.tokenizer.stats()
+        }
+
+
+def build_prompt_assembler(app_settings, summarize: Summarizer = None) -> PromptAssembler:
+    """Create the prompt assembler configured in AppSettings"""
+    return PromptAssembler(
+        Tokenizer(app_settings.tokenizer_encoding, app_settings.tokenizer_cache_entries),
+        context_window=app_settings.prompt_context_window,
+        answer_reserve=app_settings.openai_completion_token_reserve,
+        documents_budget=app_settings.prompt_documents_budget,
+        history_budget=app_settings.prompt_history_budget,
+        summary_mode=app_settings.prompt_summary_mode,
+        summary_max_tokens=app_settings.prompt_summary_max_tokens,
+        summarize=summarize
+    )
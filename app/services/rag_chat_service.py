@@ -5,13 +5,26 @@ This module implements a Retrieval Augmented Generation (RAG) service that conne
 Azure OpenAI with Azure AI Search. RAG enhances LLM responses by grounding them in
 your enterprise data stored in Azure AI Search.
 """
+import hashlib
 import logging
-from typing import List
-from azure.identity import DefaultAzureCredential, get_bearer_token_provider
-from openai import AsyncAzureOpenAI
+import time
+from typing import TYPE_CHECKING, AsyncIterator, List, Optional, Tuple
 from app.models.chat_models import ChatMessage
+from app.services.answer_cache import AnswerCache, build_answer_cache, normalize_question
+from app.services.coalescing import SingleFlight
+from app.services.context_compression import ContextCompressor, build_context_compressor
+from app.services.admission import AdmissionController, build_admission_controller
+from app.services.metrics import metrics
+from app.services.prompt_assembly import PromptAssembler, build_prompt_assembler, format_sources
+from app.services.routing import ROUTE_CANNED, ROUTE_CHAT, ROUTE_RAG, QueryRouter, RouteDecision, build_query_router
+from app.logging_setup import per_message
+from app.services.retrieval.base import RetrievedDocument, Retriever
 from app.config import settings
 
+if TYPE_CHECKING:
+    # openai is only imported when the registry builds the client
+    from openai import AsyncAzureOpenAI
+
 logger = logging.getLogger(__name__)
 
 
@@ -21,40 +34,267 @@ class RagChatService:
     by connecting Azure OpenAI with Azure AI Search for grounded responses.
     
     This service:
-    1. Handles authentication to Azure services using Managed Identity
+    1. Handles authentication to Azure services using Managed Identity, through the
+       credential and client shared by app.services.registry
     2. Implements the "On Your Data" pattern using Azure AI Search as a data source
     3. Processes user queries and returns AI-generated responses grounded in your data
+    4. Serves repeated and near-duplicate questions from an answer cache
+    5. Optionally grounds answers with a local retriever instead of "On Your Data"
+    6. Coalesces concurrent identical questions into one upstream request
+    7. Admits upstream calls through an adaptive limiter with RPM/TPM budgets
+    8. Fits documents and history into a token budget, optionally summarizing older turns
+    9. Routes small talk to canned replies or a cheaper deployment without retrieval
+    10. Picks up prompt, deployment and index changes from reloaded settings
+    11. Compresses locally retrieved documents (near-duplicates, repeated and off-query
+        sentences) before they are fitted into the prompt
     """
     
-    def __init__(self):
-        """Initialize the RAG chat service using settings from app config"""
-        # Store settings for easy access
-        self.openai_endpoint = settings.azure_openai_endpoint
-        self.gpt_deployment = settings.azure_openai_gpt_deployment
-        self.embedding_deployment = settings.azure_openai_embedding_deployment
-        self.search_url = settings.azure_search_service_url
-        self.search_index_name = settings.azure_search_index_name
-        self.system_prompt = settings.system_prompt
-        
-        # Create Azure credentials for managed identity
-        # This allows secure, passwordless authentication to Azure services
-        self.credential = DefaultAzureCredential()
-        token_provider = get_bearer_token_provider(
-            self.credential,
-            "https://cognitiveservices.azure.com/.default"
+    def __init__(
+        self,
+        openai_client: "AsyncAzureOpenAI" = None,
+        answer_cache: AnswerCache = None,
+        retriever: Retriever = None,
+        admission: AdmissionController = None,
+        prompt_assembler: PromptAssembler = None,
+        router: QueryRouter = None,
+        compressor: ContextCompressor = None
+    ):
+        """
+        Initialize the RAG chat service using settings from app config
+        
+        Args:
+            openai_client: Optional pre-built client (e.g. a fake client in tests);
+                when omitted, the process-wide client from the registry is used
+            answer_cache: Optional answer cache; when omitted, it is built from settings
+            retriever: Optional retriever; when set, documents are retrieved locally and
+                the grounded prompt is built here instead of using the azure_search data source
+            admission: Optional admission controller; when omitted, it is built from settings
+            prompt_assembler: Optional prompt assembler; when omitted, it is built from settings
+            router: Optional query router; when omitted, it is built from settings
+            compressor: Optional context compressor for retrieved documents; when
+                omitted, it is built from settings
+        """
+        # Store settings for easy access; apply_settings replaces them on reload
+        self.apply_settings(settings.current)
+        self.retriever = retriever
+        
+        if openai_client is None:
+            # Share the credential, cached token and HTTP pool of the whole process
+            # instead of creating a new DefaultAzureCredential per service
+            from app.services.registry import registry
+            openai_client = registry.get_openai_client()
+        self.openai_client = openai_client
+        
+        # Answer cache for exact and near-duplicate questions (None when disabled)
+        self.answer_cache = answer_cache if answer_cache is not None else build_answer_cache(settings)
+        
+        # Single-flight deduplication of concurrent identical requests
+        self.single_flight = SingleFlight()
+        
+        # Concurrency limit, RPM/TPM budgets and 429 handling for upstream calls
+        self.admission = admission if admission is not None else build_admission_controller(settings)
+        
+        # Token budgets for documents, history and the answer
+        self.prompt_assembler = (
+            prompt_assembler if prompt_assembler is not None
+            else build_prompt_assembler(settings, summarize=self._summarize)
         )
         
-        # Create Azure OpenAI client
-        # We use the latest Azure OpenAI Python SDK with async support
-        self.openai_client = AsyncAzureOpenAI(
-            azure_endpoint=self.openai_endpoint,
-            azure_ad_token_provider=token_provider,
-            api_version="2024-10-21"
+        # Local classification of small talk and the deployment used by each route
+        self.router = router if router is not None else build_query_router(settings)
+        
+        # Near-duplicate, repeated and off-query text removed from retrieved documents (None when off)
+        self.compressor = (
+            compressor if compressor is not None
+            else build_context_compressor(settings, self.prompt_assembler.tokenizer)
         )
         
         logger.info("RagChatService initialized with environment variables")
     
-    async def get_chat_completion(self, user_message: str = None, conversation_history: List[ChatMessage] = None):
+    def apply_settings(self, snapshot):
+        """
+        Take the plain values (prompt, deployments, index names) from a settings snapshot
+        
+        Called at construction and by the registry when the settings file is reloaded.
+        Clients built from settings are rebuilt by the registry, not here.
+        """
+        self.openai_endpoint = snapshot.azure_openai_endpoint
+        self.gpt_deployment = snapshot.azure_openai_gpt_deployment
+        self.embedding_deployment = snapshot.azure_openai_embedding_deployment
+        self.search_url = snapshot.azure_search_service_url
+        self.search_index_name = snapshot.azure_search_index_name
+        self.system_prompt = snapshot.system_prompt
+        self.retrieval_top_k = snapshot.retrieval_top_k
+        self.completion_token_reserve = snapshot.openai_completion_token_reserve
+        self.route_deployments = {
+            ROUTE_CHAT: snapshot.routing_chat_deployment or self.gpt_deployment,
+            ROUTE_RAG: snapshot.routing_rag_deployment or self.gpt_deployment
+        }
+        # Answers cached under another prompt, deployment or set of indexes are not reused
+        self.settings_signature = hashlib.sha256(
+            "\x1f".join((
+                self.system_prompt,
+                self.route_deployments[ROUTE_RAG],
+                snapshot.retrieval_mode,
+                snapshot.search_indexes,
+                snapshot.context_compression
+            )).encode("utf-8")
+        ).hexdigest()[:16]
+    
+    @staticmethod
+    def _format_sources(documents: List[RetrievedDocument]) -> str:
+        """Render retrieved documents as numbered sources the model can cite as [docN]"""
+        return format_sources(documents)
+    
+    async def _prepare_request(
+        self,
+        user_message: str = None,
+        conversation_history: List[ChatMessage] = None,
+        conversation_id: str = None,
+        route: str = ROUTE_RAG
+    ) -> Tuple[list, dict, Optional[list]]:
+        """
+        Build the messages and request options for a completion
+        
+        Returns:
+            (messages, request options, citations). Citations are None with the
+            "On Your Data" data source, because Azure OpenAI returns them in the response
+        """
+        if route == ROUTE_CHAT:
+            # Small talk: no data source and no retrieval
+            prompt = await self.prompt_assembler.assemble(
+                self.system_prompt,
+                user_message,
+                conversation_history,
+                conversation_id=conversation_id
+            )
+            return prompt.messages, {}, []
+        
+        if self.retriever is None or not user_message:
+            prompt = await self.prompt_assembler.assemble(
+                self.system_prompt,
+                user_message,
+                conversation_history,
+                conversation_id=conversation_id
+            )
+            return prompt.messages, {"extra_body": {"data_sources": [self._build_data_source()]}}, None
+        
+        documents = await self.retriever.retrieve(user_message, top_k=self.retrieval_top_k)
+        logger.debug(f"Retrieved {len(documents)} documents in {self.retriever.stats.last_ms:.1f} ms")
+        if self.compressor is not None:
+            with metrics.span("compression"):
+                documents = self.compressor.compress(user_message, documents).documents
+        prompt = await self.prompt_assembler.assemble(
+            self.system_prompt,
+            user_message,
+            conversation_history,
+            documents=documents,
+            format_sources=self._format_sources,
+            conversation_id=conversation_id
+        )
+        # Only the documents that fit are cited, numbered as in the prompt
+        return prompt.messages, {}, [doc.as_citation() for doc in prompt.documents]
+    
+    def _estimate_tokens(self, messages: list) -> int:
+        """Tokens a request is expected to use, charged against the TPM budget up front"""
+        return self.prompt_assembler.count_messages(messages) + self.completion_token_reserve
+    
+    async def _route(self, user_message: Optional[str]) -> RouteDecision:
+        """Route of a message; everything goes to RAG when routing is disabled"""
+        if self.router is None or not user_message:
+            return RouteDecision(ROUTE_RAG, "default")
+        decision = await self.router.route(user_message)
+        logger.debug(
+            "Routed message to %s (%s, intent=%s, score=%.2f)",
+            decision.route, decision.reason, decision.intent, decision.score,
+            extra=per_message()
+        )
+        return decision
+    
+    def _record_route_latency(self, route: str, started: float):
+        if self.router is not None:
+            self.router.stats.record_latency(route, (time.perf_counter() - started) * 1000)
+    
+    async def _summarize(self, previous: str, turns: List[ChatMessage], max_tokens: int) -> str:
+        """Extend a running conversation summary with turns, using the chat deployment"""
+        transcript = "\n".join(f"{turn.role}: {turn.content}" for turn in turns)
+        messages = [
+            {
+                "role": "system",
+                "content": "Update the summary of a conversation with the new messages. Keep facts, "
+                           "names and open questions; reply with the summary only."
+            },
+            {"role": "user", "content": f"Summary so far:\n{previous or '(empty)'}\n\nNew messages:\n{transcript}"}
+        ]
+        with metrics.span("summary"):
+            response = await self.admission.call(
+                lambda: self.openai_client.chat.completions.create(
+                    model=self.gpt_deployment,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    stream=False
+                ),
+                estimated_tokens=self.prompt_assembler.count_messages(messages) + max_tokens
+            )
+        return response.choices[0].message.content if response.choices else ""
+    
+    async def _timed_create(self, **kwargs):
+        """One non-streaming upstream call, recorded as the completion stage"""
+        with metrics.span("completion"):
+            return await self.openai_client.chat.completions.create(**kwargs)
+    
+    def _coalesce_key(self, user_message: str, conversation_history: List[ChatMessage] = None) -> str:
+        """Identity of a request for single-flight coalescing: history signature + normalized prompt"""
+        return f"{self._cache_namespace(conversation_history)}\n{normalize_question(user_message)}"
+    
+    def _cache_namespace(self, conversation_history: List[ChatMessage] = None) -> str:
+        """Answer cache namespace: embedding deployment, index, answer settings and a history digest"""
+        history_signature = ""
+        if conversation_history:
+            digest = hashlib.sha256()
+            for msg in conversation_history:
+                digest.update(f"{msg.role}\x1f{msg.content}\x1e".encode("utf-8"))
+            history_signature = digest.hexdigest()
+        return AnswerCache.build_namespace(
+            self.embedding_deployment,
+            self.search_index_name,
+            history_signature,
+            self.settings_signature
+        )
+    
+    def _build_data_source(self) -> dict:
+        """
+        Configure Azure AI Search data source according to the "On Your Data" pattern
+        
+        This connects Azure OpenAI directly to your search index without needing to
+        manually implement vector search, chunking, or semantic rankers
+        """
+        return {
+            "type": "azure_search",
+            "parameters": {
+                "endpoint": self.search_url,
+                "index_name": self.search_index_name,
+                "authentication": {
+                    "type": "system_assigned_managed_identity"
+                },
+                # Combines vector and traditional search
+                "query_type": "vector_semantic_hybrid",
+                # The naming pattern for semantic configuration is generated by Azure AI Search 
+                # during integrated vectorization and cannot be customized
+                "semantic_configuration": f"{self.search_index_name}-semantic-configuration",
+                "embedding_dependency": {
+                    "type": "deployment_name",
+                    "deployment_name": self.embedding_deployment
+                }
+            }
+        }
+    
+    async def get_chat_completion(
+        self,
+        user_message: str = None,
+        conversation_history: List[ChatMessage] = None,
+        conversation_id: str = None
+    ):
         """
         Process a chat completion request with RAG capabilities by integrating with Azure AI Search
         
@@ -67,89 +307,248 @@ class RagChatService:
         Args:
             user_message: Current user message (optional, for direct message handling)
             conversation_history: List of chat messages from the conversation history (optional)
+            conversation_id: Conversation the history belongs to (optional), used to
+                reuse its running summary
             
         Returns:
-            Dict with message content and metadata from Azure AI Search
+            Dict with message content, citations from Azure AI Search and, for
+            upstream (non-cached) answers, token usage
         """
         try:
-            # Initialize messages with system prompt
-            messages = [{
-                "role": "system", 
-                "content": self.system_prompt
-            }]
+            started = time.perf_counter()
+            decision = await self._route(user_message)
+            if decision.route == ROUTE_CANNED:
+                self._record_route_latency(ROUTE_CANNED, started)
+                return {"message": decision.canned_reply, "citations": []}
             
-            # Add conversation history if provided
-            if conversation_history:
-                # Limit chat history to the 20 most recent messages to prevent token limit issues
-                recent_history = conversation_history[-20:] if len(conversation_history) > 20 else conversation_history
-                
-                # Add conversation history
-                for msg in recent_history:
-                    messages.append({
-                        "role": msg.role,
-                        "content": msg.content
-                    })
+            cache_namespace = None
+            if self.answer_cache is not None and user_message and decision.route == ROUTE_RAG:
+                cache_namespace = self._cache_namespace(conversation_history)
+                cached = await self.answer_cache.lookup(user_message, cache_namespace)
+                if cached is not None:
+                    logger.info("Answer served from cache", extra=per_message())
+                    return cached
             
-            # Add current user message if provided
-            if user_message:
-                messages.append({
-                    "role": "user",
-                    "content": user_message
-                })
+            if not user_message:
+                return await self._complete(user_message, conversation_history, cache_namespace, conversation_id)
             
-            # Configure Azure AI Search data source according to the "On Your Data" pattern
-            # This connects Azure OpenAI directly to your search index without needing to
-            # manually implement vector search, chunking, or semantic rankers
-            data_source = {
-                "type": "azure_search",
-                "parameters": {
-                    "endpoint": self.search_url,
-                    "index_name": self.search_index_name,
-                    "authentication": {
-                        "type": "system_assigned_managed_identity"
-                    },
-                    # Combines vector and traditional search
-                    "query_type": "vector_semantic_hybrid",
-                    # The naming pattern for semantic configuration is generated by Azure AI Search 
-                    # during integrated vectorization and cannot be customized
-                    "semantic_configuration": f"{self.search_index_name}-semantic-configuration",
-                    "embedding_dependency": {
-                        "type": "deployment_name",
-                        "deployment_name": self.embedding_deployment
-                    }
+            # Concurrent identical questions share one upstream completion
+            result = await self.single_flight.run(
+                self._coalesce_key(user_message, conversation_history),
+                lambda: self._complete(
+                    user_message, conversation_history, cache_namespace, conversation_id, decision.route
+                ),
+                weight=lambda result: result.get("usage", {}).get("total_tokens", 0)
+            )
+            return dict(result)
+            
+        except Exception as e:
+            logger.error(f"Error in get_chat_completion: {str(e)}")
+            # Propagate all errors to the controller layer
+            raise
+
+    async def _complete(
+        self,
+        user_message: str,
+        conversation_history: List[ChatMessage],
+        cache_namespace: Optional[str],
+        conversation_id: str = None,
+        route: str = ROUTE_RAG
+    ) -> dict:
+        """Send one completion request upstream and store the answer in the cache"""
+        started = time.perf_counter()
+        with metrics.span("prompt_build"):
+            messages, request_options, local_citations = await self._prepare_request(
+                user_message, conversation_history, conversation_id, route
+            )
+        
+        # Call Azure OpenAI for completion with the data_sources parameter directly
+        # The data_sources parameter enables the "On Your Data" pattern, where
+        # Azure OpenAI automatically retrieves relevant documents from your search index.
+        # With a local retriever the sources are already in the system message.
+        estimated_tokens = self._estimate_tokens(messages)
+        response = await self.admission.call(
+            lambda: self._timed_create(
+                model=self.route_deployments[route],
+                messages=messages,
+                stream=False,
+                **request_options
+            ),
+            estimated_tokens=estimated_tokens
+        )
+        
+        # Extract the message content and return formatted response
+        if response.choices and len(response.choices) > 0:
+            message_content = response.choices[0].message.content
+            if local_citations is not None:
+                citations = local_citations
+            else:
+                citations = getattr(response.choices[0].message, 'context', {}).get('citations', []) if hasattr(response.choices[0].message, 'context') else []
+            usage = getattr(response, 'usage', None)
+            if usage is not None:
+                self.admission.charge((usage.total_tokens or 0) - estimated_tokens)
+            result = {
+                "message": message_content,
+                "citations": citations,
+                "usage": {
+                    "prompt_tokens": getattr(usage, 'prompt_tokens', 0) or 0,
+                    "completion_tokens": getattr(usage, 'completion_tokens', 0) or 0,
+                    "total_tokens": getattr(usage, 'total_tokens', 0) or 0
                 }
             }
+            if cache_namespace is not None and message_content:
+                await self.answer_cache.store(
+                    user_message,
+                    cache_namespace,
+                    result,
+                    tokens=result["usage"]["total_tokens"],
+                    latency_ms=(time.perf_counter() - started) * 1000
+                )
+            self._record_route_latency(route, started)
+            return result
+        else:
+            return {
+                "message": "No pude generar una respuesta.",
+                "citations": []
+            }
+
+    async def stream_chat_completion(
+        self,
+        user_message: str = None,
+        conversation_history: List[ChatMessage] = None,
+        conversation_id: str = None
+    ) -> AsyncIterator[dict]:
+        """
+        Streaming variant of get_chat_completion
+        
+        Sends the same "On Your Data" request with stream=True and yields events as
+        they arrive, so callers can show the answer before it is fully generated:
+        
+        - {"type": "delta", "content": str} for every chunk of generated text
+        - {"type": "end", "message": str, "citations": list} once the stream finishes
+        
+        Citations are delivered by Azure OpenAI in the "context" of the streamed deltas
+        and are only reported in the final event. Concurrent identical questions
+        share one upstream stream.
+        """
+        try:
+            started = time.perf_counter()
+            decision = await self._route(user_message)
+            if decision.route == ROUTE_CANNED:
+                self._record_route_latency(ROUTE_CANNED, started)
+                yield {"type": "delta", "content": decision.canned_reply}
+                yield {"type": "end", "message": decision.canned_reply, "citations": []}
+                return
             
-            # Call Azure OpenAI for completion with the data_sources parameter directly
-            # The data_sources parameter enables the "On Your Data" pattern, where
-            # Azure OpenAI automatically retrieves relevant documents from your search index
-            response = await self.openai_client.chat.completions.create(
-                model=self.gpt_deployment,
-                messages=messages,
-                extra_body={
-                    "data_sources": [data_source]
-                },
-                stream=False
-            )
+            cache_namespace = None
+            if self.answer_cache is not None and user_message and decision.route == ROUTE_RAG:
+                cache_namespace = self._cache_namespace(conversation_history)
+                cached = await self.answer_cache.lookup(user_message, cache_namespace)
+                if cached is not None:
+                    logger.info("Answer served from cache", extra=per_message())
+                    yield {"type": "delta", "content": cached["message"]}
+                    yield {"type": "end", "message": cached["message"], "citations": cached["citations"]}
+                    return
             
-            # Extract the message content and return formatted response
-            if response.choices and len(response.choices) > 0:
-                message_content = response.choices[0].message.content
-                return {
-                    "message": message_content,
-                    "citations": getattr(response.choices[0].message, 'context', {}).get('citations', []) if hasattr(response.choices[0].message, 'context') else []
-                }
+            if user_message:
+                events = self.single_flight.stream(
+                    self._coalesce_key(user_message, conversation_history),
+                    lambda: self._stream_completion(
+                        user_message, conversation_history, cache_namespace, conversation_id, decision.route
+                    )
+                )
             else:
-                return {
-                    "message": "No pude generar una respuesta.",
-                    "citations": []
-                }
+                events = self._stream_completion(user_message, conversation_history, cache_namespace, conversation_id)
+            async for event in events:
+                yield event
             
         except Exception as e:
-            logger.error(f"Error in get_chat_completion: {str(e)}")
+            logger.error(f"Error in stream_chat_completion: {str(e)}")
             # Propagate all errors to the controller layer
             raise
 
+    async def _stream_completion(
+        self,
+        user_message: str,
+        conversation_history: List[ChatMessage],
+        cache_namespace: Optional[str],
+        conversation_id: str = None,
+        route: str = ROUTE_RAG
+    ) -> AsyncIterator[dict]:
+        """Stream one completion from upstream and store the answer in the cache"""
+        started = time.perf_counter()
+        with metrics.span("prompt_build"):
+            messages, request_options, local_citations = await self._prepare_request(
+                user_message, conversation_history, conversation_id, route
+            )
+        
+        parts = []
+        citations = list(local_citations) if local_citations is not None else []
+        usage = None
+        estimated_tokens = self._estimate_tokens(messages)
+        # The admission slot is held for the whole stream, not just the initial request
+        async with self.admission.slot(estimated_tokens):
+            request_started = time.perf_counter()
+            first_token = True
+            stream = await self.admission.retry(
+                lambda: self.openai_client.chat.completions.create(
+                    model=self.route_deployments[route],
+                    messages=messages,
+                    stream=True,
+                    # The last chunk then carries the token usage of the whole stream
+                    stream_options={"include_usage": True},
+                    **request_options
+                )
+            )
+            
+            async for chunk in stream:
+                if getattr(chunk, 'usage', None) is not None:
+                    usage = chunk.usage
+                # Azure may send chunks without choices (e.g. content filter results, the usage chunk)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta is None:
+                    continue
+                context = getattr(delta, 'context', None)
+                if context and context.get('citations'):
+                    citations.extend(context['citations'])
+                if delta.content:
+                    if first_token:
+                        metrics.observe("completion_first_token", time.perf_counter() - request_started)
+                        first_token = False
+                    parts.append(delta.content)
+                    yield {"type": "delta", "content": delta.content}
+            metrics.observe("completion", time.perf_counter() - request_started)
+        if usage is not None:
+            self.admission.charge((usage.total_tokens or 0) - estimated_tokens)
+        self._record_route_latency(route, started)
+        
+        message_content = "".join(parts) or "No pude generar una respuesta."
+        usage = {
+            "prompt_tokens": getattr(usage, 'prompt_tokens', 0) or 0,
+            "completion_tokens": getattr(usage, 'completion_tokens', 0) or 0,
+            "total_tokens": getattr(usage, 'total_tokens', 0) or 0
+        }
+        if cache_namespace is not None and parts:
+            await self.answer_cache.store(
+                user_message,
+                cache_namespace,
+                {"message": message_content, "citations": citations, "usage": usage},
+                tokens=usage["total_tokens"],
+                latency_ms=(time.perf_counter() - started) * 1000
+            )
+        yield {"type": "end", "message": message_content, "citations": citations, "usage": usage}
+
 
-# Create singleton instance
-rag_chat_service = RagChatService()
+def __getattr__(name):
+    """
+    Module-level ``rag_chat_service`` singleton, resolved through the registry
+
+    Kept for backwards compatibility; it is the same instance every bot receives
+    from ``registry.get_rag_chat_service()``.
+    """
+    if name == "rag_chat_service":
+        from app.services.registry import registry
+        return registry.get_rag_chat_service()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,506 @@
+"""
+Process-wide registry of Azure clients and services
+
+Every consumer in a process (both bots, the service singleton, CLIs) gets its Azure
+resources from here, so a process holds exactly one of each:
+
+1. One async ``DefaultAzureCredential``
+2. One cached bearer token for Azure OpenAI, refreshed shortly before it expires
+3. One tuned ``httpx.AsyncClient`` connection pool (limits, keepalive, HTTP/2)
+4. One ``AsyncAzureOpenAI`` client (or, with ``AZURE_OPENAI_ENDPOINTS``, one endpoint
+   pool over several of them) and one ``RagChatService`` built on top of it
+5. One admission controller that every Azure OpenAI completion goes through
+6. One conversation history store
+7. One embedder, behind the shared embedding cache, and in local or fan-out
+   retrieval mode one retriever (with its own Azure AI Search token)
+
+When the settings file is reloaded (app.config.provider), only the components whose
+settings changed are rebuilt and swapped into the running service; replaced HTTP
+pools, retrievers and answer caches are closed once in-flight requests have had time
+to finish, or right away on shutdown.
+
+Resources are created lazily on first use, so importing a bot does not import
+openai, azure.identity or httpx. ``startup()`` and ``shutdown()`` are meant to be wired
+to the web server's lifecycle hooks; with ``STARTUP_PREWARM`` the startup hook builds
+the service and fetches the first token in the background, after the server is
+already accepting requests.
+"""
+import asyncio
+import importlib
+import logging
+import time
+from typing import Optional
+
+from app.services.metrics import metrics
+from app.startup import startup
+
+logger = logging.getLogger(__name__)
+
+# Seconds shutdown waits for replaced resources to close
+RETIRE_CLOSE_TIMEOUT_SECONDS = 10.0
+
+# Imported by the pre-warm in a worker thread, so the event loop keeps serving meanwhile
+PREWARM_IMPORTS = ("httpx", "openai", "azure.identity.aio")
+
+COGNITIVE_SERVICES_SCOPE = "https://cognitiveservices.azure.com/.default"
+SEARCH_SCOPE = "https://search.azure.com/.default"
+OPENAI_API_VERSION = "2024-10-21"
+
+# Settings (names or prefixes) whose change rebuilds each component on reload
+RELOAD_COMPONENTS = {
+    "http": ("http_", "http2"),
+    "openai": ("azure_openai_endpoint", "azure_openai_api_key", "openai_hedge_", "openai_breaker_"),
+    "embedder": ("embedding_", "local_embedding_", "azure_openai_embedding_deployment"),
+    "retriever": (
+        "retrieval_mode", "retrieval_hybrid_alpha", "retrieval_index_timeout_ms", "retrieval_latency_budget_ms",
+        "retrieval_fanout_candidates", "retrieval_rrf_k", "local_index_path", "search_indexes", "azure_search_"
+    ),
+    "admission": (
+        "openai_requests_per_minute", "openai_tokens_per_minute", "openai_initial_concurrency",
+        "openai_min_concurrency", "openai_max_concurrency", "openai_max_queue", "openai_queue_timeout_seconds",
+        "openai_max_retries"
+    ),
+    "answer_cache": ("answer_cache_",),
+    "router": (
+        "routing_enabled", "routing_canned_replies", "routing_similarity_threshold",
+        "routing_max_small_talk_words", "routing_use_embeddings"
+    ),
+    "prompt": ("prompt_", "tokenizer_"),
+    "compression": ("context_compression",),
+    "citations": ("citations_",)
+}
+
+
+class CachedTokenProvider:
+    """
+    Async bearer token provider that caches the token until shortly before expiry
+
+    Concurrent callers share one in-flight token request instead of each hitting
+    the identity endpoint.
+    """
+
+    def __init__(self, credential, scope: str = COGNITIVE_SERVICES_SCOPE, refresh_margin_seconds: float = 300):
+        self.credential = credential
+        self.scope = scope
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self._token: Optional[str] = None
+        self._expires_on: float = 0.0
+        self._lock = asyncio.Lock()
+
+    def _valid(self) -> bool:
+        return self._token is not None and time.time() < self._expires_on - self.refresh_margin_seconds
+
+    async def __call__(self) -> str:
+        with metrics.span("token_acquisition"):
+            if self._valid():
+                return self._token
+            async with self._lock:
+                if not self._valid():
+                    access_token = await self.credential.get_token(self.scope)
+                    self._token = access_token.token
+                    self._expires_on = access_token.expires_on
+                    logger.debug("Azure OpenAI bearer token refreshed")
+            return self._token
+
+
+class ClientRegistry:
+    """Lazily builds and shares Azure clients and services for the whole process"""
+
+    def __init__(self, app_settings=None):
+        self._settings = app_settings
+        self._credential = None
+        self._token_provider: Optional[CachedTokenProvider] = None
+        self._search_token_provider: Optional[CachedTokenProvider] = None
+        self._http_client = None
+        self._openai_client = None
+        self._rag_chat_service = None
+        self._admission_controller = None
+        self._conversation_store = None
+        self._embedder = None
+        self._retriever = None
+        self._citation_renderer = None
+        self._state_storage = None
+        self._prewarm_task: Optional[asyncio.Task] = None
+        self._settings_subscribed = False
+        self._retiring = set()
+        # Set on shutdown: replaced resources are closed without waiting any longer
+        self._closing: Optional[asyncio.Event] = None
+
+    @property
+    def settings(self):
+        if self._settings is None:
+            from app.config import settings
+            self._settings = settings
+        return self._settings
+
+    def get_credential(self):
+        """Shared async DefaultAzureCredential (managed identity in Azure)"""
+        if self._credential is None:
+            from azure.identity.aio import DefaultAzureCredential
+            self._credential = DefaultAzureCredential()
+        return self._credential
+
+    def get_token_provider(self) -> CachedTokenProvider:
+        """Shared Azure OpenAI bearer token provider"""
+        if self._token_provider is None:
+            self._token_provider = CachedTokenProvider(self.get_credential())
+        return self._token_provider
+
+    def get_search_token_provider(self) -> CachedTokenProvider:
+        """Shared Azure AI Search bearer token provider (fan-out retrieval)"""
+        if self._search_token_provider is None:
+            self._search_token_provider = CachedTokenProvider(self.get_credential(), scope=SEARCH_SCOPE)
+        return self._search_token_provider
+
+    def get_http_client(self):
+        """Shared httpx connection pool used by every Azure OpenAI call"""
+        if self._http_client is None:
+            import httpx
+
+            http2 = self.settings.http2
+            if http2:
+                try:
+                    import h2  # noqa: F401
+                except ImportError:
+                    logger.warning("HTTP2 is enabled but the 'h2' package is not installed; using HTTP/1.1")
+                    http2 = False
+
+            self._http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.settings.http_max_connections,
+                    max_keepalive_connections=self.settings.http_max_keepalive_connections,
+                    keepalive_expiry=self.settings.http_keepalive_expiry
+                ),
+                timeout=httpx.Timeout(self.settings.http_timeout_seconds),
+                http2=http2
+            )
+            logger.info(
+                f"HTTP pool created (max_connections={self.settings.http_max_connections}, "
+                f"keepalive={self.settings.http_max_keepalive_connections}, http2={http2})"
+            )
+        return self._http_client
+
+    def _build_openai_client(self, endpoint: str, api_key: str = ""):
+        """AsyncAzureOpenAI on the shared pool; without api_key it uses the shared token provider"""
+        from openai import AsyncAzureOpenAI
+        if api_key:
+            auth = {"api_key": api_key}
+        else:
+            auth = {"azure_ad_token_provider": self.get_token_provider()}
+        return AsyncAzureOpenAI(
+            azure_endpoint=endpoint,
+            **auth,
+            api_version=OPENAI_API_VERSION,
+            http_client=self.get_http_client(),
+            # 429 retries are owned by the admission controller, which also adapts the limit
+            max_retries=0
+        )
+
+    def get_openai_client(self):
+        """Shared AsyncAzureOpenAI client, or the endpoint pool when AZURE_OPENAI_ENDPOINTS is set"""
+        if self._openai_client is None:
+            if self.settings.openai_endpoint_list:
+                from app.services.endpoint_pool import build_endpoint_pool
+                self._openai_client = build_endpoint_pool(self.settings, self._build_openai_client)
+            else:
+                self._openai_client = self._build_openai_client(
+                    self.settings.azure_openai_endpoint,
+                    self.settings.azure_openai_api_key
+                )
+        return self._openai_client
+
+    def get_rag_chat_service(self):
+        """Shared RagChatService"""
+        if self._rag_chat_service is None:
+            from app.services.rag_chat_service import RagChatService
+            self._rag_chat_service = RagChatService(
+                openai_client=self.get_openai_client(),
+                answer_cache=self._build_answer_cache(),
+                retriever=self.get_retriever(),
+                admission=self.get_admission_controller(),
+                router=self._build_router()
+            )
+        return self._rag_chat_service
+
+    def _build_answer_cache(self):
+        """Answer cache matching near-duplicates with the shared embedder, or None (built by the service)"""
+        if not self.settings.answer_cache_use_embeddings:
+            return None
+        from app.services.answer_cache import build_answer_cache
+        return build_answer_cache(self.settings, embed=self.get_embedder().embed_one)
+
+    def _build_router(self):
+        """Query router using the shared embedder, or None (built by the service)"""
+        if not (self.settings.routing_enabled and self.settings.routing_use_embeddings):
+            return None
+        from app.services.routing import build_query_router
+        return build_query_router(self.settings, embed=self.get_embedder().embed_one)
+
+    def get_admission_controller(self):
+        """Shared admission controller (concurrency limit, RPM/TPM budgets, 429 handling)"""
+        if self._admission_controller is None:
+            from app.services.admission import build_admission_controller
+            self._admission_controller = build_admission_controller(self.settings)
+        return self._admission_controller
+
+    def get_embedder(self):
+        """Shared embedder (Azure OpenAI deployment or local hashing fake), wrapped by the embedding cache"""
+        if self._embedder is None:
+            from app.services.embeddings import AzureOpenAIEmbedder, HashingEmbedder
+            if self.settings.embedding_backend == "hashing":
+                embedder = HashingEmbedder(self.settings.local_embedding_dimensions)
+            else:
+                embedder = AzureOpenAIEmbedder(
+                    self.get_openai_client(),
+                    self.settings.azure_openai_embedding_deployment
+                )
+            if self.settings.embedding_cache_enabled:
+                from app.config import resolve_app_path
+                from app.services.embedding_cache import CachedEmbedder
+                embedder = CachedEmbedder(
+                    embedder,
+                    max_memory_entries=self.settings.embedding_cache_memory_entries,
+                    directory=resolve_app_path(self.settings.embedding_cache_dir) or None
+                )
+            self._embedder = embedder
+        return self._embedder
+
+    def get_retriever(self):
+        """Local or fan-out retriever per RETRIEVAL_MODE, otherwise None (On Your Data)"""
+        if self._retriever is None and self.settings.retrieval_mode == "fanout":
+            from app.services.retrieval.fanout import build_fanout_retriever
+            self._retriever = build_fanout_retriever(self.settings, self)
+        if self._retriever is None and self.settings.retrieval_mode == "local":
+            from app.services.retrieval.local import LocalIndex, LocalRetriever
+            self._retriever = LocalRetriever(
+                LocalIndex.load(self.settings.local_index_path),
+                self.get_embedder(),
+                alpha=self.settings.retrieval_hybrid_alpha
+            )
+        return self._retriever
+
+    def get_conversation_store(self):
+        """Shared conversation history store"""
+        if self._conversation_store is None:
+            from app.services.conversation_store import build_conversation_store
+            self._conversation_store = build_conversation_store(self.settings)
+        return self._conversation_store
+
+    def get_state_storage(self):
+        """Shared botbuilder Storage for ConversationState"""
+        if self._state_storage is None:
+            from app.services.state_storage import build_state_storage
+            self._state_storage = build_state_storage(self.settings)
+        return self._state_storage
+
+    def get_citation_renderer(self):
+        """Shared renderer of answers with their citations (app.citations)"""
+        if self._citation_renderer is None:
+            from app.citations import build_citation_renderer
+            self._citation_renderer = build_citation_renderer(self.settings)
+        return self._citation_renderer
+
+    def stats(self) -> dict:
+        """Counters of the components built so far, keyed by component (exposed on /metrics)"""
+        components = {}
+        service = self._rag_chat_service
+        if service is not None:
+            components["admission"] = service.admission.stats()
+            components["single_flight"] = service.single_flight.stats()
+            if service.answer_cache is not None:
+                components["answer_cache"] = service.answer_cache.stats()
+            components["prompt"] = service.prompt_assembler.stats()
+            if service.compressor is not None:
+                components["compression"] = service.compressor.stats()
+            if service.router is not None:
+                components["routing"] = service.router.stats.as_dict()
+        if self._conversation_store is not None:
+            components["history"] = self._conversation_store.stats()
+        if self._embedder is not None and hasattr(self._embedder, "stats"):
+            components["embedding_cache"] = self._embedder.stats()
+        if self._retriever is not None:
+            components["retrieval"] = self._retriever.stats.as_dict()
+        if self._state_storage is not None and hasattr(self._state_storage, "stats"):
+            components["state"] = self._state_storage.stats()
+        if self._openai_client is not None and hasattr(self._openai_client, "endpoints"):
+            components["endpoints"] = self._openai_client.stats()
+        if self._citation_renderer is not None:
+            components["citations"] = self._citation_renderer.stats()
+        if hasattr(self.settings, "stats"):
+            components["settings"] = self.settings.stats()
+        components["startup"] = startup.report()
+        return components
+
+    async def startup(self, *args):
+        """
+        Startup hook: starts the background pre-warm when STARTUP_PREWARM is set
+
+        Accepts and ignores extra positional arguments so it can be registered
+        directly as an aiohttp on_startup handler.
+        """
+        startup.mark("server_started")
+        if self.settings.startup_prewarm and self._prewarm_task is None:
+            self._prewarm_task = asyncio.ensure_future(self.prewarm())
+        if hasattr(self.settings, "subscribe"):
+            if not self._settings_subscribed:
+                self.settings.subscribe(self.on_settings_changed)
+                self._settings_subscribed = True
+            self.settings.start()
+        logger.info("Client registry started")
+
+    @staticmethod
+    def _affected_components(changed, snapshot) -> set:
+        """Components to rebuild for the changed settings, including the ones built on top of them"""
+        affected = {
+            component for component, names in RELOAD_COMPONENTS.items()
+            if any(name.startswith(names) for name in changed)
+        }
+        if "http" in affected:
+            affected.add("openai")
+            if snapshot.retrieval_mode == "fanout":
+                affected.add("retriever")
+        if "openai" in affected and snapshot.embedding_backend != "hashing":
+            affected.add("embedder")
+        if "embedder" in affected:
+            if snapshot.retrieval_mode == "local":
+                affected.add("retriever")
+            if snapshot.answer_cache_use_embeddings:
+                affected.add("answer_cache")
+            if snapshot.routing_use_embeddings:
+                affected.add("router")
+        if "prompt" in affected:
+            # The compressor counts tokens with the prompt assembler's tokenizer
+            affected.add("compression")
+        return affected
+
+    def _retire(self, close):
+        """Close a replaced resource after in-flight requests had time to finish with it (or on shutdown)"""
+        if self._closing is None:
+            self._closing = asyncio.Event()
+        closing = self._closing
+
+        async def retire():
+            try:
+                await asyncio.wait_for(closing.wait(), timeout=self.settings.http_timeout_seconds)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await close()
+            except Exception as e:
+                logger.warning(f"Closing a replaced resource failed: {e}")
+
+        task = asyncio.ensure_future(retire())
+        self._retiring.add(task)
+        task.add_done_callback(self._retiring.discard)
+
+    async def on_settings_changed(self, old, new, changed):
+        """Settings subscriber: rebuild only the affected components and swap them into the service"""
+        affected = self._affected_components(changed, new)
+        if "http" in affected and self._http_client is not None:
+            self._retire(self._http_client.aclose)
+            self._http_client = None
+        if "openai" in affected:
+            # Not closed: the client only holds the HTTP pool, which is shared or retired above
+            self._openai_client = None
+        if "embedder" in affected:
+            self._embedder = None
+        if "retriever" in affected and self._retriever is not None:
+            self._retire(self._retriever.close)
+            self._retriever = None
+        if "admission" in affected:
+            self._admission_controller = None
+        if "citations" in affected and self._citation_renderer is not None:
+            self._citation_renderer.apply_settings(new)
+
+        service = self._rag_chat_service
+        if service is not None:
+            service.apply_settings(new)
+            if "openai" in affected:
+                service.openai_client = self.get_openai_client()
+            if "retriever" in affected:
+                service.retriever = self.get_retriever()
+            if "admission" in affected:
+                service.admission = self.get_admission_controller()
+            if "answer_cache" in affected:
+                from app.services.answer_cache import build_answer_cache
+                if service.answer_cache is not None:
+                    self._retire(service.answer_cache.close)
+                service.answer_cache = self._build_answer_cache() or build_answer_cache(new)
+            if "router" in affected:
+                from app.services.routing import build_query_router
+                service.router = self._build_router() or build_query_router(new)
+            if "prompt" in affected:
+                from app.services.prompt_assembly import build_prompt_assembler
+                service.prompt_assembler = build_prompt_assembler(new, summarize=service._summarize)
+            if "compression" in affected:
+                from app.services.context_compression import build_context_compressor
+                service.compressor = build_context_compressor(new, service.prompt_assembler.tokenizer)
+        logger.info(f"Applied settings changes, rebuilt: {', '.join(sorted(affected)) or 'nothing'}")
+
+    async def prewarm(self):
+        """Import the Azure client libraries, build the shared service and fetch the first token"""
+        started = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            for module in PREWARM_IMPORTS:
+                await loop.run_in_executor(None, importlib.import_module, module)
+            self.get_rag_chat_service()
+            endpoints = self.settings.openai_endpoint_list
+            api_keys = [endpoint.api_key for endpoint in endpoints] or [self.settings.azure_openai_api_key]
+            if not all(api_keys):
+                await self.get_token_provider()()
+            startup.mark("prewarm_done")
+            logger.info(f"Clients pre-warmed in {(time.perf_counter() - started) * 1000:.0f} ms")
+        except Exception as e:
+            # Not fatal: the first turn builds whatever is missing
+            logger.warning(f"Pre-warm failed: {e}")
+
+    async def shutdown(self, *args):
+        """
+        Shutdown hook: stops the settings watcher, closes replaced resources, flushes
+        pending bot state and closes every component once
+        """
+        if self._prewarm_task is not None:
+            self._prewarm_task.cancel()
+            await asyncio.gather(self._prewarm_task, return_exceptions=True)
+            self._prewarm_task = None
+        if hasattr(self.settings, "stop"):
+            await self.settings.stop()
+        # Replaced resources still waiting for in-flight requests are closed now
+        if self._closing is not None:
+            self._closing.set()
+        retiring = list(self._retiring)
+        if retiring:
+            _, pending = await asyncio.wait(retiring, timeout=RETIRE_CLOSE_TIMEOUT_SECONDS)
+            if pending:
+                logger.warning(f"{len(pending)} replaced resources did not close in time")
+        self._closing = None
+
+        service = self._rag_chat_service
+        if service is not None and service.answer_cache is not None:
+            await service.answer_cache.close()
+        for component in (self._state_storage, self._conversation_store, self._retriever, self._embedder):
+            if component is not None and hasattr(component, "close"):
+                await component.close()
+        # OpenAI clients (and the endpoint pool) only hold the shared HTTP pool, closed once here
+        if self._http_client is not None:
+            await self._http_client.aclose()
+        if self._credential is not None:
+            await self._credential.close()
+        self._credential = None
+        self._token_provider = None
+        self._search_token_provider = None
+        self._http_client = None
+        self._openai_client = None
+        self._rag_chat_service = None
+        self._admission_controller = None
+        self._conversation_store = None
+        self._embedder = None
+        self._retriever = None
+        self._citation_renderer = None
+        self._state_storage = None
+        logger.info("Client registry shut down")
+
+
+# Create singleton instance
+registry = ClientRegistry()
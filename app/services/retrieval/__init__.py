@@ -0,0 +1,3 @@
+"""
+Retrieval engines for the RAG Chat Service.
+"""
@@ -0,0 +1,130 @@
+"""
+Azure AI Search retriever
+
+Queries one Azure AI Search index directly over its REST API, through the shared
+httpx pool, instead of through the Azure OpenAI "On Your Data" data source. This is
+what lets the fan-out retriever query several indexes at once, each with its own
+timeout. Authentication is an API key or an Entra ID token for the search scope.
+
+By default the query is the same as the one "On Your Data" sends
+(``vector_semantic_hybrid``): full text search plus a vector query that the index
+vectorizer embeds (``kind: text``), re-ranked with the semantic configuration that
+integrated vectorization creates (``<index>-semantic-configuration``). The default
+field names are those of an integrated vectorization index: ``chunk_id`` (id),
+``chunk`` (content), ``title`` and ``text_vector`` (the vector field); it has no
+filepath or url fields. Indexes with another schema map their own names with
+``SearchIndexSettings.fields``, e.g. ``{"id": "id", "content": "content", "vector": "contentVector"}``.
+"""
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from app.services.retrieval.base import RetrievedDocument, Retriever
+
+logger = logging.getLogger(__name__)
+
+SEARCH_API_VERSION = "2024-07-01"
+
+# Document fields read by default (integrated vectorization schema); override per
+# index with SearchIndexSettings.fields. An empty name means the field is not read.
+DEFAULT_FIELDS = {
+    "id": "chunk_id",
+    "content": "chunk",
+    "title": "title",
+    "filepath": "",
+    "url": "",
+    "vector": "text_vector"
+}
+
+QUERY_TYPES = ("vector_semantic_hybrid", "vector_hybrid", "semantic", "keyword")
+
+# Nearest neighbours asked from the vector query; the semantic ranker re-ranks the top 50
+VECTOR_CANDIDATES = 50
+
+
+class AzureSearchRetriever(Retriever):
+    """
+    Hybrid (full text + vector) search with semantic ranking over one Azure AI Search index
+
+    Args:
+        http_client: Shared httpx.AsyncClient
+        service_url: https://<service>.search.windows.net
+        index_name: Index to query
+        api_key: Admin or query key; when empty token_provider is used
+        token_provider: Async function returning a bearer token for https://search.azure.com
+        fields: Mapping of RetrievedDocument fields (and "vector") to index fields
+        query_type: vector_semantic_hybrid | vector_hybrid | semantic | keyword; the
+            vector types need a vectorizer on the index's vector field
+        semantic_configuration: Semantic configuration; empty = <index>-semantic-configuration
+    """
+
+    def __init__(
+        self,
+        http_client,
+        service_url: str,
+        index_name: str,
+        api_key: str = "",
+        token_provider: Optional[Callable[[], Awaitable[str]]] = None,
+        fields: Dict[str, str] = None,
+        query_type: str = "vector_semantic_hybrid",
+        semantic_configuration: str = ""
+    ):
+        if query_type not in QUERY_TYPES:
+            raise ValueError(f"Unknown query type '{query_type}' for index {index_name}")
+        super().__init__()
+        self.http_client = http_client
+        self.index_name = index_name
+        self.api_key = api_key
+        self.token_provider = token_provider
+        self.fields = {**DEFAULT_FIELDS, **(fields or {})}
+        self.query_type = query_type
+        self.semantic_configuration = semantic_configuration or f"{index_name}-semantic-configuration"
+        # Only the mapped fields are returned, never the vectors
+        self._select = ",".join(
+            dict.fromkeys(name for field, name in self.fields.items() if name and field != "vector")
+        )
+        self._url = f"{service_url.rstrip('/')}/indexes/{index_name}/docs/search?api-version={SEARCH_API_VERSION}"
+
+    async def _headers(self) -> dict:
+        if self.api_key:
+            return {"api-key": self.api_key}
+        return {"Authorization": f"Bearer {await self.token_provider()}"}
+
+    def _body(self, query: str, top_k: int) -> dict:
+        body = {"search": query, "top": top_k, "select": self._select}
+        if self.query_type in ("vector_semantic_hybrid", "vector_hybrid"):
+            # The index vectorizer embeds the text, so no embedding call is made here
+            body["vectorQueries"] = [{
+                "kind": "text",
+                "text": query,
+                "fields": self.fields["vector"],
+                "k": max(top_k, VECTOR_CANDIDATES)
+            }]
+        if self.query_type in ("vector_semantic_hybrid", "semantic"):
+            body["queryType"] = "semantic"
+            body["semanticConfiguration"] = self.semantic_configuration
+        return body
+
+    def _field(self, hit: dict, field: str) -> str:
+        name = self.fields.get(field)
+        return (hit.get(name) or "") if name else ""
+
+    async def _retrieve(self, query: str, top_k: int) -> List[RetrievedDocument]:
+        response = await self.http_client.post(
+            self._url,
+            json=self._body(query, top_k),
+            headers=await self._headers()
+        )
+        response.raise_for_status()
+        documents = []
+        for rank, hit in enumerate(response.json().get("value", [])):
+            documents.append(RetrievedDocument(
+                id=str(self._field(hit, "id") or rank),
+                content=self._field(hit, "content"),
+                title=self._field(hit, "title"),
+                filepath=self._field(hit, "filepath"),
+                url=self._field(hit, "url"),
+                # Results are in semantic ranker order when it ran
+                score=hit.get("@search.rerankerScore") or hit.get("@search.score", 0.0),
+                metadata={"index": self.index_name}
+            ))
+        return documents
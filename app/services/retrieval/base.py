@@ -0,0 +1,77 @@
+"""
+Retriever interface
+
+A retriever returns the documents used to ground an answer. When
+``RagChatService`` has a retriever, it builds the grounded prompt itself instead
+of delegating retrieval to the Azure OpenAI "On Your Data" data source, which makes
+retrieval latency measurable and lets the whole pipeline run without Azure.
+"""
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+
+@dataclass
+class RetrievedDocument:
+    """A chunk returned by a retriever"""
+    id: str
+    content: str
+    title: str = ""
+    filepath: str = ""
+    url: str = ""
+    score: float = 0.0
+    metadata: dict = field(default_factory=dict)
+
+    def as_citation(self) -> dict:
+        """Citation in the same shape Azure OpenAI "On Your Data" returns"""
+        return {
+            "content": self.content,
+            "title": self.title,
+            "url": self.url,
+            "filepath": self.filepath,
+            "chunk_id": self.id
+        }
+
+
+@dataclass
+class RetrievalStats:
+    """Latency counters kept by every retriever"""
+    calls: int = 0
+    total_ms: float = 0.0
+    last_ms: float = 0.0
+
+    def record(self, elapsed_ms: float):
+        self.calls += 1
+        self.total_ms += elapsed_ms
+        self.last_ms = elapsed_ms
+
+    def as_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "avg_ms": round(self.total_ms / self.calls, 3) if self.calls else 0.0,
+            "last_ms": round(self.last_ms, 3)
+        }
+
+
+class Retriever(ABC):
+    """Base class for retrievers"""
+
+    def __init__(self):
+        self.stats = RetrievalStats()
+
+    @abstractmethod
+    async def _retrieve(self, query: str, top_k: int) -> List[RetrievedDocument]:
+        """Return up to top_k documents for the query, best first"""
+
+    async def retrieve(self, query: str, top_k: int = 5) -> List[RetrievedDocument]:
+        """Retrieve documents and record the latency"""
+        started = time.perf_counter()
+        try:
+            return await self._retrieve(query, top_k)
+        finally:
+            self.stats.record((time.perf_counter() - started) * 1000)
+
+    async def close(self) -> Optional[None]:
+        """Release resources held by the retriever"""
+        return None
@@ -0,0 +1,116 @@
+"""
+Fake search backend for offline runs and benchmarks
+
+``FakeSearchRetriever`` answers keyword queries with BM25 over an in-memory corpus
+and sleeps for a configurable, seeded latency first: a base latency plus jitter,
+occasional slow responses and occasional failures. Several of them behind the
+fan-out retriever reproduce the tail latency of real multi-index deployments
+without any Azure resource. The corpus is a JSONL file shaped like a local index's
+``chunks.jsonl``, or a synthetic corpus generated from the index name.
+"""
+import asyncio
+import json
+import random
+from typing import List
+
+from app.services.retrieval.base import RetrievedDocument, Retriever
+from app.services.retrieval.bm25 import BM25Index
+
+# Topics of the synthetic corpus; every index gets all of them, in its own words
+SYNTHETIC_TOPICS = {
+    "vpn": "vpn acceso remoto conexion cliente certificado red corporativa",
+    "vacaciones": "vacaciones permisos dias solicitud aprobacion calendario ausencia",
+    "nomina": "nomina salario pago recibo impuestos retenciones banco",
+    "correo": "correo outlook buzon firma reenvio spam calendario",
+    "equipos": "portatil equipo hardware reparacion garantia inventario soporte",
+    "seguridad": "seguridad contrasena phishing autenticacion mfa incidente reporte",
+    "viajes": "viajes gastos reembolso hotel vuelo politica tarjeta",
+    "formacion": "formacion curso plataforma certificacion horas inscripcion"
+}
+
+
+def synthetic_corpus(name: str, documents: int = 200, seed: int = 0) -> List[dict]:
+    """Deterministic chunks about SYNTHETIC_TOPICS, different for every index name"""
+    rng = random.Random(f"{name}:{seed}")
+    topics = list(SYNTHETIC_TOPICS)
+    chunks = []
+    for number in range(documents):
+        topic = topics[number % len(topics)]
+        words = SYNTHETIC_TOPICS[topic].split()
+        # Filler from other topics so keyword scores are not trivial
+        filler = [rng.choice(SYNTHETIC_TOPICS[rng.choice(topics)].split()) for _ in range(20)]
+        content = " ".join(rng.choices(words, k=12) + filler)
+        chunks.append({
+            "id": f"{name}-{number}",
+            "title": f"{topic.capitalize()} ({name}) {number}",
+            "filepath": f"{name}/{topic}-{number}.md",
+            "url": "",
+            "content": content
+        })
+    return chunks
+
+
+class FakeSearchRetriever(Retriever):
+    """
+    BM25 over an in-memory corpus with simulated search latency
+
+    Args:
+        name: Index name, used for the synthetic corpus and in document metadata
+        chunks: Corpus (dicts with id, title, filepath, url, content); synthetic when None
+        latency_ms: Base latency of every query
+        jitter_ms: Uniform random latency added to the base
+        slow_ratio: Fraction of queries that take slow_latency_ms instead
+        slow_latency_ms: Latency of a slow query
+        failure_ratio: Fraction of queries that raise an error
+        seed: Seed of the latency and failure draws
+    """
+
+    def __init__(
+        self,
+        name: str,
+        chunks: List[dict] = None,
+        latency_ms: float = 50.0,
+        jitter_ms: float = 20.0,
+        slow_ratio: float = 0.0,
+        slow_latency_ms: float = 2000.0,
+        failure_ratio: float = 0.0,
+        seed: int = 0
+    ):
+        super().__init__()
+        self.name = name
+        self.chunks = chunks if chunks is not None else synthetic_corpus(name, seed=seed)
+        self.bm25 = BM25Index([chunk.get("content", "") for chunk in self.chunks])
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.slow_ratio = slow_ratio
+        self.slow_latency_ms = slow_latency_ms
+        self.failure_ratio = failure_ratio
+        self._random = random.Random(seed)
+
+    @classmethod
+    def from_jsonl(cls, name: str, path: str, **options) -> "FakeSearchRetriever":
+        with open(path, encoding="utf-8") as f:
+            chunks = [json.loads(line) for line in f if line.strip()]
+        return cls(name, chunks, **options)
+
+    async def _retrieve(self, query: str, top_k: int) -> List[RetrievedDocument]:
+        if self._random.random() < self.slow_ratio:
+            delay_ms = self.slow_latency_ms
+        else:
+            delay_ms = self.latency_ms + self._random.uniform(0, self.jitter_ms)
+        await asyncio.sleep(delay_ms / 1000)
+        if self._random.random() < self.failure_ratio:
+            raise RuntimeError(f"Fake search index {self.name} failed")
+        documents = []
+        for row, score in self.bm25.search(query, top_k):
+            chunk = self.chunks[row]
+            documents.append(RetrievedDocument(
+                id=chunk.get("id", str(row)),
+                content=chunk.get("content", ""),
+                title=chunk.get("title", ""),
+                filepath=chunk.get("filepath", ""),
+                url=chunk.get("url", ""),
+                score=score,
+                metadata={"index": self.name}
+            ))
+        return documents
@@ -0,0 +1,233 @@
+"""
+Multi-index fan-out retriever
+
+Documents are split across several indexes (by department, by language). With
+``RETRIEVAL_MODE=fanout``, ``RagChatService`` retrieves through ``FanOutRetriever``,
+which:
+
+1. Queries every index in ``SEARCH_INDEXES`` concurrently, each with its own
+   timeout (``RETRIEVAL_INDEX_TIMEOUT_MS`` unless the index sets ``timeout_ms``)
+2. Stops waiting once ``RETRIEVAL_LATENCY_BUDGET_MS`` has passed: indexes that have
+   not answered by then are dropped from this query and their requests cancelled
+3. Merges the hits with reciprocal rank fusion, which only needs ranks, so scores
+   from different backends (BM25, Azure AI Search, vectors) never need calibrating.
+   A chunk found in several indexes is returned once
+
+Per-index latency, timeouts, errors and budget drops are kept in ``stats`` and
+exposed on ``/metrics``.
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from app.services.retrieval.base import RetrievalStats, RetrievedDocument, Retriever
+
+logger = logging.getLogger(__name__)
+
+
+def _document_key(document: RetrievedDocument) -> Tuple[str, str]:
+    return (document.filepath or document.url or document.title, document.id)
+
+
+def reciprocal_rank_fusion(
+    ranked_lists: Sequence[Tuple[str, float, List[RetrievedDocument]]],
+    k: int = 60
+) -> List[RetrievedDocument]:
+    """
+    Merge (index name, weight, documents best first) lists by reciprocal rank
+
+    A document scores ``sum(weight / (k + rank))`` over the lists it appears in
+    (rank starting at 1). The returned documents carry that score and the indexes
+    that returned them in ``metadata["indexes"]``.
+    """
+    fused: Dict[Tuple[str, str], float] = {}
+    documents: Dict[Tuple[str, str], RetrievedDocument] = {}
+    sources: Dict[Tuple[str, str], List[str]] = {}
+    for name, weight, ranked in ranked_lists:
+        for rank, document in enumerate(ranked, start=1):
+            key = _document_key(document)
+            fused[key] = fused.get(key, 0.0) + weight / (k + rank)
+            documents.setdefault(key, document)
+            sources.setdefault(key, []).append(name)
+    merged = []
+    for key, score in sorted(fused.items(), key=lambda item: item[1], reverse=True):
+        document = documents[key]
+        merged.append(RetrievedDocument(
+            id=document.id,
+            content=document.content,
+            title=document.title,
+            filepath=document.filepath,
+            url=document.url,
+            score=score,
+            metadata={**document.metadata, "indexes": sources[key]}
+        ))
+    return merged
+
+
+@dataclass
+class IndexStats:
+    """Counters of one index behind the fan-out"""
+    calls: int = 0
+    answered: int = 0
+    timeouts: int = 0
+    errors: int = 0
+    dropped: int = 0
+    total_ms: float = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "dropped": self.dropped,
+            "avg_ms": round(self.total_ms / self.answered, 3) if self.answered else 0.0
+        }
+
+
+@dataclass
+class FanOutStats(RetrievalStats):
+    """Retrieval latency plus per-index counters"""
+    indexes: Dict[str, IndexStats] = field(default_factory=dict)
+    partial: int = 0  # queries answered without every index
+
+    def as_dict(self) -> dict:
+        return {
+            **super().as_dict(),
+            "partial": self.partial,
+            "indexes": {name: stats.as_dict() for name, stats in self.indexes.items()}
+        }
+
+
+@dataclass
+class FanOutIndex:
+    """A retriever behind the fan-out and how it is queried"""
+    name: str
+    retriever: Retriever
+    timeout_ms: float = 1500.0
+    weight: float = 1.0
+
+
+class FanOutRetriever(Retriever):
+    """
+    Concurrent retrieval over several indexes merged with reciprocal rank fusion
+
+    Args:
+        indexes: Indexes to query
+        latency_budget_ms: Time after which unanswered indexes are dropped (0 = wait for all)
+        candidates: Documents asked from every index before fusion
+        rrf_k: Rank constant of reciprocal rank fusion
+    """
+
+    def __init__(
+        self,
+        indexes: List[FanOutIndex],
+        latency_budget_ms: float = 2000.0,
+        candidates: int = 10,
+        rrf_k: int = 60
+    ):
+        super().__init__()
+        self.indexes = indexes
+        self.latency_budget_ms = latency_budget_ms
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+        self.stats = FanOutStats(indexes={index.name: IndexStats() for index in indexes})
+
+    async def _query(self, index: FanOutIndex, query: str, top_k: int) -> List[RetrievedDocument]:
+        """Results of one index; empty on timeout or error"""
+        stats = self.stats.indexes[index.name]
+        stats.calls += 1
+        started = time.perf_counter()
+        try:
+            documents = await asyncio.wait_for(index.retriever.retrieve(query, top_k), index.timeout_ms / 1000)
+        except asyncio.TimeoutError:
+            stats.timeouts += 1
+            logger.warning(f"Index {index.name} timed out after {index.timeout_ms:.0f} ms")
+            return []
+        except Exception as e:
+            stats.errors += 1
+            logger.warning(f"Index {index.name} failed: {e}")
+            return []
+        stats.answered += 1
+        stats.total_ms += (time.perf_counter() - started) * 1000
+        return documents
+
+    async def _retrieve(self, query: str, top_k: int) -> List[RetrievedDocument]:
+        candidates = max(self.candidates, top_k)
+        tasks = {
+            asyncio.ensure_future(self._query(index, query, candidates)): index
+            for index in self.indexes
+        }
+        budget = self.latency_budget_ms / 1000 if self.latency_budget_ms > 0 else None
+        done, pending = await asyncio.wait(tasks, timeout=budget)
+        for task in pending:
+            # Past the budget: answer with what arrived instead of waiting
+            task.cancel()
+            self.stats.indexes[tasks[task].name].dropped += 1
+        if pending:
+            self.stats.partial += 1
+            logger.info(
+                f"Dropped {len(pending)} slow indexes past the {self.latency_budget_ms:.0f} ms budget: "
+                f"{', '.join(tasks[task].name for task in pending)}"
+            )
+        # In configuration order, so ties in the fused scores break the same way every time
+        ranked = [(index.name, index.weight, task.result()) for task, index in tasks.items() if task in done]
+        return reciprocal_rank_fusion(ranked, self.rrf_k)[:top_k]
+
+    async def close(self) -> Optional[None]:
+        for index in self.indexes:
+            await index.retriever.close()
+        return None
+
+
+def _build_index_retriever(index, app_settings, registry) -> Retriever:
+    """Retriever for one SearchIndexSettings entry"""
+    if index.backend == "fake":
+        from app.services.retrieval.fake import FakeSearchRetriever
+        options = dict(index.options)
+        if "seed" in options:
+            options["seed"] = int(options["seed"])
+        if index.path:
+            return FakeSearchRetriever.from_jsonl(index.name, index.path, **options)
+        return FakeSearchRetriever(index.name, **options)
+    if index.backend == "local":
+        from app.services.retrieval.local import LocalIndex, LocalRetriever
+        return LocalRetriever(
+            LocalIndex.load(index.path),
+            registry.get_embedder(),
+            alpha=app_settings.retrieval_hybrid_alpha
+        )
+    if index.backend == "azure_search":
+        from app.services.retrieval.azure_search import AzureSearchRetriever
+        return AzureSearchRetriever(
+            registry.get_http_client(),
+            app_settings.azure_search_service_url,
+            index.index_name or index.name,
+            api_key=app_settings.azure_search_api_key,
+            token_provider=None if app_settings.azure_search_api_key else registry.get_search_token_provider(),
+            fields=index.fields,
+            query_type=index.query_type,
+            semantic_configuration=index.semantic_configuration
+        )
+    raise ValueError(f"Unknown search index backend '{index.backend}' for index {index.name}")
+
+
+def build_fanout_retriever(app_settings, registry) -> FanOutRetriever:
+    """Create the fan-out retriever over SEARCH_INDEXES; registry provides the shared clients"""
+    indexes = [
+        FanOutIndex(
+            name=index.name,
+            retriever=_build_index_retriever(index, app_settings, registry),
+            timeout_ms=index.timeout_ms or app_settings.retrieval_index_timeout_ms,
+            weight=index.weight
+        )
+        for index in app_settings.search_index_list
+    ]
+    logger.info(f"Fan-out retrieval over {len(indexes)} indexes: {', '.join(index.name for index in indexes)}")
+    return FanOutRetriever(
+        indexes,
+        latency_budget_ms=app_settings.retrieval_latency_budget_ms,
+        candidates=app_settings.retrieval_fanout_candidates,
+        rrf_k=app_settings.retrieval_rrf_k
+    )
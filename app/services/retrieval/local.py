@@ -0,0 +1,160 @@
+"""
+Local hybrid retriever
+
+Runs retrieval in-process over an index directory instead of through Azure AI
+Search. The directory layout is:
+
+- ``chunks.jsonl``: one JSON object per chunk (id, title, filepath, url, content, ...)
+- ``embeddings.npy``: float32 matrix with one normalized embedding per chunk row
+- ``manifest.json``: embedder name, dimensions and chunk count
+
+Queries are answered with a hybrid of vector similarity (cosine top-k over the
+memory-mapped matrix) and BM25 keyword scores, fused with a weighted sum of
+min-max normalized scores.
+"""
+import asyncio
+import json
+import logging
+import os
+from typing import Dict, List, Sequence, Tuple
+
+from app.services.embeddings import Embedder
+from app.services.retrieval.base import RetrievedDocument, Retriever
+from app.services.retrieval.bm25 import BM25Index
+from app.services.retrieval.vector_index import VectorIndex
+
+logger = logging.getLogger(__name__)
+
+CHUNKS_FILE = "chunks.jsonl"
+EMBEDDINGS_FILE = "embeddings.npy"
+MANIFEST_FILE = "manifest.json"
+
+
+class LocalIndex:
+    """Chunks, embeddings and keyword index loaded from an index directory"""
+
+    def __init__(self, path: str, chunks: List[dict], vectors: VectorIndex, manifest: dict):
+        self.path = path
+        self.chunks = chunks
+        self.vectors = vectors
+        self.manifest = manifest
+        self.bm25 = BM25Index([chunk.get("content", "") for chunk in chunks])
+
+    @classmethod
+    def load(cls, path: str) -> "LocalIndex":
+        """Load an index directory; a missing directory yields an empty index"""
+        chunks = []
+        chunks_path = os.path.join(path, CHUNKS_FILE)
+        if os.path.exists(chunks_path):
+            with open(chunks_path, encoding="utf-8") as f:
+                chunks = [json.loads(line) for line in f if line.strip()]
+        manifest = {}
+        manifest_path = os.path.join(path, MANIFEST_FILE)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+        vectors = VectorIndex.load(os.path.join(path, EMBEDDINGS_FILE))
+        if len(vectors) not in (0, len(chunks)):
+            raise ValueError(
+                f"Index at {path} is inconsistent: {len(chunks)} chunks but {len(vectors)} embeddings"
+            )
+        logger.info(f"Loaded local index from {path} ({len(chunks)} chunks)")
+        return cls(path, chunks, vectors, manifest)
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def document(self, row: int, score: float) -> RetrievedDocument:
+        chunk = self.chunks[row]
+        return RetrievedDocument(
+            id=chunk.get("id", str(row)),
+            content=chunk.get("content", ""),
+            title=chunk.get("title", ""),
+            filepath=chunk.get("filepath", ""),
+            url=chunk.get("url", ""),
+            score=score
+        )
+
+
+def _min_max(hits: Sequence[Tuple[int, float]]) -> Dict[int, float]:
+    if not hits:
+        return {}
+    scores = [score for _, score in hits]
+    low, high = min(scores), max(scores)
+    if high == low:
+        return {row: 1.0 for row, _ in hits}
+    return {row: (score - low) / (high - low) for row, score in hits}
+
+
+def hybrid_fuse(
+    vector_hits: Sequence[Tuple[int, float]],
+    keyword_hits: Sequence[Tuple[int, float]],
+    alpha: float = 0.5
+) -> List[Tuple[int, float]]:
+    """
+    Weighted fusion of vector and keyword results
+
+    Both lists are min-max normalized to [0, 1]; alpha is the weight of the vector
+    score (1.0 = vector only, 0.0 = keyword only).
+    """
+    vector_scores = _min_max(vector_hits)
+    keyword_scores = _min_max(keyword_hits)
+    fused = {
+        row: alpha * vector_scores.get(row, 0.0) + (1 - alpha) * keyword_scores.get(row, 0.0)
+        for row in set(vector_scores) | set(keyword_scores)
+    }
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+class LocalRetriever(Retriever):
+    """
+    Hybrid vector + BM25 retriever over a LocalIndex
+
+    Args:
+        index: Loaded local index
+        embedder: Embedder used for queries; must match the one used at ingestion
+        alpha: Weight of vector scores in the hybrid fusion
+        candidates: Results taken from each of the vector and keyword searches before fusion
+    """
+
+    def __init__(self, index: LocalIndex, embedder: Embedder, alpha: float = 0.5, candidates: int = 50):
+        super().__init__()
+        self.index = index
+        self.embedder = embedder
+        self.alpha = alpha
+        self.candidates = candidates
+        indexed_with = index.manifest.get("embedder")
+        if indexed_with and embedder.name and indexed_with != embedder.name:
+            logger.warning(f"Index was built with embedder '{indexed_with}' but queries use '{embedder.name}'")
+
+    async def _retrieve(self, query: str, top_k: int) -> List[RetrievedDocument]:
+        return (await self.retrieve_many([query], top_k))[0]
+
+    def _keyword_search(self, queries: List[str]) -> list:
+        return [self.index.bm25.search(query, self.candidates) for query in queries]
+
+    async def retrieve_many(self, queries: List[str], top_k: int = 5) -> List[List[RetrievedDocument]]:
+        """Retrieve for several queries with one embedding call and one batched matrix search"""
+        if not queries:
+            return []
+        if len(self.index) == 0:
+            return [[] for _ in queries]
+
+        loop = asyncio.get_running_loop()
+        # BM25 scoring and the matrix product are CPU-bound; both run off the event loop,
+        # the keyword search while the queries are embedded
+        keyword_search = loop.run_in_executor(None, self._keyword_search, queries)
+        vector_results = [[] for _ in queries]
+        if len(self.index.vectors):
+            query_vectors = await self.embedder.embed(queries)
+            vector_results = await loop.run_in_executor(
+                None, self.index.vectors.search, query_vectors, self.candidates
+            )
+        keyword_results = await keyword_search
+
+        results = []
+        for vector_hits, keyword_hits in zip(vector_results, keyword_results):
+            fused = hybrid_fuse(vector_hits, keyword_hits, self.alpha)[:top_k]
+            # A zero fused score means the chunk was the weakest candidate in both searches
+            results.append([self.index.document(row, score) for row, score in fused if score > 0])
+        return results
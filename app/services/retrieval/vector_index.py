@@ -0,0 +1,107 @@
+"""
+Memory-mapped embedding matrix with batched cosine top-k search
+
+Vectors are stored L2-normalized as a float32 ``.npy`` file and opened with
+``mmap_mode="r"``, so large indexes are paged in by the OS on demand instead of
+being loaded into every worker's heap. Cosine similarity is then a plain matrix
+product, computed block by block to keep temporary arrays small.
+"""
+import os
+from typing import List, Tuple
+
+import numpy as np
+
+# Rows scored per matrix product; bounds the size of the temporary score array
+BLOCK_ROWS = 65536
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """Return a float32 copy with every row scaled to unit length"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class VectorIndex:
+    """Cosine similarity search over a (possibly memory-mapped) matrix of unit vectors"""
+
+    def __init__(self, matrix: np.ndarray):
+        self.matrix = matrix
+
+    @classmethod
+    def load(cls, path: str) -> "VectorIndex":
+        """Open a saved matrix without reading it into memory"""
+        if not os.path.exists(path):
+            return cls(np.zeros((0, 0), dtype=np.float32))
+        return cls(np.load(path, mmap_mode="r"))
+
+    @staticmethod
+    def save(path: str, vectors: np.ndarray):
+        """Normalize and write vectors; written to a temp file first so readers never see a partial file"""
+        tmp_path = f"{path}.tmp.npy"
+        np.save(tmp_path, normalize_rows(vectors) if len(vectors) else np.zeros((0, 0), dtype=np.float32))
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def save_rows(path: str, rows_path: str, dimensions: int):
+        """Like save, for raw float32 rows in a file; copied block by block so they are never all in memory"""
+        rows = os.path.getsize(rows_path) // (4 * dimensions) if dimensions else 0
+        tmp_path = f"{path}.tmp.npy"
+        if rows == 0:
+            np.save(tmp_path, np.zeros((0, 0), dtype=np.float32))
+        else:
+            source = np.memmap(rows_path, dtype=np.float32, mode="r", shape=(rows, dimensions))
+            target = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(rows, dimensions))
+            for start in range(0, rows, BLOCK_ROWS):
+                target[start:start + BLOCK_ROWS] = normalize_rows(source[start:start + BLOCK_ROWS])
+            target.flush()
+            del source, target
+        os.replace(tmp_path, path)
+
+    def __len__(self) -> int:
+        return self.matrix.shape[0]
+
+    @property
+    def dimensions(self) -> int:
+        return self.matrix.shape[1] if self.matrix.ndim == 2 else 0
+
+    def search(self, queries, top_k: int = 10) -> List[List[Tuple[int, float]]]:
+        """
+        Return the top_k (row, cosine score) pairs for every query vector
+
+        Args:
+            queries: One vector or a batch of vectors (n_queries x dimensions)
+            top_k: Number of results per query
+        """
+        queries = normalize_rows(queries)
+        n_queries = queries.shape[0]
+        rows = len(self)
+        if rows == 0 or top_k <= 0:
+            return [[] for _ in range(n_queries)]
+        k = min(top_k, rows)
+
+        best_scores = np.full((n_queries, 0), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((n_queries, 0), dtype=np.int64)
+        for start in range(0, rows, BLOCK_ROWS):
+            block = np.asarray(self.matrix[start:start + BLOCK_ROWS])
+            scores = queries @ block.T  # n_queries x block_rows
+            block_k = min(k, scores.shape[1])
+            candidates = np.argpartition(-scores, block_k - 1, axis=1)[:, :block_k]
+            candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+            best_scores = np.concatenate([best_scores, candidate_scores], axis=1)
+            best_rows = np.concatenate([best_rows, candidates + start], axis=1)
+            if best_scores.shape[1] > k:
+                keep = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+                best_rows = np.take_along_axis(best_rows, keep, axis=1)
+
+        order = np.argsort(-best_scores, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        return [
+            [(int(row), float(score)) for row, score in zip(best_rows[i], best_scores[i])]
+            for i in range(n_queries)
+        ]
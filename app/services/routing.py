@@ -0,0 +1,249 @@
+"""
+Query routing in front of the RAG pipeline
+
+Greetings, thanks and other small talk do not need Azure AI Search, nor the main
+chat deployment. ``QueryRouter`` classifies every message locally before any
+upstream call and picks one of three routes:
+
+1. ``canned``: greetings, thanks, farewells, acknowledgements and "what can you do",
+   answered with a fixed reply and no upstream call
+2. ``chat``: other small talk, answered by ``ROUTING_CHAT_DEPLOYMENT`` without retrieval
+3. ``rag``: everything else, the full "On Your Data" (or local retrieval) request on
+   ``ROUTING_RAG_DEPLOYMENT``
+
+Classification uses rules first: whole messages made of known phrases or equal to a
+small-talk example, and question markers. With ``ROUTING_USE_EMBEDDINGS`` it then
+compares the message with the example phrases of each intent by cosine similarity
+of their embeddings. Local hashed vectors are not used for that tier: they score
+"como estas vpn" as small talk. Anything the router is unsure about goes to ``rag``. Decisions per route and the
+estimated latency saved are kept in ``stats``, exposed on ``/metrics``.
+"""
+import logging
+import math
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from app.services.answer_cache import normalize_question
+
+logger = logging.getLogger(__name__)
+
+ROUTE_CANNED = "canned"
+ROUTE_CHAT = "chat"
+ROUTE_RAG = "rag"
+ROUTES = (ROUTE_CANNED, ROUTE_CHAT, ROUTE_RAG)
+
+# Normalized phrases (see normalize_question) that make up a whole message of each intent
+INTENT_PHRASES = {
+    "greeting": (
+        "hola", "buenas", "buenos dias", "buen dia", "buenas tardes", "buenas noches", "saludos",
+        "hey", "hi", "hello", "good morning", "good afternoon", "que tal", "hola que tal"
+    ),
+    "thanks": (
+        "gracias", "muchas gracias", "mil gracias", "muy amable", "te lo agradezco",
+        "thanks", "thank you", "thx", "genial gracias", "perfecto gracias", "ok gracias"
+    ),
+    "farewell": (
+        "adios", "chao", "chau", "hasta luego", "hasta manana", "nos vemos", "bye", "goodbye", "see you"
+    ),
+    "ack": (
+        "ok", "okay", "vale", "perfecto", "genial", "entendido", "de acuerdo", "listo", "claro",
+        "bien", "excelente", "super", "great", "got it", "cool"
+    ),
+    "help": (
+        "ayuda", "help", "que puedes hacer", "que sabes hacer", "como me puedes ayudar",
+        "en que me puedes ayudar", "quien eres", "que eres", "what can you do", "who are you"
+    )
+}
+
+# Example phrases of small talk answered without retrieval
+SMALL_TALK_EXAMPLES = (
+    "como estas", "como te va", "que tal estas", "como va todo", "que haces",
+    "cuentame un chiste", "estas ahi", "eres un bot", "eres una persona", "me caes bien",
+    "how are you", "tell me a joke", "are you there", "are you a bot"
+)
+
+CANNED_REPLIES = {
+    "greeting": "¡Hola! ¿En qué puedo ayudarte? Puedes preguntarme sobre la documentación.",
+    "thanks": "¡De nada! Si tienes otra pregunta, aquí estoy.",
+    "farewell": "¡Hasta luego! Escríbeme cuando necesites algo.",
+    "ack": "Perfecto. ¿Hay algo más en lo que pueda ayudarte?",
+    "help": (
+        "Soy un asistente que responde preguntas a partir de la documentación de tu "
+        "organización y cita las fuentes. Escríbeme tu pregunta."
+    )
+}
+
+# Words that make a message a real question even if it also contains a greeting
+_QUESTION_WORDS = {
+    "como", "que", "cual", "cuales", "donde", "cuando", "cuanto", "cuantos", "por", "quien",
+    "puedo", "necesito", "explica", "dime", "busca", "how", "what", "which", "where", "when",
+    "why", "who", "can", "explain", "find"
+}
+
+_PHRASE_INTENTS = {phrase: intent for intent, phrases in INTENT_PHRASES.items() for phrase in phrases}
+_SMALL_TALK = set(SMALL_TALK_EXAMPLES)
+
+
+def _unit(vector: List[float]) -> List[float]:
+    norm = math.sqrt(sum(v * v for v in vector))
+    return [v / norm for v in vector] if norm else list(vector)
+
+
+@dataclass
+class RouteDecision:
+    """Route chosen for one message and why"""
+    route: str
+    reason: str  # rule | similarity | default
+    intent: Optional[str] = None
+    score: float = 0.0
+
+    @property
+    def canned_reply(self) -> Optional[str]:
+        return CANNED_REPLIES.get(self.intent) if self.route == ROUTE_CANNED else None
+
+
+class RoutingStats:
+    """Decisions per route and the latency saved compared with the RAG route"""
+
+    def __init__(self):
+        self.decisions = {route: 0 for route in ROUTES}
+        self.reasons: Dict[str, int] = {}
+        self.classify_ms = 0.0
+        self.route_ms = {route: 0.0 for route in ROUTES}
+        self.timed = {route: 0 for route in ROUTES}
+        self.latency_saved_ms = 0.0
+
+    def record_decision(self, decision: RouteDecision, classify_ms: float):
+        self.decisions[decision.route] += 1
+        self.reasons[decision.reason] = self.reasons.get(decision.reason, 0) + 1
+        self.classify_ms += classify_ms
+
+    def record_latency(self, route: str, elapsed_ms: float):
+        """Latency of an answered message; non-RAG routes are credited against the RAG average"""
+        self.route_ms[route] += elapsed_ms
+        self.timed[route] += 1
+        if route != ROUTE_RAG and self.timed[ROUTE_RAG]:
+            rag_average = self.route_ms[ROUTE_RAG] / self.timed[ROUTE_RAG]
+            self.latency_saved_ms += max(rag_average - elapsed_ms, 0.0)
+
+    def as_dict(self) -> dict:
+        classified = sum(self.decisions.values())
+        return {
+            "decisions": dict(self.decisions),
+            "reasons": dict(self.reasons),
+            "avg_classify_ms": round(self.classify_ms / classified, 3) if classified else 0.0,
+            "avg_latency_ms": {
+                route: round(self.route_ms[route] / self.timed[route], 1) if self.timed[route] else 0.0
+                for route in ROUTES
+            },
+            "latency_saved_ms": round(self.latency_saved_ms, 1)
+        }
+
+
+class QueryRouter:
+    """
+    Local classifier that picks the route of a message
+
+    Args:
+        similarity_threshold: Minimum cosine similarity with an example phrase
+        max_small_talk_words: Longer messages always go to the RAG route
+        canned_replies: When False, canned intents are answered on the chat route instead
+        embed: Optional async function returning an embedding vector for a text;
+            without it only the rules classify and everything else goes to rag
+    """
+
+    def __init__(
+        self,
+        similarity_threshold: float = 0.75,
+        max_small_talk_words: int = 8,
+        canned_replies: bool = True,
+        embed: Optional[Callable[[str], Awaitable[List[float]]]] = None
+    ):
+        self.similarity_threshold = similarity_threshold
+        self.max_small_talk_words = max_small_talk_words
+        self.canned_replies = canned_replies
+        self.embed = embed
+        self.stats = RoutingStats()
+        self._examples = None  # [(intent or None for chat, vector)], built on first use
+
+    async def _vector(self, text: str) -> List[float]:
+        return _unit(list(await self.embed(text)))
+
+    async def _example_vectors(self):
+        if self._examples is None:
+            examples = [(intent, phrase) for phrase, intent in _PHRASE_INTENTS.items()]
+            examples.extend((None, phrase) for phrase in SMALL_TALK_EXAMPLES)
+            self._examples = [(intent, await self._vector(phrase)) for intent, phrase in examples]
+        return self._examples
+
+    def _decide(self, intent: Optional[str], reason: str, score: float = 1.0) -> RouteDecision:
+        if intent is not None and self.canned_replies:
+            return RouteDecision(ROUTE_CANNED, reason, intent, score)
+        return RouteDecision(ROUTE_CHAT, reason, intent, score)
+
+    def _rule_intent(self, words: List[str]) -> Optional[str]:
+        """Intent of a message made only of known phrases ("hola, buenos dias", "ok gracias, adios")"""
+        intents = []
+        position = 0
+        while position < len(words):
+            # Longest phrase first ("muchas gracias" before "gracias")
+            for length in range(min(4, len(words) - position), 0, -1):
+                intent = _PHRASE_INTENTS.get(" ".join(words[position:position + length]))
+                if intent is not None:
+                    intents.append(intent)
+                    position += length
+                    break
+            else:
+                return None
+        # The last intent is the one to answer ("hola, gracias" -> thanks)
+        return intents[-1] if intents else None
+
+    async def _classify(self, message: Optional[str]) -> RouteDecision:
+        normalized = normalize_question(message or "")
+        if not normalized:
+            return RouteDecision(ROUTE_RAG, "default")
+        words = normalized.split()
+        if len(words) > self.max_small_talk_words:
+            return RouteDecision(ROUTE_RAG, "rule")
+
+        intent = self._rule_intent(words)
+        if intent is not None:
+            return self._decide(intent, "rule")
+        if normalized in _SMALL_TALK:
+            return RouteDecision(ROUTE_CHAT, "rule", None, 1.0)
+        if "?" in message and any(word in _QUESTION_WORDS for word in words) and len(words) > 3:
+            return RouteDecision(ROUTE_RAG, "rule")
+        if self.embed is None:
+            return RouteDecision(ROUTE_RAG, "default")
+
+        vector = await self._vector(normalized)
+        best_intent, best_score = None, 0.0
+        for intent, example in await self._example_vectors():
+            score = sum(x * y for x, y in zip(vector, example))
+            if score > best_score:
+                best_intent, best_score = intent, score
+        if best_score >= self.similarity_threshold:
+            if best_intent is None:
+                return RouteDecision(ROUTE_CHAT, "similarity", None, best_score)
+            return self._decide(best_intent, "similarity", best_score)
+        return RouteDecision(ROUTE_RAG, "default", best_intent, best_score)
+
+    async def route(self, message: Optional[str]) -> RouteDecision:
+        """Classify a message and record the decision"""
+        started = time.perf_counter()
+        decision = await self._classify(message)
+        self.stats.record_decision(decision, (time.perf_counter() - started) * 1000)
+        return decision
+
+
+def build_query_router(app_settings, embed=None) -> Optional[QueryRouter]:
+    """Create the router configured in AppSettings, or None when routing is disabled"""
+    if not app_settings.routing_enabled:
+        return None
+    return QueryRouter(
+        similarity_threshold=app_settings.routing_similarity_threshold,
+        max_small_talk_words=app_settings.routing_max_small_talk_words,
+        canned_replies=app_settings.routing_canned_replies,
+        embed=embed
+    )
@@ -0,0 +1,420 @@
+"""
+Durable bot state storage for ConversationState
+
+``MemoryStorage`` loses the bot state on restart and is private to one replica. This
+module provides botbuilder ``Storage`` implementations that do neither, without a
+storage round trip on every turn:
+
+1. ``SQLiteStorage`` keeps every state item as a JSON document (``jsonpickle``, as the
+   botbuilder Azure storages do) in a local SQLite file shared by the workers of a
+   host. It is also a convenient durable store for tests. Queries and commits run
+   on a dedicated thread, never on the event loop
+2. ``CachedStorage`` wraps a durable storage with a read-through LRU cache and
+   write-behind batching: writes land in the cache and are flushed together every
+   ``STATE_FLUSH_INTERVAL_SECONDS`` (or once ``STATE_FLUSH_BATCH`` items are dirty)
+3. Both use optimistic concurrency with etags. A write carrying an etag that is not
+   the current one raises ``KeyError``, like ``MemoryStorage``. A flush only
+   replaces an item whose etag is still the one the cache read, so a write based on
+   a stale read on another replica is counted as a conflict and dropped, and the
+   item is read again on next use
+"""
+import asyncio
+import copy
+import logging
+import sqlite3
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import jsonpickle
+from botbuilder.core import Storage, StoreItem
+
+logger = logging.getLogger(__name__)
+
+
+def _get_etag(item) -> Optional[str]:
+    if isinstance(item, dict):
+        return item.get("e_tag")
+    return getattr(item, "e_tag", None)
+
+
+def _set_etag(item, etag: str):
+    if isinstance(item, dict):
+        item["e_tag"] = etag
+    else:
+        item.e_tag = etag
+
+
+def _new_etag() -> str:
+    return uuid.uuid4().hex
+
+
+def _check_etag(key: str, new_etag: Optional[str], current_etag: Optional[str]):
+    """Raise KeyError when a write does not carry the current etag ("*" or none skip the check)"""
+    if new_etag == "":
+        raise KeyError(f"Etag missing for {key}")
+    if current_etag is not None and new_etag not in (None, "*") and new_etag != current_etag:
+        raise KeyError(f"Etag conflict for {key}.\nOriginal: {new_etag}\r\nCurrent: {current_etag}")
+
+
+class SQLiteStorage(Storage):
+    """
+    Botbuilder storage in a SQLite table; items survive restarts and are shared by local workers
+
+    Every query and commit runs on one dedicated thread, which also serializes access
+    to the connection, so a turn saving its state never blocks the event loop.
+    """
+
+    def __init__(self, path: str):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="state-storage")
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS bot_state (
+                key TEXT PRIMARY KEY,
+                etag TEXT NOT NULL,
+                data TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+        self._closed = False
+        self._stored = self._count()
+        self.reads = 0
+        self.writes = 0
+
+    async def _run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    def _count(self) -> int:
+        # Refreshed on the storage thread after every change, so stats() never touches the connection
+        return self._conn.execute("SELECT COUNT(*) FROM bot_state").fetchone()[0]
+
+    def _read(self, keys: List[str]) -> Dict[str, object]:
+        placeholders = ",".join("?" * len(keys))
+        rows = self._conn.execute(
+            f"SELECT key, etag, data FROM bot_state WHERE key IN ({placeholders})", keys
+        ).fetchall()
+        items = {}
+        for key, etag, data in rows:
+            item = jsonpickle.decode(data)
+            _set_etag(item, etag)
+            items[key] = item
+        return items
+
+    async def read(self, keys: List[str]) -> Dict[str, object]:
+        if not keys:
+            return {}
+        self.reads += 1
+        return await self._run(self._read, list(keys))
+
+    def current_etags(self, keys: List[str]) -> Dict[str, str]:
+        placeholders = ",".join("?" * len(keys))
+        return dict(self._conn.execute(
+            f"SELECT key, etag FROM bot_state WHERE key IN ({placeholders})", list(keys)
+        ).fetchall())
+
+    def _write(self, changes: Dict[str, StoreItem]):
+        current = self.current_etags(list(changes))
+        for key, item in changes.items():
+            _check_etag(key, _get_etag(item), current.get(key))
+        batch = [(key, item, current.get(key), _new_etag()) for key, item in changes.items()]
+        conflicts = self._write_batch(batch)
+        if conflicts:
+            # Another worker wrote between the check and the write
+            raise KeyError(f"Etag conflict for {', '.join(conflicts)}")
+        for key, item, _, etag in batch:
+            _set_etag(item, etag)
+
+    async def write(self, changes: Dict[str, StoreItem]):
+        if changes is None:
+            raise Exception("Changes are required when writing")
+        if not changes:
+            return
+        await self._run(self._write, changes)
+
+    def _write_batch(self, batch: List[Tuple[str, object, Optional[str], str]]) -> List[str]:
+        conflicts = []
+        now = time.time()
+        with self._conn:
+            for key, item, expected, etag in batch:
+                stored = copy.copy(item)
+                if isinstance(stored, dict):
+                    stored.pop("e_tag", None)
+                data = jsonpickle.encode(stored)
+                if expected is None:
+                    cursor = self._conn.execute(
+                        "INSERT OR IGNORE INTO bot_state VALUES (?, ?, ?, ?)", (key, etag, data, now)
+                    )
+                else:
+                    cursor = self._conn.execute(
+                        "UPDATE bot_state SET etag = ?, data = ?, updated_at = ? WHERE key = ? AND etag = ?",
+                        (etag, data, now, key, expected)
+                    )
+                if cursor.rowcount != 1:
+                    conflicts.append(key)
+        self.writes += len(batch) - len(conflicts)
+        self._stored = self._count()
+        return conflicts
+
+    async def write_batch(self, batch: List[Tuple[str, object, Optional[str], str]]) -> List[str]:
+        """
+        Write (key, item, expected etag, new etag) tuples in one transaction
+
+        An item is only replaced if its stored etag is still the expected one (None =
+        the key must not exist yet). Returns the keys that were not written.
+        """
+        return await self._run(self._write_batch, batch)
+
+    def _delete(self, keys: List[str]):
+        with self._conn:
+            self._conn.executemany("DELETE FROM bot_state WHERE key = ?", [(key,) for key in keys])
+        self._stored = self._count()
+
+    async def delete(self, keys: List[str]):
+        if not keys:
+            return
+        await self._run(self._delete, list(keys))
+
+    def _close(self):
+        self._conn.close()
+
+    async def close(self, *args):
+        """Close the connection on the storage thread, after any pending write (aiohttp cleanup hook)"""
+        if self._closed:
+            return
+        self._closed = True
+        await self._run(self._close)
+        self._executor.shutdown(wait=False)
+
+    def stats(self) -> dict:
+        return {"backend": "sqlite", "items": self._stored, "reads": self.reads, "writes": self.writes}
+
+
+class _CachedItem:
+    """Cached state item and the etag the durable storage holds for it"""
+    __slots__ = ("item", "etag", "stored_etag", "dirty", "loaded_at")
+
+    def __init__(self, item, etag: Optional[str], stored_etag: Optional[str], dirty: bool = False):
+        self.item = item
+        self.etag = etag
+        self.stored_etag = stored_etag
+        self.dirty = dirty
+        self.loaded_at = time.monotonic()
+
+
+class CachedStorage(Storage):
+    """
+    Read-through, write-behind cache in front of a SQLiteStorage
+
+    Args:
+        backend: Durable storage with ``write_batch`` (SQLiteStorage)
+        max_entries: Clean items kept in the cache (LRU); dirty items stay until flushed
+        ttl_seconds: Clean items older than this are read again, so writes from other
+            replicas become visible (0 = never)
+        flush_interval: Seconds between two flushes of the dirty items
+        flush_batch: Dirty items that trigger a flush before the interval
+    """
+
+    def __init__(
+        self,
+        backend: SQLiteStorage,
+        max_entries: int = 10000,
+        ttl_seconds: float = 60,
+        flush_interval: float = 1.0,
+        flush_batch: int = 200
+    ):
+        self.backend = backend
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self._items: "OrderedDict[str, _CachedItem]" = OrderedDict()
+        self._dirty = set()
+        self._flusher: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._flush_lock = asyncio.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.flushes = 0
+        self.flushed_items = 0
+        self.conflicts = 0
+
+    def _fresh(self, cached: _CachedItem) -> bool:
+        return cached.dirty or self.ttl_seconds <= 0 or time.monotonic() - cached.loaded_at < self.ttl_seconds
+
+    async def read(self, keys: List[str]) -> Dict[str, object]:
+        if not keys:
+            return {}
+        items = {}
+        missing = []
+        for key in keys:
+            cached = self._items.get(key)
+            if cached is not None and self._fresh(cached):
+                self.hits += 1
+                self._items.move_to_end(key)
+                if cached.item is not None:
+                    items[key] = copy.deepcopy(cached.item)
+            else:
+                missing.append(key)
+        if missing:
+            self.misses += len(missing)
+            loaded = await self.backend.read(missing)
+            for key in missing:
+                item = loaded.get(key)
+                etag = _get_etag(item) if item is not None else None
+                # Absent keys are cached too, so a new conversation costs one read
+                self._items[key] = _CachedItem(item, etag, etag)
+                if item is not None:
+                    items[key] = copy.deepcopy(item)
+            self._evict()
+        return items
+
+    async def write(self, changes: Dict[str, StoreItem]):
+        if changes is None:
+            raise Exception("Changes are required when writing")
+        if not changes:
+            return
+        missing = [key for key in changes if key not in self._items]
+        if missing:
+            await self.read(missing)
+        for key, change in changes.items():
+            cached = self._items[key]
+            _check_etag(key, _get_etag(change), cached.etag)
+        for key, change in changes.items():
+            cached = self._items[key]
+            etag = _new_etag()
+            item = copy.deepcopy(change)
+            _set_etag(item, etag)
+            # The caller keeps using its copy; give it the new etag for its next write
+            _set_etag(change, etag)
+            cached.item, cached.etag, cached.dirty = item, etag, True
+            self._items.move_to_end(key)
+            self._dirty.add(key)
+        self.writes += len(changes)
+        self._schedule_flush()
+
+    async def delete(self, keys: List[str]):
+        for key in keys:
+            self._items.pop(key, None)
+            self._dirty.discard(key)
+        await self.backend.delete(keys)
+
+    def _schedule_flush(self):
+        if self._flusher is None or self._flusher.done():
+            self._wake = asyncio.Event()
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_loop())
+        if len(self._dirty) >= self.flush_batch:
+            self._wake.set()
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"State flush failed, retrying on the next interval: {e}")
+
+    async def flush(self) -> int:
+        """Write the dirty items to the durable storage; returns how many were written"""
+        async with self._flush_lock:
+            if not self._dirty:
+                return 0
+            batch = []
+            for key in list(self._dirty):
+                cached = self._items[key]
+                batch.append((key, cached.item, cached.stored_etag, cached.etag))
+            self._dirty.clear()
+            for key, *_ in batch:
+                self._items[key].dirty = False
+            try:
+                conflicts = set(await self.backend.write_batch(batch))
+            except Exception:
+                # Keep the items dirty so the next flush retries them
+                for key, *_ in batch:
+                    if key in self._items:
+                        self._items[key].dirty = True
+                        self._dirty.add(key)
+                raise
+            for key, _, _, etag in batch:
+                cached = self._items.get(key)
+                if key in conflicts:
+                    # Written elsewhere since our read: drop ours and read theirs next time
+                    if cached is not None and not cached.dirty:
+                        self._items.pop(key, None)
+                elif cached is not None:
+                    cached.stored_etag = etag
+                    cached.loaded_at = time.monotonic()
+            if conflicts:
+                self.conflicts += len(conflicts)
+                logger.warning(f"Dropped {len(conflicts)} state writes with a stale etag")
+            written = len(batch) - len(conflicts)
+            self.flushes += 1
+            self.flushed_items += written
+            self._evict()
+            return written
+
+    def _evict(self):
+        """Drop the least recently used clean items over max_entries"""
+        if len(self._items) <= self.max_entries:
+            return
+        for key in list(self._items):
+            if len(self._items) <= self.max_entries:
+                break
+            if not self._items[key].dirty:
+                del self._items[key]
+
+    async def close(self, *args):
+        """Stop the flush loop, write what is still dirty and close the backend (aiohttp cleanup hook)"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        try:
+            written = await self.flush()
+        finally:
+            await self.backend.close()
+        if written:
+            logger.info(f"Flushed {written} state items on shutdown")
+
+    def stats(self) -> dict:
+        reads = self.hits + self.misses
+        return {
+            **self.backend.stats(),
+            "cached_items": len(self._items),
+            "dirty_items": len(self._dirty),
+            "cache_hit_ratio": round(self.hits / reads, 4) if reads else 0.0,
+            "buffered_writes": self.writes,
+            "flushes": self.flushes,
+            "flushed_items": self.flushed_items,
+            "conflicts": self.conflicts
+        }
+
+
+def build_state_storage(app_settings) -> Storage:
+    """Create the bot state storage configured in AppSettings"""
+    if app_settings.state_storage == "sqlite":
+        backend = SQLiteStorage(app_settings.state_sqlite_path)
+        if app_settings.state_write_behind:
+            return CachedStorage(
+                backend,
+                max_entries=app_settings.state_cache_entries,
+                ttl_seconds=app_settings.state_cache_ttl_seconds,
+                flush_interval=app_settings.state_flush_interval_seconds,
+                flush_batch=app_settings.state_flush_batch
+            )
+        return backend
+    from botbuilder.core import MemoryStorage
+    return MemoryStorage()
@@ -0,0 +1,132 @@
+"""
+Cold start measurements for the bot processes
+
+On a scale-to-zero deployment the first Teams message waits for the container to
+start, for the modules to import and for the first Azure OpenAI token. This module
+tracks those phases so they can be watched over time:
+
+1. ``startup.mark(phase)`` records when each phase first completes, measured from
+   process start (read from ``/proc`` on Linux, otherwise from this import). The
+   entry points mark ``app_ready``, ``registry.startup`` marks ``server_started`` and
+   ``prewarm_done``, and the bots mark ``first_turn``. The phases are reported
+   under ``components.startup`` on ``/metrics``
+2. ``python -m app.startup`` imports the entry points in fresh interpreters with
+   ``-X importtime`` and reports the import time per top-level package
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+from collections import OrderedDict
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODULES = ("app.bot_app", "teams_bot_official")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _process_started_at() -> float:
+    """Wall-clock time the process started; falls back to now"""
+    try:
+        with open("/proc/self/stat") as f:
+            # The command name may contain spaces; fields after it are space separated
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/stat") as f:
+            boot_time = next(int(line.split()[1]) for line in f if line.startswith("btime"))
+        return boot_time + start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, StopIteration, AttributeError):
+        return time.time()
+
+
+class StartupTimer:
+    """Time from process start to each startup phase, recorded once per phase"""
+
+    def __init__(self):
+        self.started_at = _process_started_at()
+        self.phases: "OrderedDict[str, float]" = OrderedDict()
+
+    def mark(self, phase: str) -> None:
+        """Record the first completion of phase"""
+        if phase in self.phases:
+            return
+        elapsed_ms = (time.time() - self.started_at) * 1000
+        self.phases[phase] = elapsed_ms
+        logger.info(f"Startup phase {phase} reached {elapsed_ms:.0f} ms after process start")
+
+    def report(self) -> dict:
+        return {phase: round(elapsed_ms, 1) for phase, elapsed_ms in self.phases.items()}
+
+
+startup = StartupTimer()
+
+
+def import_report(module: str, top: int = 15) -> dict:
+    """
+    Import module in a fresh interpreter and aggregate ``-X importtime`` by top-level package
+
+    Returns:
+        Dict with the total import time and the slowest top-level packages (cumulative ms)
+    """
+    started = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True
+    )
+    wall_ms = (time.perf_counter() - started) * 1000
+    if completed.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{completed.stderr[-2000:]}")
+
+    entries = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, self_us, cumulative_us, name = line.replace("import time:", "|", 1).split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((depth, name.strip(), int(cumulative_us)))
+
+    # importtime prints children before their parent; walking backwards visits parents
+    # first, so a package is charged only where it is imported from another package
+    packages = {}
+    total_us = 0
+    ancestors: List[str] = []
+    for depth, name, cumulative_us in reversed(entries):
+        del ancestors[depth:]
+        package = name.split(".")[0]
+        if depth == 0:
+            total_us += cumulative_us
+        if all(package != parent for parent in ancestors):
+            packages[package] = packages.get(package, 0) + cumulative_us
+        ancestors.append(package)
+    slowest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+    return {
+        "module": module,
+        "import_ms": round(total_us / 1000, 1),
+        "interpreter_wall_ms": round(wall_ms, 1),
+        "packages_ms": {name: round(us / 1000, 1) for name, us in slowest}
+    }
+
+
+def main(argv: List[str] = None):
+    """Print the import time report of the entry points as JSON"""
+    parser = argparse.ArgumentParser(description="Import time report of the bot entry points")
+    parser.add_argument("modules", nargs="*", default=list(DEFAULT_MODULES))
+    parser.add_argument("--top", type=int, default=15, help="Top-level packages listed per module")
+    parser.add_argument("--output", help="Also write the report to this JSON file")
+    args = parser.parse_args(argv)
+
+    report = {"python": sys.version.split()[0], "modules": [import_report(module, args.top) for module in args.modules]}
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
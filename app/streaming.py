@@ -0,0 +1,117 @@
+"""
+Entrega progresiva de respuestas RAG en Microsoft Teams
+
+Consume el generador ``RagChatService.stream_chat_completion`` y muestra la
+respuesta al usuario mientras se genera:
+
+1. Envía un indicador de escritura (typing) en cuanto llega el mensaje
+2. Publica el primer fragmento de texto como mensaje nuevo
+3. Actualiza ese mismo mensaje con el texto acumulado cada ``flush_interval`` segundos
+4. Al terminar, deja el mensaje con la respuesta completa, renderizada con sus
+   citas si se indica ``render`` (ver app.citations)
+
+Si el canal no permite actualizar mensajes (el envío no devuelve id o la
+actualización falla), no se publica más texto parcial: el resto se acumula y se envía
+una sola vez al final, sin repetir lo que el usuario ya ve. El canal se recuerda y en
+los turnos siguientes la respuesta se envía entera al terminar.
+"""
+import logging
+import time
+from typing import AsyncIterator, Callable, List, Optional
+
+from botbuilder.core import MessageFactory, TurnContext
+from botbuilder.schema import Activity, ActivityTypes
+
+logger = logging.getLogger(__name__)
+
+
+class StreamingResponder:
+    """
+    Publica en Teams una respuesta en streaming mediante actualizaciones progresivas
+    """
+
+    def __init__(self, flush_interval: float = 1.0, render: Optional[Callable[[str, List[dict]], Activity]] = None):
+        # Segundos mínimos entre dos actualizaciones del mensaje
+        self.flush_interval = flush_interval
+        # Actividad final a partir del texto y las citas; por defecto sólo el texto
+        self.render = render or (lambda message, citations: MessageFactory.text(message))
+        # Canales donde no se pueden actualizar mensajes
+        self._no_updates = set()
+
+    async def send_typing(self, turn_context: TurnContext):
+        """Envía un indicador de escritura al usuario"""
+        await turn_context.send_activity(Activity(type=ActivityTypes.typing))
+
+    async def deliver(self, turn_context: TurnContext, stream: AsyncIterator[dict]) -> dict:
+        """
+        Entrega el stream al usuario y devuelve la respuesta final
+
+        Returns:
+            Dict con "message" y "citations", igual que get_chat_completion
+        """
+        await self.send_typing(turn_context)
+
+        channel = getattr(turn_context.activity, "channel_id", None)
+        text = ""
+        message_id = None
+        updates_supported = channel not in self._no_updates
+        # El primer fragmento se publica de inmediato para reducir el tiempo al primer token
+        last_flush = float("-inf")
+        flushed_text = ""
+        final = {"message": "", "citations": []}
+
+        async for event in stream:
+            if event["type"] == "end":
+                final = {"message": event["message"], "citations": event.get("citations", [])}
+                break
+
+            text += event["content"]
+            now = time.monotonic()
+            if not updates_supported or now - last_flush < self.flush_interval:
+                continue
+
+            if message_id is None:
+                response = await turn_context.send_activity(MessageFactory.text(text))
+                message_id = getattr(response, "id", None)
+                flushed_text = text
+                if message_id is None:
+                    updates_supported = False
+            elif await self._update(turn_context, message_id, MessageFactory.text(text)):
+                flushed_text = text
+            else:
+                updates_supported = False
+            last_flush = now
+
+        final_text = final["message"] or text
+        final_activity = self.render(final_text, final["citations"])
+        changed = final_text != flushed_text or final_activity.text != final_text or bool(final_activity.attachments)
+        if message_id is not None and updates_supported:
+            if not changed or await self._update(turn_context, message_id, final_activity):
+                final["message"] = final_text
+                return final
+            updates_supported = False
+
+        if not updates_supported:
+            self._no_updates.add(channel)
+        if not flushed_text:
+            await turn_context.send_activity(final_activity)
+        elif final_text.startswith(flushed_text):
+            # El usuario ya ve el principio: sólo se envía lo que falta (con las citas)
+            rest = final_text[len(flushed_text):].strip()
+            if rest or final["citations"]:
+                await turn_context.send_activity(self.render(rest, final["citations"]))
+        else:
+            await turn_context.send_activity(final_activity)
+
+        final["message"] = final_text
+        return final
+
+    async def _update(self, turn_context: TurnContext, message_id: str, activity: Activity) -> bool:
+        """Actualiza el mensaje ya publicado; devuelve False si el canal no lo permite"""
+        activity.id = message_id
+        try:
+            await turn_context.update_activity(activity)
+            return True
+        except Exception as e:
+            logger.warning(f"Progressive update not supported, falling back to final message: {e}")
+            return False
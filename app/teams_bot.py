@@ -8,11 +8,18 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app.services.rag_chat_service import RagChatService
+from app.services.registry import registry
+from app.services.admission import ServiceBusyError
+from app.services.metrics import metrics
+from app.streaming import StreamingResponder
+from app.background import ActivityDeduplicator, BackgroundTurnProcessor
+from app.config import settings
+from app.logging_setup import MessageText, configure_logging, per_message
+from app.startup import startup
 import logging
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging (cola no bloqueante, muestreo y redacción según LOG_*)
+configure_logging(settings)
 logger = logging.getLogger(__name__)
 
 class TeamsRAGBot(ActivityHandler):
@@ -20,32 +27,89 @@ class TeamsRAGBot(ActivityHandler):
     Bot que implementa RAG para Microsoft Teams usando ActivityHandler oficial
     """
     
-    def __init__(self):
+    def __init__(self, background: BackgroundTurnProcessor = None):
         super().__init__()
-        self.rag_service = RagChatService()
+        # Citas agrupadas por documento y renderizadas en una tarjeta compacta
+        self.citations = registry.get_citation_renderer()
+        self.streaming = StreamingResponder(flush_interval=settings.stream_flush_interval, render=self.citations.render)
+        # Procesamiento en segundo plano (opcional) y descarte de reenvíos del canal
+        self.background = background
+        self.deduplicator = ActivityDeduplicator(settings.dedup_ttl_seconds, settings.dedup_max_entries)
         logger.info("TeamsRAGBot initialized successfully")
 
+    # Los clientes de Azure se crean en el primer uso (o en el pre-calentamiento del
+    # arranque), no al importar el bot
+    @property
+    def rag_service(self):
+        return registry.get_rag_chat_service()
+
+    @property
+    def conversation_store(self):
+        return registry.get_conversation_store()
+
     async def on_message_activity(self, turn_context: TurnContext):
         """
         Maneja las actividades de mensaje siguiendo el patrón oficial de Microsoft
+
+        Con procesamiento en segundo plano el turno termina en cuanto el mensaje se
+        encola y la respuesta llega después como mensaje proactivo.
+        """
+        activity = turn_context.activity
+        if self.deduplicator.is_duplicate(activity.id):
+            logger.info("Ignoring redelivered activity", extra=per_message(activity.id))
+            return
+        if self.background is not None and self.background.submit(turn_context, self.answer):
+            return
+        await self.answer(turn_context, activity)
+
+    async def answer(self, turn_context: TurnContext, activity: Activity):
+        """
+        Genera y envía la respuesta RAG a activity
+
+        turn_context puede ser el turno original o uno proactivo, por eso el mensaje se
+        lee de activity y no de turn_context.activity.
         """
         try:
-            user_message = turn_context.activity.text
-            logger.info(f"Received message: {user_message}")
+            user_message = activity.text
+            logger.info("Received message: %s", MessageText(user_message), extra=per_message(activity.id))
+            conversation_id = activity.conversation.id
+            history = await self.conversation_store.get_history(conversation_id)
+            
+            if settings.stream_responses:
+                # Mostrar la respuesta a medida que se genera
+                rag_response = await self.streaming.deliver(
+                    turn_context,
+                    self.rag_service.stream_chat_completion(
+                        user_message=user_message,
+                        conversation_history=history,
+                        conversation_id=conversation_id
+                    )
+                )
+                await self.conversation_store.append_exchange(conversation_id, user_message, rag_response["message"])
+                logger.info("Streamed response sent successfully", extra=per_message(activity.id))
+                return
             
             # Usar el servicio RAG para generar respuesta
             rag_response = await self.rag_service.get_chat_completion(
                 user_message=user_message,
-                conversation_history=[]  # Simplificado por ahora
+                conversation_history=history,
+                conversation_id=conversation_id
             )
             
-            # Enviar respuesta usando MessageFactory oficial
+            # Enviar la respuesta con sus citas (tarjeta compacta o texto, según CITATIONS_MODE)
             response_text = rag_response.get("message", "Lo siento, no pude generar una respuesta.")
-            response_activity = MessageFactory.text(response_text)
+            response_activity = self.citations.render(response_text, rag_response.get("citations"))
             
             await turn_context.send_activity(response_activity)
-            logger.info("Response sent successfully")
+            await self.conversation_store.append_exchange(conversation_id, user_message, response_text)
+            logger.info("Response sent successfully", extra=per_message(activity.id))
             
+        except ServiceBusyError as e:
+            # Respuesta rápida en lugar de esperar un timeout cuando el servicio está saturado
+            logger.warning(f"Request shed by admission control: {e}")
+            await turn_context.send_activity(MessageFactory.text(
+                "El servicio está ocupado en este momento. Por favor intenta de nuevo en unos segundos."
+            ))
         except Exception as e:
             logger.error(f"Error processing message: {str(e)}")
             logger.error(traceback.format_exc())
@@ -79,8 +143,12 @@ class TeamsRAGBot(ActivityHandler):
         Override opcional del turn handler principal para logging adicional
         """
         try:
-            logger.info(f"Processing activity type: {turn_context.activity.type}")
-            await super().on_turn(turn_context)
+            logger.info(
+                "Processing activity type: %s", turn_context.activity.type, extra=per_message(turn_context.activity.id)
+            )
+            with metrics.span("turn"):
+                await super().on_turn(turn_context)
+            startup.mark("first_turn")
         except Exception as e:
             logger.error(f"Error in on_turn: {str(e)}")
             logger.error(traceback.format_exc())
@@ -15,7 +15,6 @@ from aiohttp.web import Request, Response, json_response
 from botbuilder.core import (
     BotFrameworkAdapterSettings,
     ConversationState,
-    MemoryStorage,
     TurnContext,
     ActivityHandler,
     MessageFactory
@@ -27,38 +26,48 @@ from botbuilder.schema import Activity, ActivityTypes
 # Agregar path para importaciones
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from app.services.rag_chat_service import RagChatService
+from app.services.registry import registry
+from app.services.admission import ServiceBusyError
+from app.services.metrics import PROMETHEUS_CONTENT_TYPE, SendTimingMixin, metrics, wants_prometheus
+from app.streaming import StreamingResponder
+from app.background import ActivityDeduplicator, BackgroundTurnProcessor, build_background_processor
+from app.fast_path import build_activity_fast_path
+from app.config import settings
+from app.logging_setup import ActivitySummary, MessageText, SafeHeaders, configure_logging, per_message
+from app.startup import startup
 
 
 # OPCIÓN 1: Establecer variables de entorno directamente
-os.environ["MicrosoftAppId"] = "92bc3ead-9f2c-4d71-a58e-2015571d3410"
-os.environ["MicrosoftAppPassword"] = "QD-8Q~dQz5GzPx0UTmbeTp4GkLIRw1HSEPMYDcS4"
-
-# Configurar logging en modo DEBUG
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-    handlers=[logging.StreamHandler(sys.stdout)]
-)
+# (values already in the environment win; empty ones run the bot anonymously, as the
+# offline load test in app.benchmarks.loadtest does)
+os.environ.setdefault("MicrosoftAppId", "92bc3ead-9f2c-4d71-a58e-2015571d3410")
+os.environ.setdefault("MicrosoftAppPassword", "QD-8Q~dQz5GzPx0UTmbeTp4GkLIRw1HSEPMYDcS4")
+
+# Logging through a non-blocking queue; level, format, sampling and redaction come
+# from the LOG_* settings (LOG_LEVEL=DEBUG restores the old verbose output)
+configure_logging(settings)
 logger = logging.getLogger("teams_bot_official")
+metrics.enabled = settings.metrics_enabled
 
 class Config:
     """Bot Configuration"""
-    PORT = 3978
-    APP_ID = "92bc3ead-9f2c-4d71-a58e-2015571d3410"
-    APP_PASSWORD = "QD-8Q~dQz5GzPx0UTmbeTp4GkLIRw1HSEPMYDcS4"
+    PORT = settings.web_port
+    APP_ID = os.environ["MicrosoftAppId"]
+    APP_PASSWORD = os.environ["MicrosoftAppPassword"]
 
 # Create adapter using the official pattern
 SETTINGS = ConfigurationBotFrameworkAuthentication(
     Config()  # Pass config object directly
 )
 
-STORAGE = MemoryStorage()
+# MemoryStorage por defecto; con STATE_STORAGE=sqlite el estado sobrevive a reinicios y
+# se escribe en lotes (ver app.services.state_storage)
+STORAGE = registry.get_state_storage()
 CONVERSATION_STATE = ConversationState(STORAGE)
 
 # Create adapter with error handler (official pattern)
 
-class AdapterWithErrorHandler(CloudAdapter):
+class AdapterWithErrorHandler(SendTimingMixin, CloudAdapter):
     def __init__(self, settings: ConfigurationBotFrameworkAuthentication, config: Config, conversation_state: ConversationState):
         super().__init__(settings)
         self._conversation_state = conversation_state
@@ -83,30 +92,77 @@ ADAPTER = AdapterWithErrorHandler(SETTINGS, Config(), CONVERSATION_STATE)
 class TeamsRAGBot(ActivityHandler):
     """Teams RAG Bot using official ActivityHandler pattern"""
     
-    def __init__(self, conversation_state: ConversationState):
+    def __init__(self, conversation_state: ConversationState, background: BackgroundTurnProcessor = None):
         super().__init__()
         self.conversation_state = conversation_state
-        self.rag_service = RagChatService()
+        # Citas agrupadas por documento y renderizadas en una tarjeta compacta
+        self.citations = registry.get_citation_renderer()
+        self.streaming = StreamingResponder(flush_interval=settings.stream_flush_interval, render=self.citations.render)
+        self.background = background
+        self.deduplicator = ActivityDeduplicator(settings.dedup_ttl_seconds, settings.dedup_max_entries)
+
+    # Azure clients are built on first use (or by the startup pre-warm), not at import
+    @property
+    def rag_service(self):
+        return registry.get_rag_chat_service()
+
+    @property
+    def conversation_store(self):
+        return registry.get_conversation_store()
 
     async def on_message_activity(self, turn_context: TurnContext) -> None:
-        """Handle message activities"""
+        """Handle message activities, inline or by queueing them for a proactive reply"""
+        activity = turn_context.activity
+        if self.deduplicator.is_duplicate(activity.id):
+            logger.info("Ignoring redelivered activity", extra=per_message(activity.id))
+            return
+        if self.background is not None and self.background.submit(turn_context, self.answer):
+            return
+        await self.answer(turn_context, activity)
+
+    async def answer(self, turn_context: TurnContext, activity: Activity) -> None:
+        """Answer one message; turn_context may be a proactive turn, so read the message from activity"""
         try:
-            user_message = turn_context.activity.text
-            logger.debug(f"Received message: {user_message}")
-            logger.debug(f"Activity: {turn_context.activity}")
-            logger.debug(f"Headers: {getattr(turn_context, 'headers', 'N/A')}")
+            user_message = activity.text
+            log_extra = per_message(activity.id)
+            logger.debug("Received message: %s", MessageText(user_message), extra=log_extra)
+            logger.debug("Activity: %s", ActivitySummary(activity), extra=log_extra)
+            conversation_id = activity.conversation.id
+            history = await self.conversation_store.get_history(conversation_id)
+
+            if settings.stream_responses:
+                # Stream the answer with typing indicator and progressive updates
+                rag_response = await self.streaming.deliver(
+                    turn_context,
+                    self.rag_service.stream_chat_completion(
+                        user_message=user_message,
+                        conversation_history=history,
+                        conversation_id=conversation_id
+                    )
+                )
+                await self.conversation_store.append_exchange(conversation_id, user_message, rag_response["message"])
+                logger.debug("RAG streamed response: %s", MessageText(rag_response["message"]), extra=log_extra)
+                return
 
             # Use RAG service to get response
             rag_response = await self.rag_service.get_chat_completion(
                 user_message=user_message,
-                conversation_history=[]
+                conversation_history=history,
+                conversation_id=conversation_id
             )
 
             # Send response
             response_text = rag_response.get("message", "Lo siento, no pude generar una respuesta.")
-            logger.debug(f"RAG response: {response_text}")
-            await turn_context.send_activity(MessageFactory.text(response_text))
+            logger.debug("RAG response: %s", MessageText(response_text), extra=log_extra)
+            await turn_context.send_activity(self.citations.render(response_text, rag_response.get("citations")))
+            await self.conversation_store.append_exchange(conversation_id, user_message, response_text)
 
+        except ServiceBusyError as e:
+            # Shed under load: answer right away instead of letting Teams time out
+            logger.warning(f"Request shed by admission control: {e}")
+            await turn_context.send_activity(MessageFactory.text(
+                "El servicio está ocupado en este momento. Por favor intenta de nuevo en unos segundos."
+            ))
         except Exception as e:
             logger.error(f"Error in on_message_activity: {e}")
             traceback.print_exc()
@@ -121,33 +177,50 @@ class TeamsRAGBot(ActivityHandler):
 
     async def on_turn(self, turn_context: TurnContext):
         """Handle every turn of the bot and save state changes"""
-        await super().on_turn(turn_context)
+        with metrics.span("turn"):
+            await super().on_turn(turn_context)
         # Save any state changes
         await self.conversation_state.save_changes(turn_context, False)
+        startup.mark("first_turn")
 
-# Create the Bot
-BOT = TeamsRAGBot(CONVERSATION_STATE)
+# Create the Bot; with BACKGROUND_PROCESSING=true answers are sent as proactive messages
+BOT = TeamsRAGBot(
+    CONVERSATION_STATE,
+    background=build_background_processor(ADAPTER, settings) if settings.background_processing else None
+)
+
+# Cheap 200 for the activities the bot ignores (typing, reactions...), before deserializing them
+FAST_PATH = build_activity_fast_path(settings)
 
 # Main bot message handler (official pattern)
 async def messages(req: Request) -> Response:
     """Main bot message handler - exact official pattern"""
-    logger.debug(f"Incoming request headers: {dict(req.headers)}")
+    logger.debug("Incoming request headers: %s", SafeHeaders(req.headers), extra=per_message())
     # Check content type
-    if "application/json" in req.headers["Content-Type"]:
-        body = await req.json()
-    else:
-        logger.warning("Unsupported media type")
-        return Response(status=HTTPStatus.UNSUPPORTED_MEDIA_TYPE)
-
-    logger.debug(f"Incoming request body: {body}")
-    activity = Activity().deserialize(body)
+    with metrics.span("activity_deserialize"):
+        if "application/json" not in req.headers["Content-Type"]:
+            logger.warning("Unsupported media type")
+            return Response(status=HTTPStatus.UNSUPPORTED_MEDIA_TYPE)
+        try:
+            body, activity = FAST_PATH.parse(await req.read())
+        except ValueError:
+            logger.warning("Empty or invalid request body")
+            return Response(status=HTTPStatus.BAD_REQUEST)
+
+        logger.debug("Incoming request body: %s", ActivitySummary(body), extra=per_message(body.get("id")))
+    if activity is None:
+        return Response(status=HTTPStatus.OK)
     auth_header = req.headers["Authorization"] if "Authorization" in req.headers else ""
 
     try:
+        # Authenticate separately so its latency is visible on /metrics; process_activity
+        # accepts the result in place of the raw header
+        with metrics.span("adapter_auth"):
+            auth_result = await SETTINGS.authenticate_request(activity, auth_header)
         # Official pattern: ADAPTER.process_activity(auth_header, activity, BOT.on_turn)
-        invoke_response = await ADAPTER.process_activity(auth_header, activity, BOT.on_turn)
+        invoke_response = await ADAPTER.process_activity(auth_result, activity, BOT.on_turn)
         if invoke_response:
-            logger.debug(f"Invoke response: {invoke_response.body}")
+            logger.debug("Invoke response: status=%s", invoke_response.status)
             return json_response(data=invoke_response.body, status=invoke_response.status)
         logger.debug("No invoke response, returning 200 OK")
         return Response(status=HTTPStatus.OK)
@@ -156,9 +229,28 @@ async def messages(req: Request) -> Response:
         traceback.print_exc()
         return Response(status=HTTPStatus.INTERNAL_SERVER_ERROR)
 
+async def metrics_handler(req: Request) -> Response:
+    """Per-stage latency histograms; ?format=prometheus returns Prometheus text"""
+    components = registry.stats()
+    components["dedup"] = {"duplicates": BOT.deduplicator.duplicates}
+    components["activities"] = FAST_PATH.stats()
+    if BOT.background is not None:
+        components["background"] = BOT.background.stats()
+    if wants_prometheus(req.query.get("format"), req.headers.get("Accept")):
+        return Response(text=metrics.render_prometheus(components), headers={"Content-Type": PROMETHEUS_CONTENT_TYPE})
+    return json_response(metrics.snapshot(components))
+
 # Create app
 APP = web.Application(middlewares=[aiohttp_error_middleware])
 APP.router.add_post("/api/messages", messages)
+if settings.metrics_enabled:
+    APP.router.add_get("/metrics", metrics_handler)
+APP.on_startup.append(registry.startup)
+if BOT.background is not None:
+    # Finish queued answers before the shared clients are closed
+    APP.on_cleanup.append(BOT.background.drain)
+APP.on_cleanup.append(registry.shutdown)
+startup.mark("app_ready")
 
 if __name__ == "__main__":
     try:
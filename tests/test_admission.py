@@ -0,0 +1,171 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app.services.admission import AdmissionController, ServiceBusyError
+
+
+class StatusError(Exception):
+    """Error with an HTTP status and headers, like the OpenAI SDK's APIStatusError"""
+
+    def __init__(self, status_code, retry_after_ms=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        headers = {"retry-after-ms": str(retry_after_ms)} if retry_after_ms is not None else {}
+        self.response = SimpleNamespace(headers=headers)
+
+
+def failing(times, error):
+    """Factory that raises error the first times calls, then answers"""
+    calls = []
+
+    async def call():
+        calls.append(1)
+        if len(calls) <= times:
+            raise error
+        return "ok"
+
+    return call, calls
+
+
+async def answer():
+    return "ok"
+
+
+def test_successful_calls_raise_the_limit_additively():
+    async def scenario():
+        controller = AdmissionController(initial_concurrency=4)
+        for _ in range(4):
+            await controller.call(answer)
+        return controller.limit
+
+    expected = 4.0
+    for _ in range(4):
+        expected += 1 / expected
+    assert asyncio.run(scenario()) == pytest.approx(expected)
+
+
+def test_throttled_call_halves_the_limit_and_is_retried():
+    async def scenario():
+        controller = AdmissionController(initial_concurrency=8)
+        call, calls = failing(1, StatusError(429, retry_after_ms=1))
+        result = await controller.call(call)
+        return controller, result, len(calls)
+
+    controller, result, calls = asyncio.run(scenario())
+    assert (result, calls) == ("ok", 2)
+    assert controller.throttled == controller.retries == 1
+    # Halved by the 429, then one additive step for the successful retry
+    assert controller.limit == pytest.approx(4 + 1 / 4)
+
+
+def test_limit_never_drops_below_the_minimum():
+    async def scenario():
+        controller = AdmissionController(initial_concurrency=8, min_concurrency=2, max_retries=10)
+        call, _ = failing(6, StatusError(429, retry_after_ms=1))
+        await controller.call(call)
+        return controller
+
+    controller = asyncio.run(scenario())
+    assert controller.throttled == 6
+    assert 2 <= controller.limit < 3
+
+
+def test_exhausted_retries_are_shed_as_busy():
+    async def scenario():
+        controller = AdmissionController(max_retries=2)
+        call, calls = failing(10, StatusError(429, retry_after_ms=1))
+        with pytest.raises(ServiceBusyError):
+            await controller.call(call)
+        return controller, len(calls)
+
+    controller, calls = asyncio.run(scenario())
+    assert calls == 3
+    assert controller.shed_retries == 1
+    assert controller.in_flight == 0
+
+
+def test_other_errors_are_not_retried():
+    async def scenario():
+        controller = AdmissionController()
+        call, calls = failing(1, StatusError(400))
+        with pytest.raises(StatusError):
+            await controller.call(call)
+        return controller, len(calls)
+
+    controller, calls = asyncio.run(scenario())
+    assert calls == 1
+    assert controller.retries == controller.throttled == 0
+
+
+def test_retry_after_pauses_new_calls():
+    async def scenario():
+        controller = AdmissionController(max_retries=0)
+        call, _ = failing(1, StatusError(429, retry_after_ms=200))
+        with pytest.raises(ServiceBusyError):
+            await controller.call(call)
+        started = time.monotonic()
+        await controller.call(answer)
+        return time.monotonic() - started
+
+    assert asyncio.run(scenario()) >= 0.15
+
+
+def test_concurrency_is_bounded_by_the_limit():
+    async def scenario():
+        controller = AdmissionController(initial_concurrency=2, max_concurrency=2)
+        running, peak = 0, 0
+
+        async def call():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            return "ok"
+
+        await asyncio.gather(*(controller.call(call) for _ in range(6)))
+        return peak
+
+    assert asyncio.run(scenario()) == 2
+
+
+def test_full_queue_and_queue_timeout_shed_callers():
+    async def scenario():
+        controller = AdmissionController(initial_concurrency=1, max_concurrency=1, max_queue=1, queue_timeout=0.1)
+        release = asyncio.Event()
+
+        async def held():
+            await release.wait()
+            return "ok"
+
+        holder = asyncio.ensure_future(controller.call(held))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(controller.call(answer))
+        await asyncio.sleep(0)
+        with pytest.raises(ServiceBusyError):
+            await controller.call(answer)
+        with pytest.raises(ServiceBusyError):
+            await waiter
+        release.set()
+        await holder
+        return controller
+
+    controller = asyncio.run(scenario())
+    assert controller.shed_queue_full == 1
+    assert controller.shed_timeout == 1
+
+
+def test_charge_corrects_the_token_budget():
+    async def scenario():
+        controller = AdmissionController(tokens_per_minute=60000, queue_timeout=1)
+        await controller.call(answer, estimated_tokens=60000)
+        # The call used far fewer tokens than estimated
+        controller.charge(1000 - 60000)
+        started = time.monotonic()
+        await controller.call(answer, estimated_tokens=50000)
+        return time.monotonic() - started
+
+    assert asyncio.run(scenario()) < 0.5
@@ -0,0 +1,106 @@
+import asyncio
+
+import pytest
+
+from app.services import answer_cache
+from app.services.answer_cache import AnswerCache, SQLiteCacheBackend, local_question_vector
+
+NAMESPACE = "embeddings|index||"
+
+# Questions with different answers that hashed vectors score as near-identical
+DIFFERENT_QUESTIONS = [
+    ("¿Cuántos días de vacaciones tengo en 2024?", "¿Cuántos días de vacaciones tengo en 2025?"),
+    ("¿Cuál es el límite de dietas en viajes nacionales?", "¿Cuál es el límite de dietas en viajes internacionales?"),
+    ("What is the health insurance for employees in Spain?", "What is the health insurance for employees in France?"),
+    ("Which vacation days carry over to next year?", "Which vacation days do not carry over to next year?"),
+]
+
+
+def result(question):
+    return {"message": f"answer to {question}", "citations": []}
+
+
+async def same_vector(text):
+    return [1.0, 0.0, 0.0]
+
+
+async def hashed_vector(text):
+    return local_question_vector(text)
+
+
+async def store_and_lookup(cache, stored, asked):
+    await cache.store(stored, NAMESPACE, result(stored))
+    return await cache.lookup(asked, NAMESPACE)
+
+
+@pytest.mark.parametrize("stored, asked", DIFFERENT_QUESTIONS)
+def test_default_cache_matches_exact_repeats_only(stored, asked):
+    cache = AnswerCache()
+    assert asyncio.run(store_and_lookup(cache, stored, asked)) is None
+    assert asyncio.run(cache.lookup(stored.upper() + "!!", NAMESPACE)) == result(stored)
+
+
+@pytest.mark.parametrize("stored, asked", DIFFERENT_QUESTIONS[:1] + DIFFERENT_QUESTIONS[3:])
+def test_number_or_negation_change_never_matches(stored, asked):
+    # Even an embedder that finds both questions identical
+    cache = AnswerCache(similarity_threshold=0.97, embed=same_vector)
+    assert asyncio.run(store_and_lookup(cache, stored, asked)) is None
+
+
+@pytest.mark.parametrize("stored, asked", DIFFERENT_QUESTIONS[1:3])
+def test_entity_change_below_threshold_does_not_match(stored, asked):
+    cache = AnswerCache(similarity_threshold=0.97, embed=hashed_vector)
+    assert asyncio.run(store_and_lookup(cache, stored, asked)) is None
+
+
+def test_near_duplicate_with_embeddings():
+    cache = AnswerCache(similarity_threshold=0.97, embed=same_vector)
+    stored = "How many vacation days do I get in 2024?"
+    cached = asyncio.run(store_and_lookup(cache, stored, "How many days of vacation in 2024?"))
+    assert cached == result(stored)
+    assert cache.stats()["near_hits"] == 1
+
+
+def test_lookup_does_not_hold_lock_while_embedding():
+    async def scenario():
+        release = asyncio.Event()
+        cache = AnswerCache(similarity_threshold=0.97, embed=same_vector)
+        await cache.store("What is the VPN address?", NAMESPACE, result("vpn"))
+
+        async def slow_embed(text):
+            await release.wait()
+            return [1.0, 0.0, 0.0]
+
+        cache.embed = slow_embed
+        slow = asyncio.ensure_future(cache.lookup("Where is the VPN?", NAMESPACE))
+        await asyncio.sleep(0)
+        # An exact hit completes while the other lookup waits for its embedding
+        exact = await asyncio.wait_for(cache.lookup("What is the VPN address?", NAMESPACE), 1)
+        release.set()
+        return exact, await slow
+
+    exact, near = asyncio.run(scenario())
+    assert exact == result("vpn")
+    assert near == result("vpn")
+
+
+def test_sqlite_backend_matches_off_the_loop(tmp_path, monkeypatch):
+    async def scenario():
+        path = str(tmp_path / "answers.sqlite3")
+        writer = AnswerCache(SQLiteCacheBackend(path), similarity_threshold=0.97, embed=same_vector)
+        reader = AnswerCache(SQLiteCacheBackend(path), similarity_threshold=0.97, embed=same_vector)
+        assert await reader.lookup("What is the VPN address?", NAMESPACE) is None
+        await writer.store("What is the VPN address?", NAMESPACE, result("vpn"))
+        exact = await reader.lookup("what is the vpn address", NAMESPACE)
+        # The reader's matrix predates the store; it is rebuilt once it is old enough
+        monkeypatch.setattr(answer_cache, "INDEX_REFRESH_SECONDS", 0.0)
+        near = await reader.lookup("Where is the VPN?", NAMESPACE)
+        stats = writer.stats()
+        await writer.close()
+        await reader.close()
+        return exact, near, stats
+
+    exact, near, stats = asyncio.run(scenario())
+    assert exact == result("vpn")
+    assert near == result("vpn")
+    assert stats["entries"] == 1
@@ -0,0 +1,126 @@
+import json
+
+import pytest
+
+from app.citations import CitationRenderer, Source, _snippet, process_citations
+
+
+def citation(filepath, content="", title=None, url=""):
+    return {"filepath": filepath, "title": title or filepath, "url": url, "content": content, "chunk_id": "0"}
+
+
+def card_body(card_json):
+    return json.loads(card_json)["body"]
+
+
+def test_markers_are_renumbered_in_order_of_appearance():
+    text, sources = process_citations(
+        "Vacaciones [doc2]. Permisos [doc1].",
+        [citation("permisos.md"), citation("vacaciones.md")]
+    )
+    assert text == "Vacaciones [1]. Permisos [2]."
+    assert [(source.number, source.title) for source in sources] == [(1, "vacaciones.md"), (2, "permisos.md")]
+
+
+def test_chunks_of_one_document_are_one_source():
+    text, sources = process_citations(
+        "Respuesta [doc1][doc2] y más [doc3].",
+        [citation("a.md", "primer chunk"), citation("A.md", "segundo chunk"), citation("b.md")]
+    )
+    # Consecutive markers for the same source collapse into one
+    assert text == "Respuesta [1] y más [2]."
+    assert len(sources) == 2
+    assert sources[0].snippet == "primer chunk"
+
+
+def test_markers_past_max_sources_or_out_of_range_are_removed():
+    text, sources = process_citations(
+        "Uno [doc1]. Dos [doc2]. Tres [doc3]. Nada [doc9].",
+        [citation("a.md"), citation("b.md"), citation("c.md")],
+        max_sources=2
+    )
+    assert text == "Uno [1]. Dos [2]. Tres. Nada."
+    assert [source.number for source in sources] == [1, 2]
+
+
+def test_without_markers_the_first_documents_are_listed():
+    text, sources = process_citations(
+        "Sin marcadores.",
+        [citation("a.md"), citation("a.md"), citation("b.md"), citation("c.md")],
+        max_sources=2
+    )
+    assert text == "Sin marcadores."
+    assert [source.title for source in sources] == ["a.md", "b.md"]
+
+
+def test_title_falls_back_to_the_path_url_or_number():
+    _, sources = process_citations("[doc1] [doc2] [doc3]", [
+        {"filepath": "manual.pdf"},
+        {"url": "https://intranet/faq"},
+        {"chunk_id": "7"}
+    ])
+    assert [source.title for source in sources] == ["manual.pdf", "https://intranet/faq", "Documento 3"]
+    assert sources[1].url == "https://intranet/faq"
+
+
+@pytest.mark.parametrize("content, limit, expected", [
+    ("corto", 20, "corto"),
+    ("  varios   espacios\n aquí ", 40, "varios espacios aquí"),
+    ("una frase larga, con comas", 17, "una frase larga…"),
+    ("palabrasinespacios", 8, "palabras…"),
+    (None, 10, ""),
+])
+def test_snippet(content, limit, expected):
+    assert _snippet(content, limit) == expected
+
+
+def sources(count, snippet_chars=150):
+    return [Source(number, f"Documento {number}", snippet="x " * snippet_chars) for number in range(1, count + 1)]
+
+
+def test_fit_keeps_a_card_within_the_budget():
+    renderer = CitationRenderer(max_payload_bytes=24000)
+    card_json = renderer._fit("Respuesta", sources(3))
+    assert renderer.trimmed == 0
+    assert len(card_body(card_json)[1]["items"]) == 6
+
+
+def test_fit_drops_snippets_first():
+    renderer = CitationRenderer()
+    full = renderer._fit("Respuesta", sources(3))
+    renderer.max_payload_bytes = len(full.encode("utf-8")) - 1
+    card_json = renderer._fit("Respuesta", sources(3))
+    items = card_body(card_json)[1]["items"]
+    assert [item["text"] for item in items] == ["[1] Documento 1", "[2] Documento 2", "[3] Documento 3"]
+    assert renderer.trimmed == 1
+
+
+def test_fit_drops_sources_then_trims_the_text():
+    renderer = CitationRenderer()
+    without_snippets = renderer._card_json("Respuesta", sources(3), with_snippets=False)
+    renderer.max_payload_bytes = len(without_snippets.encode("utf-8")) - 1
+    body = card_body(renderer._fit("Respuesta", sources(3)))
+    assert [item["text"] for item in body[1]["items"]] == ["[1] Documento 1", "[2] Documento 2"]
+
+    text = "Una respuesta con \"comillas\" y acentos: áéíóú " * 20
+    renderer.max_payload_bytes = 400
+    card_json = renderer._fit(text, sources(3))
+    body = card_body(card_json)
+    assert len(card_json.encode("utf-8")) <= 400
+    assert len(body) == 1
+    assert body[0]["text"].endswith("…")
+    assert text.startswith(body[0]["text"][:-1])
+
+
+def test_render_caches_cards_and_text_mode_lists_sources():
+    renderer = CitationRenderer()
+    citations = [citation("a.md", "contenido", url="https://intranet/a")]
+    first = renderer.render("Respuesta [doc1]", citations)
+    second = renderer.render("Respuesta [doc1]", citations)
+    assert first.attachments[0].content == second.attachments[0].content
+    assert first.attachments[0].content is not second.attachments[0].content
+    assert (renderer.rendered, renderer.cache_hits) == (1, 1)
+
+    renderer = CitationRenderer(mode="text")
+    activity = renderer.render("Respuesta [doc1]", citations)
+    assert activity.text == "Respuesta [1]\n\n**Fuentes:**\n1. [a.md](https://intranet/a)"
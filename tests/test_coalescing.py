@@ -0,0 +1,170 @@
+import asyncio
+
+import pytest
+
+from app.services.coalescing import SingleFlight
+
+
+class FakeCompletion:
+    """Upstream stand-in counting calls; answers once released"""
+
+    def __init__(self, answer="answer", error=None):
+        self.answer = answer
+        self.error = error
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def complete(self):
+        self.calls += 1
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return self.answer
+
+    async def stream(self):
+        self.calls += 1
+        yield "first"
+        await self.release.wait()
+        yield "second"
+        if self.error is not None:
+            raise self.error
+        yield "third"
+
+
+async def collect(stream):
+    return [event async for event in stream]
+
+
+def test_run_merges_concurrent_callers():
+    async def scenario():
+        flight, upstream = SingleFlight(), FakeCompletion()
+        callers = [asyncio.ensure_future(flight.run("q", upstream.complete, weight=len)) for _ in range(3)]
+        await asyncio.sleep(0)
+        upstream.release.set()
+        return flight, upstream, await asyncio.gather(*callers)
+
+    flight, upstream, results = asyncio.run(scenario())
+    assert results == ["answer"] * 3
+    assert upstream.calls == 1
+    assert (flight.leaders, flight.merged) == (1, 2)
+    assert flight.tokens_avoided == 2 * len("answer")
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_run_starts_a_new_request_once_the_previous_one_finished():
+    async def scenario():
+        flight, upstream = SingleFlight(), FakeCompletion()
+        upstream.release.set()
+        await flight.run("q", upstream.complete)
+        await flight.run("q", upstream.complete)
+        return flight, upstream
+
+    flight, upstream = asyncio.run(scenario())
+    assert upstream.calls == 2
+    assert flight.merged == 0
+
+
+def test_run_leader_cancellation_does_not_cancel_followers():
+    async def scenario():
+        flight, upstream = SingleFlight(), FakeCompletion()
+        leader = asyncio.ensure_future(flight.run("q", upstream.complete))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.run("q", upstream.complete))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        upstream.release.set()
+        return leader, await follower
+
+    leader, result = asyncio.run(scenario())
+    assert leader.cancelled()
+    assert result == "answer"
+
+
+def test_run_error_reaches_every_caller():
+    async def scenario():
+        flight, upstream = SingleFlight(), FakeCompletion(error=RuntimeError("upstream failed"))
+        callers = [asyncio.ensure_future(flight.run("q", upstream.complete)) for _ in range(2)]
+        await asyncio.sleep(0)
+        upstream.release.set()
+        return await asyncio.gather(*callers, return_exceptions=True)
+
+    assert [type(result) for result in asyncio.run(scenario())] == [RuntimeError, RuntimeError]
+
+
+def test_stream_follower_replays_events_sent_before_it_joined():
+    async def scenario():
+        flight, upstream = SingleFlight(), FakeCompletion()
+        leader = flight.stream("q", upstream.stream)
+        assert await leader.__anext__() == "first"
+        follower = asyncio.ensure_future(collect(flight.stream("q", upstream.stream)))
+        await asyncio.sleep(0)
+        upstream.release.set()
+        return flight, upstream, ["first"] + await collect(leader), await follower
+
+    flight, upstream, leader_events, follower_events = asyncio.run(scenario())
+    assert leader_events == follower_events == ["first", "second", "third"]
+    assert upstream.calls == 1
+    assert (flight.leaders, flight.merged) == (1, 1)
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_stream_leader_cancellation_does_not_stop_followers():
+    async def scenario():
+        flight, upstream = SingleFlight(), FakeCompletion()
+        leader = asyncio.ensure_future(collect(flight.stream("q", upstream.stream)))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(collect(flight.stream("q", upstream.stream)))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        upstream.release.set()
+        return leader, await follower
+
+    leader, events = asyncio.run(scenario())
+    assert leader.cancelled()
+    assert events == ["first", "second", "third"]
+
+
+def test_stream_error_reaches_every_subscriber_after_the_events():
+    async def scenario():
+        flight, upstream = SingleFlight(), FakeCompletion(error=RuntimeError("stream broke"))
+        received = [[], []]
+
+        async def subscribe(events):
+            async for event in flight.stream("q", upstream.stream):
+                events.append(event)
+
+        subscribers = [asyncio.ensure_future(subscribe(events)) for events in received]
+        await asyncio.sleep(0)
+        upstream.release.set()
+        results = await asyncio.gather(*subscribers, return_exceptions=True)
+        return received, results
+
+    received, results = asyncio.run(scenario())
+    assert received == [["first", "second"]] * 2
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_stream_new_caller_after_completion_starts_fresh():
+    async def scenario():
+        flight, upstream = SingleFlight(), FakeCompletion()
+        upstream.release.set()
+        await collect(flight.stream("q", upstream.stream))
+        await collect(flight.stream("q", upstream.stream))
+        return upstream
+
+    assert asyncio.run(scenario()).calls == 2
+
+
+@pytest.mark.parametrize("keys, calls", [(("a", "a"), 1), (("a", "b"), 2)])
+def test_run_coalesces_by_key(keys, calls):
+    async def scenario():
+        flight, upstream = SingleFlight(), FakeCompletion()
+        callers = [asyncio.ensure_future(flight.run(key, upstream.complete)) for key in keys]
+        await asyncio.sleep(0)
+        upstream.release.set()
+        await asyncio.gather(*callers)
+        return upstream.calls
+
+    assert asyncio.run(scenario()) == calls
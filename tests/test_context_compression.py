@@ -0,0 +1,117 @@
+import pytest
+
+from app.services.context_compression import (
+    ContextCompressor,
+    hamming_distance,
+    simhash,
+    split_sentences
+)
+from app.services.prompt_assembly import Tokenizer
+from app.services.retrieval.base import RetrievedDocument
+
+POLICY = (
+    "El plazo para solicitar las vacaciones de verano termina el quince de mayo y las solicitudes "
+    "se hacen en el portal del empleado con la aprobación del responsable directo."
+)
+
+
+def doc(doc_id, content):
+    return RetrievedDocument(id=doc_id, content=content, filepath=f"{doc_id}.md")
+
+
+def compressor(**kwargs):
+    # Character estimate: counts do not depend on a tiktoken download
+    return ContextCompressor(Tokenizer(""), **kwargs)
+
+
+def test_split_sentences():
+    assert split_sentences("Uno. Dos? Tres!\nCuatro: cinco;  seis") == ["Uno.", "Dos?", "Tres!", "Cuatro:", "cinco;", "seis"]
+    assert split_sentences("") == []
+
+
+def test_simhash_distance_tracks_similarity():
+    assert simhash(POLICY) == simhash(POLICY.upper().replace(" ", "  "))
+    edited = hamming_distance(simhash(POLICY), simhash(POLICY.replace("quince", "treinta")))
+    unrelated = hamming_distance(simhash(POLICY), simhash("El comedor abre de doce a cuatro los días laborables."))
+    assert 0 < edited < unrelated
+
+
+def test_off_mode_returns_the_documents_unchanged():
+    documents = [doc("a", POLICY), doc("b", POLICY)]
+    result = compressor(mode="off").compress("vacaciones", documents)
+    assert result.documents == documents
+    assert result.tokens_before == result.tokens_after
+
+
+def test_near_duplicate_chunks_are_dropped():
+    documents = [doc("a", POLICY), doc("b", POLICY.upper()), doc("c", POLICY.replace("quince", "treinta"))]
+    result = compressor(mode="dedupe").compress("vacaciones", documents)
+    assert [document.id for document in result.documents] == ["a", "c"]
+    assert result.duplicates == 1
+
+    result = compressor(mode="dedupe", simhash_distance=16).compress("vacaciones", documents)
+    assert [document.id for document in result.documents] == ["a"]
+    assert result.duplicates == 2
+
+
+def test_sentences_of_better_ranked_chunks_are_dropped():
+    shared = "Las solicitudes se aprueban en un plazo de cinco días laborables."
+    documents = [
+        doc("a", f"Las vacaciones se piden en el portal del empleado. {shared}"),
+        doc("b", f"{shared} Los días no disfrutados caducan el treinta y uno de marzo.")
+    ]
+    result = compressor(mode="dedupe").compress("vacaciones", documents)
+    assert result.documents[0] is documents[0]
+    assert result.documents[1].content == "Los días no disfrutados caducan el treinta y uno de marzo."
+    assert result.sentences_dropped == 1
+    assert result.tokens_after < result.tokens_before
+
+
+def test_document_left_empty_is_dropped():
+    documents = [
+        doc("a", "Primera frase con varias palabras. Segunda frase con otras palabras."),
+        doc("b", "Segunda frase con otras palabras. Primera frase con varias palabras.")
+    ]
+    result = compressor(mode="dedupe", simhash_distance=0).compress("frase", documents)
+    assert [document.id for document in result.documents] == ["a"]
+    # Not a near-duplicate: both of its sentences were already sent
+    assert (result.duplicates, result.sentences_dropped) == (0, 2)
+
+
+def test_extractive_keeps_matching_sentences_and_their_neighbours_in_order():
+    content = " ".join([
+        "La empresa tiene oficinas en tres ciudades.",
+        "El horario de verano empieza en junio.",
+        "Las vacaciones se solicitan en el portal del empleado.",
+        "El comedor abre a mediodía.",
+        "El aparcamiento es gratuito.",
+        "La red wifi de invitados no requiere contraseña."
+    ])
+    result = compressor(mode="extractive", min_sentences=1).compress("¿Cómo pido las vacaciones?", [doc("a", content)])
+    assert result.documents[0].content == (
+        "El horario de verano empieza en junio. "
+        "Las vacaciones se solicitan en el portal del empleado. "
+        "El comedor abre a mediodía."
+    )
+    assert result.sentences_dropped == 3
+
+
+def test_extractive_without_query_terms_keeps_the_first_sentences():
+    content = "Primera frase. Segunda frase. Tercera frase. Cuarta frase."
+    result = compressor(mode="extractive", min_sentences=2).compress("nómina", [doc("a", content)])
+    assert result.documents[0].content == "Primera frase. Segunda frase."
+
+
+def test_extractive_respects_the_document_budget():
+    long_sentence = "vacaciones " * 200
+    result = compressor(mode="extractive", max_document_tokens=20).compress("vacaciones", [doc("a", long_sentence)])
+    assert Tokenizer("").count(result.documents[0].content) <= 20
+
+
+def test_stats_aggregate_the_reduction():
+    compression = compressor(mode="dedupe")
+    compression.compress("vacaciones", [doc("a", POLICY), doc("b", POLICY)])
+    stats = compression.stats()
+    assert stats["calls"] == 1
+    assert stats["near_duplicates"] == 1
+    assert stats["reduction"] == pytest.approx(0.5)
@@ -0,0 +1,67 @@
+import pytest
+
+from app import background
+from app.background import ActivityDeduplicator
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(background.time, "monotonic", clock)
+    return clock
+
+
+def test_repeated_activity_id_is_a_duplicate(clock):
+    deduplicator = ActivityDeduplicator()
+    assert not deduplicator.is_duplicate("a")
+    assert deduplicator.is_duplicate("a")
+    assert deduplicator.is_duplicate("a")
+    assert not deduplicator.is_duplicate("b")
+    assert deduplicator.duplicates == 2
+
+
+@pytest.mark.parametrize("activity_id", [None, ""])
+def test_activities_without_id_are_never_duplicates(clock, activity_id):
+    deduplicator = ActivityDeduplicator()
+    assert not deduplicator.is_duplicate(activity_id)
+    assert not deduplicator.is_duplicate(activity_id)
+    assert deduplicator.duplicates == 0
+
+
+def test_ids_expire_after_the_ttl(clock):
+    deduplicator = ActivityDeduplicator(ttl_seconds=60)
+    deduplicator.is_duplicate("a")
+    clock.now += 59
+    assert deduplicator.is_duplicate("a")
+    clock.now += 2
+    # Seen 61 s ago: a new delivery, not a channel retry
+    assert not deduplicator.is_duplicate("a")
+    assert deduplicator.is_duplicate("a")
+
+
+def test_expired_ids_are_dropped_oldest_first(clock):
+    deduplicator = ActivityDeduplicator(ttl_seconds=60)
+    deduplicator.is_duplicate("old")
+    clock.now += 30
+    deduplicator.is_duplicate("recent")
+    clock.now += 40
+    deduplicator.is_duplicate("new")
+    assert list(deduplicator._seen) == ["recent", "new"]
+
+
+def test_max_entries_evicts_the_oldest_id(clock):
+    deduplicator = ActivityDeduplicator(max_entries=2)
+    for activity_id in ("a", "b", "c"):
+        clock.now += 1
+        deduplicator.is_duplicate(activity_id)
+    assert len(deduplicator._seen) == 2
+    assert deduplicator.is_duplicate("c")
+    assert not deduplicator.is_duplicate("a")
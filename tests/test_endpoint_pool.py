@@ -0,0 +1,199 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app.services.endpoint_pool import (
+    CIRCUIT_CLOSED,
+    CIRCUIT_OPEN,
+    KIND_COMPLETE,
+    KIND_EMBEDDING,
+    Endpoint,
+    EndpointConfig,
+    EndpointPool
+)
+
+
+class StatusError(Exception):
+    """Error with an HTTP status, like the OpenAI SDK's APIStatusError"""
+
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class FakeStream:
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._chunks)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeClient:
+    """AsyncAzureOpenAI stand-in answering after a delay, or failing with a status"""
+
+    def __init__(self, name, delay=0.0, fail_with=None):
+        self.name = name
+        self.delay = delay
+        self.fail_with = fail_with
+        self.calls = 0
+        self.cancelled = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+        self.embeddings = SimpleNamespace(create=self._embed)
+
+    async def _respond(self):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.fail_with is not None:
+            raise StatusError(self.fail_with)
+
+    async def _create(self, model, stream=False, **kwargs):
+        await self._respond()
+        if stream:
+            return FakeStream([f"{self.name}:1", f"{self.name}:2"])
+        return f"{self.name}:{model}"
+
+    async def _embed(self, model, **kwargs):
+        await self._respond()
+        return f"{self.name}:embedding"
+
+    async def close(self):
+        pass
+
+
+def endpoint(client, weight=1.0):
+    return Endpoint(EndpointConfig(client.name, f"https://{client.name}", weight=weight), client)
+
+
+def pool(*endpoints, **kwargs):
+    options = dict(hedge_initial_delay_ms=50, hedge_min_delay_ms=10, hedge_max_ratio=1.0)
+    options.update(kwargs)
+    return EndpointPool(list(endpoints), **options)
+
+
+async def collect(stream):
+    return [chunk async for chunk in stream]
+
+
+def test_hedge_to_second_endpoint_when_first_is_slow():
+    slow, fast = FakeClient("slow", delay=5), FakeClient("fast", delay=0.01)
+    # The fast endpoint's weight makes the slow one the first choice
+    endpoints = pool(endpoint(slow), endpoint(fast, weight=1e-9))
+
+    async def scenario():
+        started = time.monotonic()
+        result = await endpoints.chat.completions.create(model="gpt")
+        await asyncio.sleep(0)
+        return result, time.monotonic() - started
+
+    result, elapsed = asyncio.run(scenario())
+    assert result == "fast:gpt"
+    assert elapsed < 1
+    assert endpoints.hedges == endpoints.hedge_wins == 1
+    assert slow.cancelled == 1
+
+
+def test_no_hedge_over_max_ratio():
+    slow, fast = FakeClient("slow", delay=0.2), FakeClient("fast")
+    endpoints = pool(endpoint(slow), endpoint(fast, weight=1e-9), hedge_max_ratio=0)
+    assert asyncio.run(endpoints.chat.completions.create(model="gpt")) == "slow:gpt"
+    assert endpoints.hedges == 0
+    assert fast.calls == 0
+
+
+def test_stream_hedge_races_to_first_chunk():
+    slow, fast = FakeClient("slow", delay=5), FakeClient("fast", delay=0.01)
+    endpoints = pool(endpoint(slow), endpoint(fast, weight=1e-9))
+
+    async def scenario():
+        return await collect(await endpoints.chat.completions.create(model="gpt", stream=True))
+
+    # The first chunk consumed by the race is put back in front
+    assert asyncio.run(scenario()) == ["fast:1", "fast:2"]
+    assert endpoints.hedge_wins == 1
+
+
+def test_retryable_error_fails_over_to_next_endpoint():
+    throttled, healthy = FakeClient("throttled", fail_with=429), FakeClient("healthy")
+    first, second = endpoint(throttled), endpoint(healthy, weight=1e-9)
+    endpoints = pool(first, second, hedge_enabled=False)
+    assert asyncio.run(endpoints.chat.completions.create(model="gpt")) == "healthy:gpt"
+    assert endpoints.failovers == 1
+    assert first.failures == 1 and first.error_rate > 0
+    assert second.latency[KIND_COMPLETE].samples
+
+
+def test_client_error_is_raised_without_failover():
+    rejected, healthy = FakeClient("rejected", fail_with=400), FakeClient("healthy")
+    endpoints = pool(endpoint(rejected), endpoint(healthy, weight=1e-9), hedge_enabled=False)
+    with pytest.raises(StatusError):
+        asyncio.run(endpoints.chat.completions.create(model="gpt"))
+    assert healthy.calls == 0
+
+
+def test_consecutive_failures_open_the_circuit():
+    broken, healthy = FakeClient("broken", fail_with=500), FakeClient("healthy")
+    failing = endpoint(broken)
+    endpoints = pool(failing, endpoint(healthy, weight=1e-9), hedge_enabled=False, failure_threshold=2)
+
+    async def scenario():
+        for _ in range(4):
+            await endpoints.chat.completions.create(model="gpt")
+
+    asyncio.run(scenario())
+    assert failing.state == CIRCUIT_OPEN
+    # Skipped once open: the remaining calls go straight to the healthy endpoint
+    assert broken.calls == 2
+    assert healthy.calls == 4
+
+
+def test_all_circuits_open_tries_the_endpoint_closest_to_its_probe():
+    first, second = FakeClient("first"), FakeClient("second")
+    later, sooner = endpoint(first), endpoint(second)
+    endpoints = pool(later, sooner, hedge_enabled=False)
+    now = time.monotonic()
+    for opened, open_until in ((later, now + 60), (sooner, now + 30)):
+        opened.state = CIRCUIT_OPEN
+        opened.open_until = open_until
+
+    assert endpoints._candidates(KIND_COMPLETE) == [sooner, later]
+    assert asyncio.run(endpoints.chat.completions.create(model="gpt")) == "second:gpt"
+    assert sooner.state == CIRCUIT_CLOSED
+    assert later.state == CIRCUIT_OPEN
+
+
+def test_all_endpoints_throttled_raises_the_last_error():
+    endpoints = pool(
+        endpoint(FakeClient("a", fail_with=429)),
+        endpoint(FakeClient("b", fail_with=429)),
+        hedge_enabled=False
+    )
+    with pytest.raises(StatusError) as raised:
+        asyncio.run(endpoints.chat.completions.create(model="gpt"))
+    assert raised.value.status_code == 429
+
+
+def test_embeddings_fail_over_and_track_health():
+    broken, healthy = FakeClient("broken", fail_with=503), FakeClient("healthy")
+    failing, working = endpoint(broken), endpoint(healthy, weight=1e-9)
+    endpoints = pool(failing, working)
+    assert asyncio.run(endpoints.embeddings.create(model="ada", input=["x"])) == "healthy:embedding"
+    assert endpoints.failovers == 1
+    assert failing.failures == 1
+    assert working.latency[KIND_EMBEDDING].samples
@@ -0,0 +1,129 @@
+import asyncio
+import time
+
+import pytest
+
+from app.services.retrieval.base import RetrievedDocument, Retriever
+from app.services.retrieval.fanout import FanOutIndex, FanOutRetriever, reciprocal_rank_fusion
+
+
+def doc(doc_id, filepath=None):
+    return RetrievedDocument(id=doc_id, content=f"content of {doc_id}", filepath=filepath or f"{doc_id}.md")
+
+
+class FakeRetriever(Retriever):
+    """Index stand-in answering fixed documents after a delay, or failing"""
+
+    def __init__(self, documents=(), delay=0.0, error=None):
+        super().__init__()
+        self.documents = list(documents)
+        self.delay = delay
+        self.error = error
+        self.cancelled = False
+        self.closed = False
+        self.asked = []
+
+    async def _retrieve(self, query, top_k):
+        self.asked.append(top_k)
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.error is not None:
+            raise self.error
+        return self.documents[:top_k]
+
+    async def close(self):
+        self.closed = True
+
+
+def fanout(*indexes, **kwargs):
+    return FanOutRetriever(
+        [FanOutIndex(name, retriever, timeout_ms=kwargs.pop(f"{name}_timeout_ms", 1000)) for name, retriever in indexes],
+        **kwargs
+    )
+
+
+def test_rrf_scores_by_rank_and_merges_duplicates():
+    merged = reciprocal_rank_fusion(
+        [("hr", 1.0, [doc("a"), doc("b")]), ("it", 1.0, [doc("b"), doc("c")])],
+        k=60
+    )
+    assert [document.id for document in merged] == ["b", "a", "c"]
+    assert merged[0].score == pytest.approx(1 / 62 + 1 / 61)
+    assert merged[0].metadata["indexes"] == ["hr", "it"]
+    assert merged[1].score == pytest.approx(1 / 61)
+
+
+def test_rrf_weights_and_document_identity():
+    # The same chunk id in two different files is two documents
+    merged = reciprocal_rank_fusion(
+        [("hr", 1.0, [doc("1", "hr.md")]), ("it", 2.0, [doc("1", "it.md")])],
+        k=60
+    )
+    assert [document.filepath for document in merged] == ["it.md", "hr.md"]
+    assert merged[0].score == pytest.approx(2 / 61)
+
+
+def test_fanout_merges_every_index():
+    retriever = fanout(
+        ("hr", FakeRetriever([doc("a"), doc("b")])),
+        ("it", FakeRetriever([doc("b"), doc("c")]))
+    )
+    documents = asyncio.run(retriever.retrieve("question", top_k=2))
+    assert [document.id for document in documents] == ["b", "a"]
+    assert retriever.stats.partial == 0
+    assert retriever.stats.indexes["hr"].answered == retriever.stats.indexes["it"].answered == 1
+
+
+def test_budget_drops_and_cancels_slow_indexes():
+    slow = FakeRetriever([doc("late")], delay=5)
+    retriever = fanout(("fast", FakeRetriever([doc("a")])), ("slow", slow), latency_budget_ms=50)
+
+    async def scenario():
+        started = time.monotonic()
+        documents = await retriever.retrieve("question")
+        await asyncio.sleep(0)
+        return documents, time.monotonic() - started
+
+    documents, elapsed = asyncio.run(scenario())
+    assert [document.id for document in documents] == ["a"]
+    assert elapsed < 1
+    assert slow.cancelled
+    assert retriever.stats.partial == 1
+    assert retriever.stats.indexes["slow"].dropped == 1
+    assert retriever.stats.indexes["fast"].dropped == 0
+
+
+def test_index_timeout_and_error_return_no_results():
+    retriever = fanout(
+        ("ok", FakeRetriever([doc("a")])),
+        ("slow", FakeRetriever([doc("late")], delay=5)),
+        ("broken", FakeRetriever(error=RuntimeError("index down"))),
+        slow_timeout_ms=20,
+        latency_budget_ms=0
+    )
+    documents = asyncio.run(retriever.retrieve("question"))
+    assert [document.id for document in documents] == ["a"]
+    indexes = retriever.stats.indexes
+    assert indexes["slow"].timeouts == 1
+    assert indexes["broken"].errors == 1
+    # Timeouts and errors are not budget drops
+    assert retriever.stats.partial == 0
+    assert retriever.stats.as_dict()["indexes"]["ok"]["calls"] == 1
+
+
+def test_every_index_is_asked_for_the_candidates():
+    index = FakeRetriever([doc(str(number)) for number in range(20)])
+    retriever = fanout(("hr", index), candidates=8)
+    assert len(asyncio.run(retriever.retrieve("question", top_k=3))) == 3
+    assert len(asyncio.run(retriever.retrieve("question", top_k=12))) == 12
+    assert index.asked == [8, 12]
+
+
+def test_close_closes_every_index():
+    indexes = [FakeRetriever(), FakeRetriever()]
+    retriever = fanout(("hr", indexes[0]), ("it", indexes[1]))
+    asyncio.run(retriever.close())
+    assert all(index.closed for index in indexes)
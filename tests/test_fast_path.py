@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+from app.fast_path import MAX_COUNTED_TYPES, ActivityFastPath
+
+BOT = {"id": "28:bot"}
+
+
+def conversation_update(*member_ids):
+    return {
+        "type": "conversationUpdate",
+        "recipient": BOT,
+        "membersAdded": [{"id": member_id} for member_id in member_ids]
+    }
+
+
+@pytest.mark.parametrize("body, wanted", [
+    ({"type": "message"}, True),
+    ({"type": "invoke"}, True),
+    ({"type": "typing"}, False),
+    ({"type": "messageReaction"}, False),
+    ({"type": "installationUpdate"}, False),
+    (conversation_update("29:user"), True),
+    (conversation_update(BOT["id"], "29:user"), True),
+    (conversation_update(BOT["id"]), False),
+    (conversation_update(), False),
+    ({"type": "conversationUpdate", "membersRemoved": [{"id": "29:user"}]}, False),
+    ({"type": "conversationUpdate", "membersAdded": None}, False),
+])
+def test_wanted(body, wanted):
+    assert ActivityFastPath()._wanted(body, body["type"]) is wanted
+
+
+def test_disabled_fast_path_wants_everything():
+    assert ActivityFastPath(enabled=False)._wanted({"type": "typing"}, "typing")
+
+
+def test_custom_handled_types():
+    fast_path = ActivityFastPath(handled_types={"message", "typing"})
+    assert fast_path._wanted({"type": "typing"}, "typing")
+    assert not fast_path._wanted({"type": "invoke"}, "invoke")
+
+
+def test_parse_skips_unwanted_activities_without_deserializing():
+    fast_path = ActivityFastPath()
+    body, activity = fast_path.parse(json.dumps({"type": "typing", "id": "1"}).encode())
+    assert body["id"] == "1" and activity is None
+    body, activity = fast_path.parse(json.dumps({"type": "message", "id": "2", "text": "hola"}).encode())
+    assert activity.text == "hola"
+    stats = fast_path.stats()
+    assert stats["received"] == {"typing": 1, "message": 1}
+    assert stats["handled"] == {"message": 1}
+    assert stats["skipped"] == 1
+
+
+@pytest.mark.parametrize("raw", [b"[]", b"{}", b"null"])
+def test_parse_rejects_bodies_that_are_not_activities(raw):
+    with pytest.raises(ValueError):
+        ActivityFastPath().parse(raw)
+
+
+def test_unknown_types_are_counted_under_other_past_the_limit():
+    fast_path = ActivityFastPath()
+    for number in range(MAX_COUNTED_TYPES + 3):
+        fast_path.parse(json.dumps({"type": f"custom{number}"}).encode())
+    assert len(fast_path.received) == MAX_COUNTED_TYPES + 1
+    assert fast_path.received["other"] == 3
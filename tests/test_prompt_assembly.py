@@ -0,0 +1,140 @@
+import asyncio
+
+from app.models.chat_models import ChatMessage
+from app.services.prompt_assembly import (
+    MESSAGE_OVERHEAD,
+    SOURCE_OVERHEAD,
+    SOURCES_HEADER,
+    SUMMARY_PREFIX,
+    PromptAssembler,
+    Tokenizer
+)
+from app.services.retrieval.base import RetrievedDocument
+
+# Character estimate (len // 4 + 1): counts do not depend on a tiktoken download
+tokenizer = Tokenizer("")
+DOCUMENT_TOKENS = tokenizer.count("x" * 400)
+DOCUMENT_COST = DOCUMENT_TOKENS + tokenizer.count("d1") + SOURCE_OVERHEAD
+HEADER_TOKENS = tokenizer.count(SOURCES_HEADER)
+
+
+def documents(count):
+    return [RetrievedDocument(id=f"d{number}", content="x" * 400, title=f"d{number}") for number in range(1, count + 1)]
+
+
+def conversation(turns):
+    return [
+        ChatMessage(role="user" if number % 2 == 0 else "assistant", content=f"Turno {number}. " + "palabra " * 20)
+        for number in range(turns)
+    ]
+
+
+def assembler(**kwargs):
+    return PromptAssembler(Tokenizer(""), **kwargs)
+
+
+def test_tokenizer_caches_counts_and_truncates_within_the_limit():
+    counter = Tokenizer("")
+    text = "palabra " * 100
+    assert counter.count(text) == counter.count(text) == len(text) // 4 + 1
+    assert counter.stats()["hit_ratio"] == 0.5
+    assert counter.count(counter.truncate(text, 10)) <= 10
+    assert counter.truncate("corto", 10) == "corto"
+    assert counter.truncate(text, 0) == ""
+
+
+def test_documents_fit_in_rank_order_and_the_last_one_is_truncated():
+    budget = HEADER_TOKENS + 2 * DOCUMENT_COST + 60 + (DOCUMENT_COST - DOCUMENT_TOKENS)
+    prompt_assembler = assembler(documents_budget=budget)
+    prompt = asyncio.run(prompt_assembler.assemble("Sistema", "Pregunta", documents=documents(4)))
+    assert [document.id for document in prompt.documents] == ["d1", "d2", "d3"]
+    assert prompt.documents[2].content != "x" * 400
+    assert tokenizer.count(prompt.documents[2].content) <= 60
+    assert prompt_assembler.truncated_documents == 1
+    assert "[doc3] d3" in prompt.messages[0]["content"]
+
+
+def test_document_left_too_small_is_dropped():
+    budget = HEADER_TOKENS + DOCUMENT_COST + 20
+    prompt = asyncio.run(assembler(documents_budget=budget).assemble("Sistema", "Pregunta", documents=documents(2)))
+    assert [document.id for document in prompt.documents] == ["d1"]
+
+
+def test_custom_format_sources():
+    prompt = asyncio.run(assembler().assemble(
+        "Sistema",
+        "Pregunta",
+        documents=documents(2),
+        format_sources=lambda kept: " | ".join(document.id for document in kept)
+    ))
+    assert prompt.messages[0]["content"] == "Sistema\n\nd1 | d2"
+
+
+def test_history_is_filled_newest_first_within_its_budget():
+    history = conversation(10)
+    turn_tokens = tokenizer.count(history[-1].content) + MESSAGE_OVERHEAD
+    prompt_assembler = assembler(history_budget=3 * turn_tokens + 1)
+    prompt = asyncio.run(prompt_assembler.assemble("Sistema", "Pregunta", history=history))
+    assert prompt.history_turns == 3
+    assert prompt.dropped_turns == 7
+    assert [message["content"] for message in prompt.messages[1:-1]] == [turn.content for turn in history[-3:]]
+    assert prompt.messages[-1] == {"role": "user", "content": "Pregunta"}
+    assert prompt.tokens["history"] <= 3 * turn_tokens + 1
+    assert prompt_assembler.stats()["dropped_turns"] == 7
+
+
+def test_on_your_data_reserves_the_documents_budget():
+    history = conversation(40)
+    prompt_assembler = assembler(context_window=2000, answer_reserve=500, documents_budget=1000, history_budget=5000)
+    prompt = asyncio.run(prompt_assembler.assemble("Sistema", "Pregunta", history=history))
+    assert prompt.documents is None
+    assert prompt.tokens["documents"] == 0
+    # Only what the answer and the injected chunks leave is used
+    assert prompt.total_tokens <= 2000 - 500 - 1000
+
+
+def test_total_stays_within_the_context_window():
+    prompt_assembler = assembler(context_window=1500, answer_reserve=300, documents_budget=5000, history_budget=5000)
+    prompt = asyncio.run(prompt_assembler.assemble(
+        "Sistema " * 50,
+        "Pregunta",
+        history=conversation(60),
+        documents=documents(20)
+    ))
+    assert prompt.total_tokens <= 1500 - 300
+    assert prompt.history_turns > 0
+    assert prompt_assembler.stats()["max_total_tokens"] == prompt.total_tokens
+
+
+def test_extractive_summary_covers_dropped_turns_and_is_reused():
+    turn_tokens = tokenizer.count(conversation(1)[0].content) + MESSAGE_OVERHEAD
+    prompt_assembler = assembler(history_budget=200 + 4 * turn_tokens, summary_mode="extractive", summary_max_tokens=150)
+    history = conversation(12)
+    prompt = asyncio.run(prompt_assembler.assemble("Sistema", "Pregunta", history=history, conversation_id="c1"))
+    summary = prompt.messages[1]["content"]
+    assert summary.startswith(SUMMARY_PREFIX)
+    assert "- User: Turno 0." in summary
+    assert prompt.tokens["summary"] <= 150 + MESSAGE_OVERHEAD + tokenizer.count(SUMMARY_PREFIX)
+    assert prompt_assembler.summaries_built == 1
+
+    # Same history again: the stored summary already covers the dropped turns
+    asyncio.run(prompt_assembler.assemble("Sistema", "Pregunta", history=history, conversation_id="c1"))
+    assert prompt_assembler.summaries_built == 1
+    # Two more turns push more turns out of the window: only those are summarized
+    prompt = asyncio.run(prompt_assembler.assemble("Sistema", "Pregunta", history=conversation(14), conversation_id="c1"))
+    assert prompt_assembler.summaries_built == 2
+    assert summary[len(SUMMARY_PREFIX):] in prompt.messages[1]["content"]
+
+
+def test_model_summary_falls_back_to_extractive_on_failure():
+    async def summarize(previous, turns, max_tokens):
+        raise RuntimeError("model unavailable")
+
+    prompt_assembler = assembler(history_budget=100, summary_mode="model", summarize=summarize)
+    prompt = asyncio.run(prompt_assembler.assemble("Sistema", "Pregunta", history=conversation(10)))
+    assert prompt.messages[1]["content"].startswith(SUMMARY_PREFIX + "- User: Turno 0.")
+
+
+def test_model_summary_mode_without_a_summarizer_is_extractive():
+    assert assembler(summary_mode="model").summary_mode == "extractive"
+    assert assembler(summary_mode="unknown").summary_mode == "off"
@@ -0,0 +1,182 @@
+import asyncio
+
+import pytest
+
+from app.services.state_storage import CachedStorage, SQLiteStorage
+
+
+class FakeBackend:
+    """Durable storage that records batches and can fail the next ones"""
+
+    def __init__(self, failures=0):
+        self.items = {}
+        self.batches = []
+        self.reads = 0
+        self.failures = failures
+
+    async def read(self, keys):
+        self.reads += 1
+        return {key: dict(self.items[key][1], e_tag=self.items[key][0]) for key in keys if key in self.items}
+
+    async def write_batch(self, batch):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("storage unavailable")
+        self.batches.append(batch)
+        conflicts = []
+        for key, item, expected, etag in batch:
+            if self.items.get(key, (None,))[0] != expected:
+                conflicts.append(key)
+            else:
+                self.items[key] = (etag, {k: v for k, v in item.items() if k != "e_tag"})
+        return conflicts
+
+    async def delete(self, keys):
+        for key in keys:
+            self.items.pop(key, None)
+
+    async def close(self):
+        pass
+
+    def stats(self):
+        return {"backend": "fake"}
+
+
+def cached(backend, **kwargs):
+    # A long interval: the tests flush explicitly
+    return CachedStorage(backend, flush_interval=60, **kwargs)
+
+
+def test_write_with_stale_etag_raises():
+    async def scenario():
+        storage = cached(FakeBackend())
+        await storage.write({"k": {"count": 1}})
+        first = await storage.read(["k"])
+        await storage.write({"k": {"count": 2, "e_tag": first["k"]["e_tag"]}})
+        with pytest.raises(KeyError):
+            await storage.write({"k": {"count": 3, "e_tag": first["k"]["e_tag"]}})
+        await storage.close()
+
+    asyncio.run(scenario())
+
+
+def test_writes_are_flushed_together():
+    async def scenario():
+        backend = FakeBackend()
+        storage = cached(backend)
+        await storage.write({"a": {"v": 1}})
+        await storage.write({"b": {"v": 2}})
+        await storage.write({"a": {"v": 3, "e_tag": "*"}})
+        assert backend.batches == []
+        assert await storage.flush() == 2
+        await storage.close()
+        return backend
+
+    backend = asyncio.run(scenario())
+    assert len(backend.batches) == 1
+    assert {key: item["v"] for key, (_, item) in backend.items.items()} == {"a": 3, "b": 2}
+
+
+def test_failed_flush_keeps_items_dirty_for_retry():
+    async def scenario():
+        backend = FakeBackend(failures=1)
+        storage = cached(backend)
+        await storage.write({"k": {"v": 1}})
+        with pytest.raises(ConnectionError):
+            await storage.flush()
+        assert storage.stats()["dirty_items"] == 1
+        assert await storage.flush() == 1
+        await storage.close()
+        return backend
+
+    backend = asyncio.run(scenario())
+    assert backend.items["k"][1] == {"v": 1}
+
+
+def test_flush_conflict_drops_the_write_and_reads_again():
+    async def scenario():
+        backend = FakeBackend()
+        backend.items["k"] = ("ours", {"v": 1})
+        storage = cached(backend)
+        item = (await storage.read(["k"]))["k"]
+        # Another replica writes after our read
+        backend.items["k"] = ("theirs", {"v": 2})
+        await storage.write({"k": dict(item, v=3)})
+        assert await storage.flush() == 0
+        reads = backend.reads
+        again = await storage.read(["k"])
+        assert backend.reads == reads + 1
+        assert storage.stats()["conflicts"] == 1
+        await storage.close()
+        return again["k"]
+
+    assert asyncio.run(scenario()) == {"v": 2, "e_tag": "theirs"}
+
+
+def test_clean_items_are_read_again_after_ttl():
+    async def scenario():
+        backend = FakeBackend()
+        backend.items["k"] = ("first", {"v": 1})
+        storage = cached(backend, ttl_seconds=60)
+        await storage.read(["k"])
+        await storage.read(["k"])
+        assert backend.reads == 1
+        backend.items["k"] = ("second", {"v": 2})
+        storage._items["k"].loaded_at -= 61
+        item = (await storage.read(["k"]))["k"]
+        assert backend.reads == 2
+        await storage.close()
+        return item
+
+    assert asyncio.run(scenario()) == {"v": 2, "e_tag": "second"}
+
+
+def test_dirty_items_are_not_read_again_after_ttl():
+    async def scenario():
+        backend = FakeBackend()
+        storage = cached(backend, ttl_seconds=60)
+        await storage.write({"k": {"v": 1}})
+        storage._items["k"].loaded_at -= 61
+        item = (await storage.read(["k"]))["k"]
+        await storage.close()
+        return backend.reads, item["v"]
+
+    # Only the read that found the key absent before the first write
+    assert asyncio.run(scenario()) == (1, 1)
+
+
+def test_sqlite_write_batch_lets_one_of_two_racing_writers_win(tmp_path):
+    async def scenario():
+        path = str(tmp_path / "state.db")
+        first, second = SQLiteStorage(path), SQLiteStorage(path)
+        await first.write({"k": {"v": 0}})
+        etag = (await first.read(["k"]))["k"]["e_tag"]
+        # Both writers read the same etag and write concurrently
+        results = await asyncio.gather(
+            first.write_batch([("k", {"v": 1}, etag, "one"), ("new", {"v": 1}, None, "one")]),
+            second.write_batch([("k", {"v": 2}, etag, "two"), ("new", {"v": 2}, None, "two")])
+        )
+        stored = await second.read(["k", "new"])
+        stats = first.stats(), second.stats()
+        await first.close()
+        await second.close()
+        return results, stored, stats
+
+    results, stored, stats = asyncio.run(scenario())
+    assert sorted(map(sorted, results)) == [[], ["k", "new"]]
+    winner = "one" if results[0] == [] else "two"
+    assert stored["k"]["e_tag"] == stored["new"]["e_tag"] == winner
+    assert stats[1]["items"] == 2
+
+
+def test_sqlite_write_with_stale_etag_raises(tmp_path):
+    async def scenario():
+        storage = SQLiteStorage(str(tmp_path / "state.db"))
+        await storage.write({"k": {"v": 0}})
+        stale = (await storage.read(["k"]))["k"]
+        await storage.write({"k": dict(stale, v=1)})
+        with pytest.raises(KeyError):
+            await storage.write({"k": dict(stale, v=2)})
+        await storage.close()
+
+    asyncio.run(scenario())